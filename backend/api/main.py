@@ -5,8 +5,14 @@ Handles:
 - Redis
 - MongoDB
 - Cohere
+- MQTT telemetry consumer (optional, MQTT_CONSUMER_ENABLED)
+- Presence window sweeper (PRESENCE_SWEEPER_ENABLED)
+- RabbitMQ user activity consumer (optional, RABBITMQ_CONSUMER_ENABLED)
+- Redis Streams ingest workers (optional, INGEST_STREAM_CONSUMER_ENABLED)
+- Syslog log collector and access log tailer (optional, LOG_SYSLOG_ENABLED / LOG_TAIL_ENABLED)
 """
 
+import asyncio
 from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
@@ -15,7 +21,7 @@ from loguru import logger
 import sys
 
 from api.core.config import settings
-from api.services.redis_client import close_redis
+from api.services.redis_client import get_redis, close_redis
 from api.services.mongo_client import close_mongo
 from api.routers.sre import router as sre_router
 
@@ -31,8 +37,96 @@ async def lifespan(app: FastAPI):
         logger.error(f"Key Vault failed: {e}")
 
     app.state.settings = settings
+
+    if settings.REDIS_LUA_INGEST:
+        try:
+            from api.services.redis_scripts import load_scripts
+            await load_scripts(await get_redis())
+            logger.info("Redis ingest scripts loaded")
+        except Exception as e:
+            # Scripts are loaded lazily on first ingest as well
+            logger.warning(f"Redis ingest script preload failed: {e}")
+
+    if settings.IMAGE_INDEX_ENABLED:
+        try:
+            from api.services.image_service import ensure_indexes
+            # bounded: an unreachable Mongo must not hold up startup for the driver's 30s timeout
+            await asyncio.wait_for(ensure_indexes(), timeout=10)
+        except Exception as e:
+            # The image index refresh still works, with a collection scan per refresh
+            logger.warning(f"Mongo index creation for image embeddings failed: {e}")
+
+    if settings.LOG_COUNTS_MIGRATE_ON_STARTUP:
+        try:
+            from api.services.log_service import migrate_hash_counts
+            migrated = await migrate_hash_counts()
+            if migrated:
+                logger.info(f"Migrated legacy log IP count hashes into sorted sets: {migrated}")
+        except Exception as e:
+            logger.warning(f"Log IP count migration failed (will retry next start): {e}")
+
+    app.state.presence_sweeper = None
+    if settings.PRESENCE_SWEEPER_ENABLED:
+        from api.workers.presence_sweeper import PresenceSweeper
+        app.state.presence_sweeper = PresenceSweeper()
+        await app.state.presence_sweeper.start()
+
+    app.state.mqtt_consumer = None
+    if settings.MQTT_CONSUMER_ENABLED:
+        from api.workers.mqtt_consumer import MqttTelemetryConsumer
+        app.state.mqtt_consumer = MqttTelemetryConsumer()
+        await app.state.mqtt_consumer.start()
+
+    app.state.rabbitmq_consumer = None
+    if settings.RABBITMQ_CONSUMER_ENABLED:
+        from api.workers.rabbitmq_consumer import RabbitUserActivityConsumer
+        app.state.rabbitmq_consumer = RabbitUserActivityConsumer()
+        try:
+            await app.state.rabbitmq_consumer.start()
+        except Exception as e:
+            logger.error(f"RabbitMQ consumer failed to start: {e}")
+            app.state.rabbitmq_consumer = None
+
+    app.state.stream_workers = None
+    if settings.INGEST_STREAM_CONSUMER_ENABLED:
+        from api.workers.stream_consumer import StreamIngestWorkers
+        app.state.stream_workers = StreamIngestWorkers()
+        await app.state.stream_workers.start()
+    elif settings.INGEST_VIA_STREAM:
+        logger.warning("INGEST_VIA_STREAM is on without local stream workers; run api.workers.stream_consumer")
+
+    app.state.syslog_collector = None
+    if settings.LOG_SYSLOG_ENABLED:
+        from api.workers.syslog_collector import SyslogCollector
+        app.state.syslog_collector = SyslogCollector()
+        try:
+            await app.state.syslog_collector.start()
+        except OSError as e:
+            logger.error(f"Syslog collector failed to bind: {e}")
+            app.state.syslog_collector = None
+
+    app.state.log_tailer = None
+    if settings.LOG_TAIL_ENABLED:
+        from api.workers.log_tailer import LogFileTailer
+        app.state.log_tailer = LogFileTailer()
+        await app.state.log_tailer.start()
+
     yield
 
+    from api.services.live_updates import stop_feeds
+    await stop_feeds()
+    if app.state.log_tailer is not None:
+        await app.state.log_tailer.stop()
+    if app.state.syslog_collector is not None:
+        await app.state.syslog_collector.stop()
+    if app.state.stream_workers is not None:
+        await app.state.stream_workers.stop()
+    if app.state.rabbitmq_consumer is not None:
+        await app.state.rabbitmq_consumer.stop()
+    if app.state.mqtt_consumer is not None:
+        await app.state.mqtt_consumer.stop()
+    if app.state.presence_sweeper is not None:
+        await app.state.presence_sweeper.stop()
     await close_redis()
     await close_mongo()
     logger.info("🛑 Shutdown complete.")
@@ -1,4 +1,4 @@
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, FiniteFloat
 from typing import Any, Dict, List, Optional
 from datetime import datetime
 
@@ -7,15 +7,20 @@ class TelemetryEvent(BaseModel):
     device_type: str
     device_id: str
     timestamp: datetime = Field(default_factory=datetime.utcnow)
-    metrics: Optional[Dict[str, float]] = None
+    metrics: Optional[Dict[str, FiniteFloat]] = None   # NaN/inf rejected: HINCRBYFLOAT refuses them
+
+class TelemetryBatch(BaseModel):
+    """Batch of raw telemetry events; each event is validated individually"""
+    events: List[Dict[str, Any]]
 
 class UserMetric(BaseModel):
     site_id: str
     session_id: str
     user_id: str
-    latency_ms: Optional[float] = None
-    cpu_pct: Optional[float] = None
-    mem_pct: Optional[float] = None
+    role: Optional[str] = None
+    latency_ms: Optional[FiniteFloat] = None
+    cpu_pct: Optional[FiniteFloat] = None
+    mem_pct: Optional[FiniteFloat] = None
     timestamp: datetime = Field(default_factory=datetime.utcnow)
 
 class ImageEmbedding(BaseModel):
@@ -26,10 +31,12 @@ class ImageEmbedding(BaseModel):
 class ImageSearchRequest(BaseModel):
     query_embedding: List[float]
     top_k: int = 5
+    nprobe: Optional[int] = None      # IVF engine only: overrides IMAGE_IVF_NPROBE for this query
 
 class TopIPsQuery(BaseModel):
-    status_code: str = "400"
+    status_code: str = "400"          # a status ("404") or a class ("4xx")
     top_n: int = 10
+    window_sec: Optional[int] = None  # last N seconds only (per-minute buckets); None = all time
 
 class ImageDescriptionRequest(BaseModel):
     """Request to generate embedding for an image description"""
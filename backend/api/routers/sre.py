@@ -1,12 +1,16 @@
-from fastapi import APIRouter, HTTPException, Request
+from fastapi import APIRouter, HTTPException, Query, Request
+from fastapi.responses import StreamingResponse
 from typing import Dict, Any
+import time
 from loguru import logger
+import orjson
 from api.models.schemas import (
-    TelemetryEvent, UserMetric, ImageSearchRequest, TopIPsQuery, ImageEmbedding,
+    TelemetryEvent, TelemetryBatch, UserMetric, ImageSearchRequest, TopIPsQuery, ImageEmbedding,
     ImageDescriptionRequest, NaturalLanguageSearchRequest, ChatWithImagesRequest,
     SafetyAnalysisRequest
 )
-from api.services import telemetry_service, user_service, image_service, log_service, cohere_service
+from api.services import telemetry_service, user_service, image_service, log_service, log_templates, cohere_service, rollup_service, distinct_service, ingest_stream, live_updates
+from api.services.response_cache import response_cache
 from api.core.keyvault import is_key_vault_available
 
 router = APIRouter(prefix="/sre", tags=["sre"])
@@ -45,9 +49,16 @@ async def get_system_status(request: Request):
     - Azure Key Vault
     - MQTT broker
     - RabbitMQ broker
+
+    Cached for CACHE_TTL_STATUS_SEC; concurrent callers share one probe run.
     """
     settings = request.app.state.settings
+    return await response_cache.get_or_compute(
+        ("status",), settings.CACHE_TTL_STATUS_SEC, lambda: _probe_system_status(settings)
+    )
+
 
+async def _probe_system_status(settings) -> Dict[str, Any]:
     # Check Key Vault availability
     kv_available = is_key_vault_available()
 
@@ -122,18 +133,171 @@ async def get_system_status(request: Request):
     }
 
 
+@router.get("/live/active-devices")
+async def live_active_devices(site_id: str | None = None):
+    """
+    Server-Sent Events: a snapshot, then per-tick deltas (LIVE_TICK_SEC).
+    With site_id: joined/left device keys and the count; without: changed site counts.
+    """
+    return StreamingResponse(
+        live_updates.sse_stream("devices", site_id),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@router.get("/live/active-users")
+async def live_active_users(site_id: str | None = None):
+    """Same as /live/active-devices for user sessions."""
+    return StreamingResponse(
+        live_updates.sse_stream("users", site_id),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@router.get("/live/metrics")
+async def live_metrics():
+    """Live feed tick cost, subscribers and dropped (too slow) subscribers."""
+    return {kind: feed.metrics() for kind, feed in live_updates.feeds.items()}
+
+@router.get("/cache/stats")
+async def cache_stats():
+    """Dashboard response cache hit/miss/coalesced counters."""
+    return response_cache.metrics()
+
+
 # ============================================================================
 # DEVICE TELEMETRY ENDPOINTS
 # ============================================================================
 
 @router.post("/devices/ingest")
-async def ingest_device(evt: TelemetryEvent) -> Dict[str, Any]:
+async def ingest_device(evt: TelemetryEvent, request: Request) -> Dict[str, Any]:
+    if request.app.state.settings.INGEST_VIA_STREAM:
+        # applied asynchronously by the stream consumer workers
+        return {"ok": True, "queued": await ingest_stream.enqueue("telemetry", evt)}
     await telemetry_service.ingest_telemetry(evt)
     return {"ok": True}
 
+@router.post("/devices/ingest-batch")
+async def ingest_device_batch(batch: TelemetryBatch, request: Request) -> Dict[str, Any]:
+    """
+    Ingest many telemetry events in one request (single pipelined Redis round trip).
+    Returns per-event accept/reject counts; rejected events carry their index.
+    """
+    max_events = request.app.state.settings.TELEMETRY_BATCH_MAX_EVENTS
+    if len(batch.events) > max_events:
+        raise HTTPException(status_code=413, detail=f"Batch exceeds {max_events} events")
+    return await telemetry_service.ingest_telemetry_batch(batch.events)
+
+@router.get("/ingest/mqtt-metrics")
+async def mqtt_consumer_metrics(request: Request) -> Dict[str, Any]:
+    """
+    MQTT consumer health: lag, batch size, flush latency, drops.
+    """
+    consumer = request.app.state.mqtt_consumer
+    if consumer is None:
+        return {"running": False}
+    return {"running": True, **consumer.metrics()}
+
+@router.get("/ingest/rabbitmq-metrics")
+async def rabbitmq_consumer_metrics(request: Request) -> Dict[str, Any]:
+    """
+    RabbitMQ user_activity consumer health: msgs/sec, batch size, acks, requeues.
+    """
+    consumer = request.app.state.rabbitmq_consumer
+    if consumer is None:
+        return {"running": False}
+    return {"running": True, **consumer.metrics()}
+
+@router.get("/ingest/sweeper-metrics")
+async def presence_sweeper_metrics(request: Request) -> Dict[str, Any]:
+    """
+    Presence sweeper health: ticks, trimmed members, orphan hashes deleted.
+    """
+    sweeper = request.app.state.presence_sweeper
+    if sweeper is None:
+        return {"running": False}
+    return {"running": True, **sweeper.metrics()}
+
+@router.get("/ingest/stream-metrics")
+async def stream_ingest_metrics(request: Request) -> Dict[str, Any]:
+    """
+    Stream ingest backlog (shared across processes) and this process's workers.
+    """
+    workers = request.app.state.stream_workers
+    return {
+        "streams": await ingest_stream.stream_lag(),
+        "workers": {"running": True, **workers.metrics()} if workers is not None else {"running": False},
+    }
+
 @router.get("/active-devices")
-async def get_active_devices(site_id: str | None = None, limit: int = 20):
-    return await telemetry_service.get_active_devices(site_id=site_id, limit=limit)
+async def get_active_devices(request: Request, site_id: str | None = None, limit: int = 20, counts_only: bool = False):
+    return await response_cache.get_or_compute(
+        ("active-devices", site_id, limit, counts_only),
+        request.app.state.settings.CACHE_TTL_ACTIVE_DEVICES_SEC,
+        lambda: telemetry_service.get_active_devices(site_id=site_id, limit=limit, counts_only=counts_only),
+    )
+
+
+@router.get("/active-devices/page")
+async def get_active_devices_page(
+    site_id: str,
+    device_type: str | None = None,
+    limit: int = Query(default=100, ge=1, le=1000),
+    cursor: str | None = None,
+):
+    """
+    Cursor-paginated active devices of one site, newest first.
+    Pass next_cursor back as cursor until it is null.
+    """
+    try:
+        return await telemetry_service.get_active_devices_page(site_id, device_type, limit, cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@router.get("/active-devices/stream")
+async def stream_active_devices(
+    site_id: str,
+    device_type: str | None = None,
+    page_size: int = Query(default=500, ge=1, le=1000),
+):
+    """
+    Every active device of a site as NDJSON, fetched page by page.
+    """
+    async def lines():
+        async for device in telemetry_service.iter_active_devices(site_id, device_type, page_size):
+            yield orjson.dumps(device) + b"\n"
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+
+@router.get("/devices/distinct")
+async def distinct_devices(site_id: str | None = None, window_sec: int = 3600):
+    """
+    Approximate unique devices seen in the last window_sec (HyperLogLog, ~0.81%
+    standard error), per site or across every site active in the window.
+    """
+    try:
+        return await distinct_service.count_distinct_devices(site_id, window_sec)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@router.get("/metrics/rollups")
+async def metric_rollups(
+    site_id: str,
+    device_type: str,
+    metric: str | None = None,
+    start: int | None = None,
+    end: int | None = None,
+    resolution: str = "auto",
+):
+    """
+    Min/max/avg/count time series per site and device type (epoch-second range).
+    Served from per-minute / per-hour rollup buckets, not per-device state.
+    """
+    try:
+        return await rollup_service.get_rollups(site_id, device_type, metric, start, end, resolution)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
 
 # ============================================================================
@@ -141,13 +305,38 @@ async def get_active_devices(site_id: str | None = None, limit: int = 20):
 # ============================================================================
 
 @router.post("/users/ingest")
-async def ingest_user(m: UserMetric):
+async def ingest_user(m: UserMetric, request: Request):
+    if request.app.state.settings.INGEST_VIA_STREAM:
+        return {"ok": True, "queued": await ingest_stream.enqueue("users", m)}
     await user_service.ingest_user_metric(m)
     return {"ok": True}
 
 @router.get("/active-users")
-async def active_users(site_id: str, limit: int = 50):
-    return await user_service.get_active_users(site_id, limit)
+async def active_users(request: Request, site_id: str, limit: int = 50):
+    return await response_cache.get_or_compute(
+        ("active-users", site_id, limit),
+        request.app.state.settings.CACHE_TTL_ACTIVE_USERS_SEC,
+        lambda: user_service.get_active_users(site_id, limit),
+    )
+
+@router.get("/users/breakdown")
+async def user_breakdown():
+    """
+    Active sessions per region and per role from incrementally maintained
+    counters: O(regions + roles), no session scan.
+    """
+    return await user_service.get_active_user_breakdown()
+
+@router.get("/users/latency-percentiles")
+async def user_latency_percentiles(site_id: str | None = None, window_sec: int = 300):
+    """
+    p50/p90/p99 user latency for the last window_sec, per site and across sites.
+    Values carry a relative error bound of USER_LATENCY_SKETCH_ALPHA.
+    """
+    try:
+        return await user_service.get_latency_percentiles(site_id, window_sec)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
 
 # ============================================================================
@@ -161,7 +350,10 @@ async def upsert_image_embedding(body: ImageEmbedding):
 
 @router.post("/images/search")
 async def search_images(body: ImageSearchRequest):
-    results = await image_service.search_similar(body.query_embedding, body.top_k)
+    try:
+        results = await image_service.search_similar(body.query_embedding, body.top_k, body.nprobe)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     return {"results": results}
 
 
@@ -174,9 +366,58 @@ async def ingest_log_line(line: str):
     await log_service.ingest_log_line(line)
     return {"ok": True}
 
+@router.post("/logs/ingest")
+async def ingest_log_stream(request: Request):
+    """
+    Bulk log upload: the raw request body is newline-delimited log lines, plain
+    or gzip (e.g. curl --data-binary @access.log.gz). Streamed and parsed
+    incrementally; returns parsed/rejected line counts and lines/sec.
+    """
+    return await log_service.ingest_log_stream(request.stream())
+
+@router.get("/logs/collector-metrics")
+async def log_collector_metrics(request: Request) -> Dict[str, Any]:
+    """
+    Syslog listener and file tailer health: lines/sec, parse rejects, drops
+    (syslog queue full) and per-file offsets / lag.
+    """
+    out: Dict[str, Any] = {}
+    for name, collector in (("syslog", request.app.state.syslog_collector), ("tail", request.app.state.log_tailer)):
+        out[name] = {"running": False} if collector is None else {"running": True, **collector.metrics()}
+    return out
+
+@router.get("/logs/templates")
+async def log_templates_top(limit: int = Query(30, ge=1, le=500), group: str | None = None, since_sec: int | None = None):
+    """
+    Most frequent log templates (Drain clusters of error and unparseable lines)
+    with counts, examples and first/last-seen times, merged across all workers
+    and collectors. group is a status code or "raw"; since_sec keeps templates
+    seen in the last since_sec seconds. lines/clusters/evicted are this worker's.
+    Compact enough to hand to an LLM diagnosis step as-is.
+    """
+    since = time.time() - since_sec if since_sec else 0.0
+    return {
+        **log_templates.miner.metrics(),
+        "templates": await log_templates.top_templates(limit, group, since),
+    }
+
 @router.post("/logs/top-ips")
 async def top_ips(q: TopIPsQuery):
-    return {"status": q.status_code, "top": await log_service.top_error_ips(q.status_code, q.top_n)}
+    """
+    Top source IPs for a status code or a class such as "5xx" (all 5xx
+    statuses merged in one query). With window_sec, counts only the last
+    window_sec seconds.
+    """
+    if q.window_sec is not None:
+        try:
+            return await log_service.top_ips_window(q.status_code, q.window_sec, q.top_n)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+    result = {"status": q.status_code, "top": await log_service.top_error_ips(q.status_code, q.top_n)}
+    bounds = await log_service.top_error_ips_bounds(q.status_code)
+    if bounds is not None:
+        result["error_bounds"] = bounds
+    return result
 
 
 # ============================================================================
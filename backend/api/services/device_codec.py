@@ -0,0 +1,97 @@
+"""
+Compact binary device snapshots (opt-in via DEVICE_SNAPSHOT_COMPACT).
+
+The regular device:{site|type|id} hash stores site_id/device_type/device_id
+(already encoded in the key) plus one stringified "m:<metric>" field per
+metric. The compact format stores a single field "c" holding:
+
+    u8  schema version
+    u32 last_seen_ts
+    f32 per metric of the device_type schema (NaN = not reported)
+
+Identity fields are rebuilt from the key on read, so decode_snapshot() returns
+exactly the dict shape of the regular format. Device types without a schema,
+or events carrying metrics outside it or beyond float32 range, are written in
+the regular format. Values are stored as float32 (~7 significant digits).
+Writers drop the other format's fields (see _queue_snapshot in
+telemetry_service and TELEMETRY_INGEST_LUA), so toggling
+DEVICE_SNAPSHOT_COMPACT never leaves a stale "c" that reads would prefer.
+"""
+
+import math
+import struct
+from functools import lru_cache
+from typing import Dict, List, Mapping, Optional
+
+COMPACT_FIELD = "c"
+SCHEMA_VERSION = 1
+
+# Metric order per device_type (matches simulators/mqtt_device_simulator.py).
+# Append-only: reordering or removing entries requires a new SCHEMA_VERSION
+# (decode_snapshot reads shorter and longer snapshots of the same version).
+DEVICE_SCHEMAS: Dict[str, List[str]] = {
+    "turbine": ["rpm", "temperature", "vibration", "power_output", "fuel_consumption"],
+    "thermal-engine": ["temperature", "pressure", "efficiency", "coolant_level"],
+    "electrical-rotor": ["voltage", "current", "frequency", "power_factor"],
+    "connected-device": ["battery_level", "signal_strength", "data_transmitted"],
+}
+
+_HEADER = struct.Struct("<BI")
+_STRUCTS = {dtype: struct.Struct("<BI" + "f" * len(names)) for dtype, names in DEVICE_SCHEMAS.items()}
+
+
+@lru_cache(maxsize=None)
+def _values_struct(count: int) -> struct.Struct:
+    return struct.Struct("<" + "f" * count)
+
+
+def encode_snapshot(device_type: str, metrics: Optional[Mapping[str, float]], now: int) -> Optional[bytes]:
+    """Packed snapshot, or None if the event does not fit the device_type schema."""
+    names = DEVICE_SCHEMAS.get(device_type)
+    if names is None:
+        return None
+    metrics = metrics or {}
+    if any(k not in names for k in metrics):
+        return None
+    values = [metrics.get(name, math.nan) for name in names]
+    try:
+        return _STRUCTS[device_type].pack(SCHEMA_VERSION, now, *values)
+    except OverflowError:
+        return None             # |value| beyond float32 range: keep it exact in the regular format
+
+
+def last_seen(packed: bytes) -> int:
+    return _HEADER.unpack_from(packed)[1]
+
+
+def decode_snapshot(member: str, raw: Mapping[bytes, bytes]) -> Dict[str, str]:
+    """
+    Decode a device hash read with a binary (decode_responses=False) client.
+    member is the presence zset member ("site|type|id").
+
+    The metric count comes from the value length, so snapshots written before a
+    metric was appended to the schema (or after, by a newer writer) decode
+    their known prefix. Snapshots of another SCHEMA_VERSION, of a device_type
+    without a schema, or of a malformed length come back with identity and
+    last_seen_ts only instead of raising.
+    """
+    packed = raw.get(COMPACT_FIELD.encode())
+    if packed is None:
+        return {k.decode(): v.decode() for k, v in raw.items()}
+
+    site_id, device_type, device_id = member.split("|", 2)
+    out = {"site_id": site_id, "device_type": device_type, "device_id": device_id}
+    if len(packed) < _HEADER.size:
+        return out
+    version, ts = _HEADER.unpack_from(packed)
+    out["last_seen_ts"] = str(ts)
+    names = DEVICE_SCHEMAS.get(device_type)
+    count, rest = divmod(len(packed) - _HEADER.size, 4)
+    if names is None or version != SCHEMA_VERSION or rest:
+        return out
+    count = min(count, len(names))
+    for name, value in zip(names, _values_struct(count).unpack_from(packed, _HEADER.size)):
+        if not math.isnan(value):
+            out[f"m:{name}"] = str(float(f"{value:.7g}"))
+    return out
+
@@ -0,0 +1,127 @@
+"""
+Fixed-memory heavy hitters per status code: Count-Min sketch + top-K set
+(LOG_IP_COUNTS_MODE=sketch).
+
+The exact layout (one sorted-set member per source IP) grows with the number of
+distinct IPs, which is unbounded during a scan or DDoS. In sketch mode each
+status instead keeps:
+- a Count-Min sketch of LOG_HH_DEPTH rows x LOG_HH_WIDTH u32 counters in one
+  string, updated with BITFIELD INCRBY (OVERFLOW SAT)
+- a top-K sorted set of at most LOG_HH_TOP_K IPs scored by their sketch estimate;
+  an IP not in the set replaces the current minimum (Space-Saving style
+  eviction) only when its estimate is larger
+- the total number of lines counted (N)
+All three are updated together by one Lua script call per batch.
+
+Error bounds (Count-Min, w = width, d = depth):
+- estimates never undercount: true <= reported
+- reported <= true + (e / w) * N with probability >= 1 - e^-d per IP
+- once the set is full, any IP whose true count exceeds the set's minimum score
+  is guaranteed to be in it (scores and the minimum only ever grow)
+With the defaults (w=8192, d=5) that is an overcount of at most 0.033% of N
+with 99.3% confidence, in 160 KB + ~100 B per tracked IP for each status.
+
+Keys embed the sketch dimensions, so changing LOG_HH_WIDTH / LOG_HH_DEPTH starts
+fresh sketches instead of mixing incompatible ones. Hash columns are derived
+client-side (blake2b, double hashing), so every process must agree on them -
+they do, the hash is stable.
+"""
+
+import hashlib
+import math
+from typing import Any, Dict, Iterable, List, Mapping, Tuple
+
+from redis.asyncio.client import Pipeline
+
+from api.core.config import settings
+from api.services import redis_scripts
+from api.services.redis_client import get_redis
+
+
+def _dims() -> str:
+    return f"{settings.LOG_HH_DEPTH}x{settings.LOG_HH_WIDTH}"
+
+def k_hh_cms(status: str) -> str:
+    return f"logs:hh:{_dims()}:{status}:cms"     # string: depth*width u32 counters
+
+def k_hh_topk(status: str) -> str:
+    return f"logs:hh:{_dims()}:{status}:topk"    # zset: member=ip, score=sketch estimate
+
+def k_hh_total(status: str) -> str:
+    return f"logs:hh:{_dims()}:{status}:n"       # int: lines counted (N)
+
+
+def counter_indexes(ip: str, depth: int, width: int) -> List[int]:
+    """One counter index per sketch row (row * width + column)."""
+    digest = hashlib.blake2b(ip.encode(), digest_size=16).digest()
+    h1 = int.from_bytes(digest[:8], "little")
+    h2 = int.from_bytes(digest[8:], "little") | 1
+    return [row * width + (h1 + row * h2) % width for row in range(depth)]
+
+
+def queue_counts(pipe: Pipeline, counts: Mapping[Tuple[str, str], int]) -> None:
+    """Queue sketch updates for {(status, ip): n}, one script call per status and batch."""
+    depth, width = settings.LOG_HH_DEPTH, settings.LOG_HH_WIDTH
+    batch = settings.LOG_INGEST_PIPELINE_BATCH
+    by_status: Dict[str, List[Any]] = {}
+    for (status, ip), n in counts.items():
+        by_status.setdefault(status, []).append((ip, n))
+
+    for status, items in by_status.items():
+        keys = [k_hh_cms(status), k_hh_topk(status), k_hh_total(status)]
+        for i in range(0, len(items), batch):
+            args: List[Any] = [depth, settings.LOG_HH_TOP_K]
+            for ip, n in items[i:i + batch]:
+                args.append(ip)
+                args.append(n)
+                args.extend(counter_indexes(ip, depth, width))
+            redis_scripts.heavy_hitters_add.queue(pipe, keys, args)
+
+
+async def add_counts(counts: Mapping[Tuple[str, str], int]) -> None:
+    if not counts:
+        return
+    r = await get_redis()
+    await redis_scripts.execute_pipeline(r, lambda pipe: queue_counts(pipe, counts))
+
+
+async def top(status: str, top_n: int) -> List[Tuple[str, int]]:
+    """Top-N tracked IPs by estimated count (N is capped at LOG_HH_TOP_K)."""
+    r = await get_redis()
+    rows = await r.zrevrange(k_hh_topk(status), 0, top_n - 1, withscores=True)
+    return [(ip, int(cnt)) for ip, cnt in rows]
+
+
+async def error_bounds(status: str) -> Dict[str, Any]:
+    """Current error bounds for the counts reported by top()."""
+    return (await error_bounds_many([status]))[status]
+
+
+async def error_bounds_many(statuses: Iterable[str]) -> Dict[str, Dict[str, Any]]:
+    """error_bounds() of several statuses in one round trip."""
+    statuses = list(statuses)
+    r = await get_redis()
+    pipe = r.pipeline(transaction=False)
+    for status in statuses:
+        pipe.get(k_hh_total(status))
+        pipe.zcard(k_hh_topk(status))
+        pipe.zrange(k_hh_topk(status), 0, 0, withscores=True)
+    rows = await pipe.execute()
+    return {status: _bounds(*rows[i * 3:i * 3 + 3]) for i, status in enumerate(statuses)}
+
+
+def _bounds(total: Any, tracked: int, lowest: List[Tuple[str, float]]) -> Dict[str, Any]:
+    total = int(total or 0)
+    epsilon = math.e / settings.LOG_HH_WIDTH
+    full = tracked >= settings.LOG_HH_TOP_K
+    return {
+        "total": total,
+        "tracked": tracked,
+        "capacity": settings.LOG_HH_TOP_K,
+        "epsilon": epsilon,
+        "confidence": round(1 - math.exp(-settings.LOG_HH_DEPTH), 6),
+        # reported - max_overcount <= true <= reported
+        "max_overcount": math.ceil(epsilon * total),
+        # every IP counted more often than this is in the top-K set
+        "guaranteed_above": int(lowest[0][1]) if full and lowest else 0,
+    }
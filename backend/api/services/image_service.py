@@ -1,9 +1,30 @@
-from typing import Dict, Any, List
+import asyncio
+import time
+from typing import Dict, Any, List, Optional, Union
 from math import sqrt
+from loguru import logger
+from api.core.config import settings
 from api.services.mongo_client import get_db
+from api.services.vector_index import IVFIndex, VectorIndex, auto_nlist
 from api.models.schemas import ImageEmbedding
 
 COLL = "image_embeddings"
+LOAD_BATCH = 10000
+
+# Process-local index over COLL (IMAGE_INDEX_ENABLED): loaded on first search,
+# updated in place by upsert_embedding and every IMAGE_INDEX_REFRESH_SEC from
+# documents other processes wrote since (by updated_at, indexed by
+# ensure_indexes). updated_at comes from each writer's clock, so a refresh
+# re-reads from IMAGE_INDEX_SYNC_SKEW_SEC before the newest value seen; rows
+# already in the index are updated in place, so the overlap is harmless.
+# IMAGE_INDEX_ENGINE=ivf makes it an approximate IVFIndex, (re)trained in a
+# worker thread once it reaches IMAGE_IVF_MIN_TRAIN_ROWS rows and again after
+# every IMAGE_IVF_RETRAIN_GROWTH-fold growth; searches stay exact until then.
+_index: Optional[VectorIndex] = None
+_index_lock = asyncio.Lock()
+_synced_until = 0.0
+_next_refresh = 0.0
+_training: Optional[asyncio.Task] = None
 
 def _cosine(a: List[float], b: List[float]) -> float:
     s = sum(x*y for x,y in zip(a,b))
@@ -11,21 +32,124 @@ def _cosine(a: List[float], b: List[float]) -> float:
     nb = sqrt(sum(y*y for y in b)) or 1.0
     return s / (na * nb)
 
-async def upsert_embedding(doc: ImageEmbedding) -> None:
+async def _load_into(index: VectorIndex, query: Dict[str, Any]) -> int:
+    """Stream matching documents into the index in batches; returns rows added."""
+    global _synced_until
+    db = get_db()
+    cursor = db[COLL].find(
+        query, {"_id": 0, "image_id": 1, "embedding": 1, "metadata": 1, "updated_at": 1}
+    ).batch_size(LOAD_BATCH)
+    added = skipped = 0
+    batch: List[Dict[str, Any]] = []
+    async for row in cursor:
+        batch.append(row)
+        _synced_until = max(_synced_until, row.get("updated_at") or 0.0)
+        if len(batch) >= LOAD_BATCH:
+            a, s = index.add_rows(batch)
+            added, skipped, batch = added + a, skipped + s, []
+    if batch:
+        a, s = index.add_rows(batch)
+        added, skipped = added + a, skipped + s
+    if skipped:
+        logger.warning(f"Image index skipped {skipped} embeddings with a dimension other than {index.dim}")
+    return added
+
+def _new_index() -> VectorIndex:
+    engine = settings.IMAGE_INDEX_ENGINE.lower()
+    if engine == "ivf":
+        return IVFIndex(nlist=settings.IMAGE_IVF_NLIST, nprobe=settings.IMAGE_IVF_NPROBE)
+    if engine != "exact":
+        logger.warning(f"Unknown IMAGE_INDEX_ENGINE {settings.IMAGE_INDEX_ENGINE!r}, using exact search")
+    return VectorIndex()
+
+async def _train(index: IVFIndex) -> None:
+    n = len(index)
+    nlist = settings.IMAGE_IVF_NLIST or auto_nlist(n)
+    start = time.perf_counter()
+    try:
+        centroids, assign = await asyncio.to_thread(index.compute_lists, n, nlist)
+    except Exception as e:
+        logger.error(f"Image IVF training failed: {e}")
+        return
+    index.install(centroids, assign)
+    logger.info(f"Image IVF index trained: {n} rows into {nlist} lists in {time.perf_counter() - start:.1f}s")
+
+def _maybe_train(index: VectorIndex) -> None:
+    global _training
+    if not isinstance(index, IVFIndex) or (_training is not None and not _training.done()):
+        return
+    n = len(index)
+    if n < settings.IMAGE_IVF_MIN_TRAIN_ROWS:
+        return
+    if index.trained and n < index.trained_rows * settings.IMAGE_IVF_RETRAIN_GROWTH:
+        return
+    _training = asyncio.create_task(_train(index))
+
+async def ensure_indexes() -> None:
+    """Create the Mongo index the incremental refresh queries by (no-op if it exists)."""
+    await get_db()[COLL].create_index("updated_at")
+
+async def _get_index() -> VectorIndex:
+    global _index, _next_refresh
+    if _index is not None and time.monotonic() < _next_refresh:
+        return _index
+    async with _index_lock:
+        if _index is None:
+            start = time.perf_counter()
+            index = _new_index()
+            await _load_into(index, {})
+            _index = index
+            logger.info(
+                f"Image index loaded: {len(index)} x {index.dim} in {time.perf_counter() - start:.1f}s "
+                f"({index.memory_bytes() / 2**20:.0f} MiB)"
+            )
+        elif time.monotonic() >= _next_refresh:
+            since = _synced_until - settings.IMAGE_INDEX_SYNC_SKEW_SEC
+            await _load_into(_index, {"updated_at": {"$gte": since}})
+        _next_refresh = time.monotonic() + settings.IMAGE_INDEX_REFRESH_SEC
+        _maybe_train(_index)
+    return _index
+
+async def upsert_embedding(doc: Union[ImageEmbedding, Dict[str, Any]]) -> None:
     """
     Store embedding & metadata. Use image_id as unique key.
     """
+    if isinstance(doc, dict):
+        doc = ImageEmbedding(**doc)
     db = get_db()
     await db[COLL].update_one(
         {"image_id": doc.image_id},
-        {"$set": {"embedding": doc.embedding, "metadata": doc.metadata or {}}},
+        {"$set": {"embedding": doc.embedding, "metadata": doc.metadata or {}, "updated_at": time.time()}},
         upsert=True
     )
+    if _index is not None:
+        _index.add_batch([doc.image_id], [doc.embedding], [doc.metadata or {}])
+
+async def search_similar(
+    query_embedding: List[float], top_k: int = 5, nprobe: Optional[int] = None
+) -> List[Dict[str, Any]]:
+    """
+    Cosine similarity top-k over all stored embeddings: one matrix-vector
+    product over the in-memory index (exact, same scores as a full scan), or
+    over the nprobe nearest IVF lists with IMAGE_INDEX_ENGINE=ivf.
+    Raises ValueError if the query dimension differs from the stored embeddings.
+    """
+    if not settings.IMAGE_INDEX_ENABLED:
+        return await _scan_similar(query_embedding, top_k)
+    index = await _get_index()
+    if len(index) >= settings.IMAGE_INDEX_THREAD_MIN_ROWS:
+        hits = await asyncio.to_thread(index.search, query_embedding, top_k, nprobe)
+    else:
+        hits = index.search(query_embedding, top_k, nprobe)
+    return [
+        {"image_id": index.ids[row], "score": score, "metadata": index.metadata[row]}
+        for row, score in hits
+    ]
 
-async def search_similar(query_embedding: List[float], top_k: int = 5) -> List[Dict[str, Any]]:
+async def _scan_similar(query_embedding: List[float], top_k: int = 5) -> List[Dict[str, Any]]:
     """
     Simple in-memory cosine similarity: pulls all embeddings and ranks.
-    Fine for hackathon scale; switch to vector index later if needed.
+    Used when IMAGE_INDEX_ENABLED is off.
     """
     db = get_db()
     cursor = db[COLL].find({}, {"_id": 0, "image_id": 1, "embedding": 1, "metadata": 1})
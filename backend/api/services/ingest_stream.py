@@ -0,0 +1,136 @@
+"""
+Durable ingest buffer on Redis Streams (INGEST_VIA_STREAM).
+
+In stream mode the HTTP ingest endpoints only XADD the validated event to a
+capped stream (one per event kind) and return; request latency is one Redis
+command regardless of how many keys the event touches. Consumer-group
+workers (api.workers.stream_consumer) apply entries to the regular key layout
+in batches through the same batch functions as the direct path, then XACK.
+
+Delivery is at-least-once: an entry is acknowledged only after its batch was
+written, and entries left pending by a crashed or stalled consumer are
+reclaimed with XAUTOCLAIM. Re-applying an event is harmless for presence and
+snapshots (last write wins); counters derived from it (rollups, sketches) may
+count it twice.
+
+An entry whose apply keeps failing (a poison event) is moved to a capped
+dead-letter stream (ingest:dead:<kind>) after INGEST_STREAM_MAX_DELIVERIES
+deliveries instead of being retried forever.
+
+The streams are capped with approximate MAXLEN trimming, so a long consumer
+outage drops the oldest unconsumed entries rather than growing without bound.
+"""
+
+import json
+import time
+from typing import Any, Dict, List
+
+from pydantic import BaseModel
+
+from api.core.config import settings
+from api.services.redis_client import get_redis
+
+GROUP = "ingest-workers"
+PAYLOAD_FIELD = "e"
+
+# kind -> stream key
+STREAMS: Dict[str, str] = {
+    "telemetry": "ingest:stream:telemetry",
+    "users": "ingest:stream:users",
+}
+
+
+def k_ingest_stream(kind: str) -> str:
+    return STREAMS[kind]                         # stream: field "e" = event JSON
+
+
+def k_dead_letter_stream(kind: str) -> str:
+    return f"ingest:dead:{kind}"                 # stream: original fields + source_id, deliveries
+
+
+async def enqueue(kind: str, evt: BaseModel) -> str:
+    """XADD one validated event; returns the stream entry id."""
+    r = await get_redis()
+    return await r.xadd(
+        k_ingest_stream(kind),
+        {PAYLOAD_FIELD: evt.model_dump_json(exclude_none=True)},
+        maxlen=settings.INGEST_STREAM_MAXLEN,
+        approximate=True,
+    )
+
+
+def decode_entries(entries: List) -> List[Dict[str, Any]]:
+    """[(id, {field: value})] -> event dicts; undecodable entries are skipped."""
+    events = []
+    for _, fields in entries:
+        try:
+            events.append(json.loads(fields[PAYLOAD_FIELD]))
+        except (KeyError, TypeError, ValueError):
+            continue
+    return events
+
+
+async def dead_letter(kind: str, entries: List, deliveries: Dict[str, int]) -> int:
+    """
+    Move (id, fields) entries of the kind's ingest stream to its dead-letter
+    stream and XACK them, in one MULTI/EXEC. Returns the number acknowledged.
+    """
+    r = await get_redis()
+    pipe = r.pipeline(transaction=True)
+    for entry_id, fields in entries:
+        pipe.xadd(
+            k_dead_letter_stream(kind),
+            {**fields, "source_id": entry_id, "deliveries": deliveries.get(entry_id, 0)},
+            maxlen=settings.INGEST_DEAD_LETTER_MAXLEN,
+            approximate=True,
+        )
+    pipe.xack(k_ingest_stream(kind), GROUP, *(entry_id for entry_id, _ in entries))
+    return (await pipe.execute())[-1]
+
+
+async def ensure_groups() -> None:
+    """Create the consumer group on every stream (idempotent, creates the stream)."""
+    r = await get_redis()
+    for stream in STREAMS.values():
+        try:
+            await r.xgroup_create(stream, GROUP, id="0", mkstream=True)
+        except Exception as e:
+            if "BUSYGROUP" not in str(e):
+                raise
+
+
+async def stream_lag() -> Dict[str, Any]:
+    """
+    Backlog per stream as seen by Redis, shared by every consumer process:
+    length, entries not yet delivered to the group (lag), delivered but unacked
+    (pending), and the age of the oldest pending entry.
+    """
+    r = await get_redis()
+    now = time.time()
+    pipe = r.pipeline(transaction=False)
+    for stream in STREAMS.values():
+        pipe.xlen(stream)
+        pipe.xinfo_groups(stream)
+        pipe.xpending(stream, GROUP)
+    replies = await pipe.execute(raise_on_error=False)
+
+    out: Dict[str, Any] = {}
+    for i, (kind, stream) in enumerate(STREAMS.items()):
+        length, groups, pending = replies[i * 3:(i + 1) * 3]
+        # a missing stream/group comes back as an error reply
+        group = None
+        if isinstance(groups, list):
+            group = next((g for g in groups if g.get("name") == GROUP), None)
+        if group is None:
+            out[kind] = {"stream": stream, "length": length if isinstance(length, int) else 0, "group": None}
+            continue
+        oldest = pending.get("min") if isinstance(pending, dict) else None
+        out[kind] = {
+            "stream": stream,
+            "length": length,
+            "lag": group.get("lag"),            # None before Redis 7
+            "pending": group.get("pending", 0),
+            "consumers": group.get("consumers", 0),
+            "oldest_pending_age_sec": round(now - int(oldest.split("-")[0]) / 1000, 3) if oldest else 0.0,
+        }
+    return out
@@ -0,0 +1,275 @@
+"""
+Push-based presence feeds for live dashboards (Server-Sent Events).
+
+One PresenceFeed per kind ("devices", "users") keeps an in-process mirror of
+every site's presence zset {member: last_seen}. It runs only while someone is
+subscribed and, every LIVE_TICK_SEC:
+- fetches the members updated since the previous tick (ZRANGEBYSCORE from the
+  last tick's timestamp, for the sites the registry shows as recently active)
+- computes joins (new members) and leaves (last_seen fell out of the window)
+- serialises each changed site's delta once and hands the same bytes to every
+  subscriber of that site (and one counts-only frame to all-sites subscribers)
+
+So the Redis work and serialisation per tick are independent of how many
+dashboards are connected, and proportional to the update rate rather than to
+the number of active members.
+
+Subscribers get a snapshot first, then deltas. A subscriber that falls more
+than LIVE_SUBSCRIBER_QUEUE ticks behind is sent a "resync" event and closed;
+EventSource reconnects and starts over from a fresh snapshot.
+"""
+
+import asyncio
+import time
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+import orjson
+from loguru import logger
+
+from api.core.config import settings
+from api.services.redis_client import get_redis
+from api.services.telemetry_service import k_device_sites, k_device_zset_site
+from api.services.user_service import k_user_sites, k_user_zset_site
+
+# kind -> (site registry, presence zset key fn, window setting)
+FEED_KINDS = {
+    "devices": (k_device_sites(), k_device_zset_site, "DEVICE_PRESENCE_WINDOW_SEC"),
+    "users": (k_user_sites(), k_user_zset_site, "USER_PRESENCE_WINDOW_SEC"),
+}
+
+
+def sse_frame(event: str, data: Dict[str, Any]) -> bytes:
+    return b"event: " + event.encode() + b"\ndata: " + orjson.dumps(data) + b"\n\n"
+
+
+RESYNC_FRAME = sse_frame("resync", {"reason": "subscriber too slow"})
+HEARTBEAT_FRAME = b": keepalive\n\n"
+
+
+class Subscriber:
+    def __init__(self, site_id: Optional[str], maxsize: int):
+        self.site_id = site_id
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=maxsize)
+
+
+class PresenceFeed:
+    """Shared tick loop and subscriber fan-out for one presence kind."""
+
+    def __init__(self, kind: str):
+        self.kind = kind
+        self.registry, self.zset_key, self._window_attr = FEED_KINDS[kind]
+
+        self._members: Dict[str, Dict[str, float]] = {}
+        self._subscribers: Set[Subscriber] = set()
+        self._task: Optional[asyncio.Task] = None
+        self._ready: Optional[asyncio.Event] = None
+        self._last_ts = 0
+
+        self.stats: Dict[str, Any] = {
+            "ticks": 0,
+            "errors": 0,
+            "frames": 0,
+            "dropped_subscribers": 0,
+            "last_tick_ms": 0.0,
+            "last_updates": 0,
+        }
+
+    @property
+    def window(self) -> int:
+        return getattr(settings, self._window_attr)
+
+    # ------------------------------------------------------------------
+    # mirror
+    # ------------------------------------------------------------------
+    async def _fetch(self, since: float, now: int) -> Dict[str, List[Tuple[str, float]]]:
+        """{site: [(member, score)]} for members with last_seen >= since, two round trips."""
+        r = await get_redis()
+        sites = await r.zrangebyscore(self.registry, since, "+inf")
+        if not sites:
+            return {}
+        pipe = r.pipeline(transaction=False)
+        for sid in sites:
+            pipe.zrangebyscore(self.zset_key(sid), since, "+inf", withscores=True)
+        return dict(zip(sites, await pipe.execute()))
+
+    async def _load(self) -> None:
+        now = int(time.time())
+        self._members = {
+            sid: dict(rows) for sid, rows in (await self._fetch(now - self.window, now)).items()
+        }
+        self._last_ts = now
+
+    async def _tick(self) -> None:
+        now = int(time.time())
+        # Inclusive lower bound: writes in the same second as the previous read are seen again
+        updates = await self._fetch(self._last_ts, now)
+        self._last_ts = now
+        min_score = now - self.window
+
+        changes: Dict[str, Tuple[List[str], List[str]]] = {}
+        for sid, rows in updates.items():
+            members = self._members.setdefault(sid, {})
+            joined = [m for m, score in rows if m not in members and score >= min_score]
+            for m, score in rows:
+                members[m] = score
+            if joined:
+                changes[sid] = (joined, [])
+        for sid, members in self._members.items():
+            left = [m for m, score in members.items() if score < min_score]
+            if left:
+                for m in left:
+                    del members[m]
+                changes.setdefault(sid, ([], []))[1].extend(left)
+        for sid in [sid for sid, members in self._members.items() if not members]:
+            del self._members[sid]
+
+        self.stats["last_updates"] = sum(len(rows) for rows in updates.values())
+        if changes:
+            self._publish(now, changes)
+
+    # ------------------------------------------------------------------
+    # fan-out
+    # ------------------------------------------------------------------
+    def _count(self, site_id: str) -> int:
+        return len(self._members.get(site_id, ()))
+
+    def _snapshot(self, sub: Subscriber, now: int) -> bytes:
+        if sub.site_id is None:
+            return sse_frame("snapshot", {
+                "ts": now,
+                "window_sec": self.window,
+                "sites": {sid: len(m) for sid, m in self._members.items()},
+                "total": sum(len(m) for m in self._members.values()),
+            })
+        members = self._members.get(sub.site_id, {})
+        return sse_frame("snapshot", {
+            "ts": now,
+            "window_sec": self.window,
+            "site_id": sub.site_id,
+            "count": len(members),
+            "members": sorted(members, key=members.__getitem__, reverse=True),
+        })
+
+    def _publish(self, now: int, changes: Dict[str, Tuple[List[str], List[str]]]) -> None:
+        frames: Dict[Optional[str], bytes] = {}
+        wanted = {sub.site_id for sub in self._subscribers}
+        if None in wanted:
+            frames[None] = sse_frame("delta", {
+                "ts": now,
+                "sites": {sid: self._count(sid) for sid in changes},
+                "total": sum(len(m) for m in self._members.values()),
+            })
+        for sid in wanted & changes.keys():
+            joined, left = changes[sid]
+            frames[sid] = sse_frame("delta", {
+                "ts": now, "site_id": sid, "count": self._count(sid), "joined": joined, "left": left,
+            })
+
+        for sub in list(self._subscribers):
+            frame = frames.get(sub.site_id)
+            if frame is None:
+                continue
+            try:
+                sub.queue.put_nowait(frame)
+                self.stats["frames"] += 1
+            except asyncio.QueueFull:
+                self._drop(sub)
+
+    def _drop(self, sub: Subscriber) -> None:
+        self._subscribers.discard(sub)
+        self.stats["dropped_subscribers"] += 1
+        while not sub.queue.empty():
+            sub.queue.get_nowait()
+        sub.queue.put_nowait(RESYNC_FRAME)
+        sub.queue.put_nowait(None)
+
+    # ------------------------------------------------------------------
+    # lifecycle
+    # ------------------------------------------------------------------
+    async def _run(self) -> None:
+        try:
+            await self._load()
+        except Exception as e:
+            logger.error(f"Live {self.kind} feed initial load failed: {e}")
+        self._ready.set()
+        while True:
+            await asyncio.sleep(settings.LIVE_TICK_SEC)
+            start = time.perf_counter()
+            try:
+                await self._tick()
+            except Exception as e:
+                self.stats["errors"] += 1
+                logger.error(f"Live {self.kind} feed tick failed: {e}")
+            self.stats["ticks"] += 1
+            self.stats["last_tick_ms"] = round((time.perf_counter() - start) * 1000, 3)
+
+    async def subscribe(self, site_id: Optional[str]) -> Subscriber:
+        """Register a subscriber; its queue starts with a snapshot frame."""
+        while True:
+            if self._task is None:
+                self._ready = asyncio.Event()
+                self._task = asyncio.create_task(self._run(), name=f"live-{self.kind}-feed")
+            task, ready = self._task, self._ready
+            await ready.wait()
+            if self._task is task:
+                break
+            # the loop was stopped while we waited: start (or join) a new one
+        sub = Subscriber(site_id, max(2, settings.LIVE_SUBSCRIBER_QUEUE))
+        # no await between snapshot and registration: the next delta follows this state
+        sub.queue.put_nowait(self._snapshot(sub, self._last_ts))
+        self._subscribers.add(sub)
+        return sub
+
+    async def unsubscribe(self, sub: Subscriber) -> None:
+        self._subscribers.discard(sub)
+        if not self._subscribers:
+            await self.stop()
+
+    async def stop(self) -> None:
+        # Detach before awaiting the cancellation: a subscribe() arriving meanwhile
+        # starts a fresh loop instead of joining the dying one.
+        task, ready = self._task, self._ready
+        self._task = self._ready = None
+        self._members = {}
+        if task is not None:
+            task.cancel()
+            ready.set()                  # release subscribers waiting on the initial load
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+
+    def metrics(self) -> Dict[str, Any]:
+        return {
+            **self.stats,
+            "running": self._task is not None,
+            "subscribers": len(self._subscribers),
+            "sites": len(self._members),
+            "members": sum(len(m) for m in self._members.values()),
+        }
+
+
+feeds: Dict[str, PresenceFeed] = {kind: PresenceFeed(kind) for kind in FEED_KINDS}
+
+
+async def sse_stream(kind: str, site_id: Optional[str]):
+    """Async iterator of SSE frames for one subscriber (StreamingResponse body)."""
+    feed = feeds[kind]
+    sub = await feed.subscribe(site_id)
+    try:
+        while True:
+            try:
+                frame = await asyncio.wait_for(sub.queue.get(), settings.LIVE_HEARTBEAT_SEC)
+            except asyncio.TimeoutError:
+                yield HEARTBEAT_FRAME
+                continue
+            if frame is None:
+                return
+            yield frame
+    finally:
+        await feed.unsubscribe(sub)
+
+
+async def stop_feeds() -> None:
+    for feed in feeds.values():
+        await feed.stop()
@@ -1,25 +1,402 @@
 import re
-from typing import List, Tuple
+import time
+import uuid
+import zlib
+from typing import Any, AsyncIterator, Callable, Dict, Iterable, List, NamedTuple, Optional, Tuple
+from redis.asyncio.client import Pipeline
 from api.services.redis_client import get_redis
+from api.services import heavy_hitters, log_templates, redis_scripts
+from api.core.config import settings
 
 # Simple regex for common web logs: 'IP - - [ts] "GET /..." status bytes ...'
+# Kept as the fallback of the anchored parsers below, which return exactly what it matches.
 LOG_RE = re.compile(r'(?P<ip>\d{1,3}(?:\.\d{1,3}){3}).*?"\w+ [^"]+" (?P<status>\d{3})')
 
-def k_errors_by_ip(status: str) -> str:
-    return f"logs:status:{status}:by_ip"   # hash: {ip -> count}
+# Anchored at the IP and stopping at the first quote, so a line is scanned once;
+# when these match, LOG_RE.search would match the same IP and status at position 0.
+_IP_STATUS_RE = re.compile(r'(?P<ip>\d{1,3}(?:\.\d{1,3}){3}) [^"\n]*"(?P<method>\w+) (?P<target>[^"]+)" (?P<status>\d{3})')
+_COMBINED_RE = re.compile(
+    r'(?P<ip>\d{1,3}(?:\.\d{1,3}){3}) [^"\n]*"(?P<method>\w+) (?P<target>[^"]+)" (?P<status>\d{3})'
+    r'(?: (?P<bytes>\d+|-)(?: "(?P<referrer>[^"\\]*(?:\\.[^"\\]*)*)" "(?P<user_agent>[^"\\]*(?:\\.[^"\\]*)*)")?)?'
+)
+# Every LOG_RE match contains this; lines without it skip the backtracking search
+_STATUS_HINT_RE = re.compile(r'" \d{3}')
 
-async def ingest_log_line(line: str) -> None:
-    r = await get_redis()
-    m = LOG_RE.search(line)
+class LogRecord(NamedTuple):
+    """Combined log format fields; only ip and status are set for LOG_RE-fallback lines."""
+    ip: str
+    status: str
+    method: Optional[str] = None
+    path: Optional[str] = None
+    protocol: Optional[str] = None
+    bytes: Optional[int] = None
+    referrer: Optional[str] = None
+    user_agent: Optional[str] = None
+
+def _fallback(line: str) -> Optional[re.Match]:
+    return LOG_RE.search(line) if _STATUS_HINT_RE.search(line) else None
+
+def match_ip_status(line: str) -> Optional[re.Match]:
+    """
+    Match of a log line with "ip" and "status" groups (same as LOG_RE.search),
+    plus "method" and "target" when the anchored pattern matched; None if none.
+    """
+    return _IP_STATUS_RE.match(line) or _fallback(line)
+
+def parse_ip_status(line: str) -> Optional[Tuple[str, str]]:
+    """(ip, status) of a log line, or None; same result as LOG_RE.search."""
+    m = match_ip_status(line)
+    return m.group("ip", "status") if m else None
+
+def parse_log_line(line: str) -> Optional[LogRecord]:
+    """
+    Parse a common/combined log format line:
+    'IP ident user [ts] "METHOD path PROTO" status bytes "referrer" "user agent"'.
+    Lines in other layouts fall back to LOG_RE (ip and status only).
+    """
+    m = _COMBINED_RE.match(line)
     if not m:
+        m = _fallback(line)
+        return LogRecord(m.group("ip"), m.group("status")) if m else None
+    ip, method, target, status, nbytes, referrer, user_agent = m.groups()
+    path, space, protocol = target.rpartition(" ")
+    if not space:
+        path, protocol = target, None
+    if nbytes is not None:
+        nbytes = 0 if nbytes == "-" else int(nbytes)
+    return LogRecord(ip, status, method, path, protocol, nbytes, referrer, user_agent)
+
+def k_errors_by_ip(status: str) -> str:
+    return f"logs:status:{status}:by_ip"   # legacy hash: {ip -> count}; migrated by migrate_hash_counts
+
+def k_ip_counts(status: str) -> str:
+    return f"logs:status:{status}:top_ips" # zset: member=ip, score=count
+
+def k_ip_minute(status: str, minute_ts: int) -> str:
+    return f"logs:status:{status}:top_ips:{minute_ts}"  # zset per minute, expires after the retention
+
+def k_minute_statuses(minute_ts: int) -> str:
+    return f"logs:statuses:{minute_ts}"    # set of statuses seen in the minute (status-class queries)
+
+MINUTE = 60
+STATUS_CLASS_RE = re.compile(r"^[1-5]xx$")
+
+def class_statuses(status_class: str) -> List[str]:
+    """Every status code of a class: "4xx" -> ["400", ..., "499"]."""
+    base = int(status_class[0]) * 100
+    return [str(base + i) for i in range(100)]
+
+def _queue_window(pipe, items: Iterable[Tuple[Tuple[str, str], int]], now: int) -> None:
+    """
+    Queue per-minute counts (and the minute's status registry) for the sliding-window view.
+    In sketch mode each minute keeps only its LOG_HH_TOP_K heaviest IPs, so the
+    window stays bounded like the sketches; an IP trimmed from a minute restarts
+    from zero there, so windowed counts may undercount.
+    """
+    minute = now - now % MINUTE
+    ttl = settings.LOG_WINDOW_RETENTION_SEC + MINUTE
+    cap = settings.LOG_HH_TOP_K if settings.LOG_IP_COUNTS_MODE == "sketch" else 0
+    statuses = set()
+    for (status, ip), n in items:
+        pipe.zincrby(k_ip_minute(status, minute), n, ip)
+        statuses.add(status)
+    if not statuses:
         return
-    ip = m.group("ip")
-    status = m.group("status")
-    await r.hincrby(k_errors_by_ip(status), ip, 1)
+    for status in statuses:
+        if cap:
+            pipe.zremrangebyrank(k_ip_minute(status, minute), 0, -(cap + 1))
+        pipe.expire(k_ip_minute(status, minute), ttl)
+    pipe.sadd(k_minute_statuses(minute), *statuses)
+    pipe.expire(k_minute_statuses(minute), ttl)
+
+def mine_template(line: str, m: Optional[re.Match]) -> None:
+    """Feed error (4xx/5xx) and unparseable lines (m from match_ip_status) to the template miner."""
+    if m is None:
+        if line.strip():
+            log_templates.miner.add(line)
+        return
+    status = m["status"]
+    if status[0] not in "45":
+        return
+    if m.re is _IP_STATUS_RE:
+        path, space, _ = m["target"].rpartition(" ")
+        tokens = log_templates.path_tokens(path if space else m["target"])
+        log_templates.miner.add_tokens(status, [m["method"], *tokens], line)
+    else:
+        log_templates.miner.add(line, group=status)
+
+async def ingest_log_line(line: str) -> None:
+    m = match_ip_status(line)
+    if settings.LOG_TEMPLATES_ENABLED:
+        mine_template(line, m)
+
+    def build(pipe: Pipeline) -> None:
+        if m is not None:
+            ip, status = m.group("ip", "status")
+            if settings.LOG_IP_COUNTS_MODE == "sketch":
+                heavy_hitters.queue_counts(pipe, {(status, ip): 1})
+            else:
+                pipe.zincrby(k_ip_counts(status), 1, ip)
+            if settings.LOG_WINDOW_ENABLED:
+                _queue_window(pipe, [((status, ip), 1)], int(time.time()))
+        log_templates.miner.queue_flush(pipe)
+
+    await redis_scripts.execute_pipeline(await get_redis(), build)
+
+class LogAggregator:
+    """
+    Parses log lines and counts them per (status, ip) in memory, so a flush
+    writes one ZINCRBY (or sketch update) per distinct pair instead of one per line.
+    """
+
+    def __init__(self):
+        self.counts: Dict[Tuple[str, str], int] = {}
+        self.parsed = 0
+        self.rejected = 0
+        self.flushes = 0
+
+    def add_line(self, line: str) -> bool:
+        m = match_ip_status(line)
+        if settings.LOG_TEMPLATES_ENABLED:
+            mine_template(line, m)
+        if m is None:
+            self.rejected += 1
+            return False
+        key = m.group("status", "ip")
+        self.counts[key] = self.counts.get(key, 0) + 1
+        self.parsed += 1
+        return True
+
+    async def flush(self, extra: Optional[Callable[[Pipeline], None]] = None) -> None:
+        """
+        Write and reset the local counts in pipelined batches, plus the template
+        miner's count deltas. With `extra`, the counts and the commands it queues
+        (the tailer's checkpoint) go out in one MULTI/EXEC instead, so both are
+        written or neither is.
+        """
+        if not self.counts and extra is None:
+            if settings.LOG_TEMPLATES_ENABLED:
+                await redis_scripts.execute_pipeline(await get_redis(), log_templates.miner.queue_flush)
+            return
+        counts, self.counts = self.counts, {}
+        if counts:
+            self.flushes += 1
+        now = int(time.time())
+        sketch = settings.LOG_IP_COUNTS_MODE == "sketch"
+        if extra is not None:
+            def build(pipe: Pipeline) -> None:
+                if sketch:
+                    heavy_hitters.queue_counts(pipe, counts)
+                else:
+                    for (status, ip), n in counts.items():
+                        pipe.zincrby(k_ip_counts(status), n, ip)
+                if settings.LOG_WINDOW_ENABLED:
+                    _queue_window(pipe, counts.items(), now)
+                log_templates.miner.queue_flush(pipe)
+                extra(pipe)
+
+            await redis_scripts.execute_pipeline(await get_redis(), build, transaction=True)
+            return
+        if sketch:
+            await heavy_hitters.add_counts(counts)
+        r = await get_redis()
+        batch = settings.LOG_INGEST_PIPELINE_BATCH
+        items = list(counts.items())
+        for i in range(0, len(items), batch):
+            pipe = r.pipeline(transaction=False)
+            if not sketch:
+                for (status, ip), n in items[i:i + batch]:
+                    pipe.zincrby(k_ip_counts(status), n, ip)
+            if settings.LOG_WINDOW_ENABLED:
+                _queue_window(pipe, items[i:i + batch], now)
+            if len(pipe):
+                await pipe.execute()
+        if settings.LOG_TEMPLATES_ENABLED:
+            await redis_scripts.execute_pipeline(r, log_templates.miner.queue_flush)
+
+
+async def _decompressed(chunks: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+    """Pass plain bodies through; inflate gzip (detected by magic, multi-member ok) in bounded pieces."""
+    inflater = None
+    first = True
+    async for chunk in chunks:
+        if first and chunk:
+            first = False
+            if chunk[:2] == b"\x1f\x8b":
+                inflater = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        if inflater is None:
+            yield chunk
+            continue
+        data = chunk
+        while data:
+            out = inflater.decompress(data, 1 << 20)
+            if out:
+                yield out
+            if inflater.unconsumed_tail:
+                data = inflater.unconsumed_tail
+            elif inflater.eof and inflater.unused_data:
+                # next gzip member
+                data = inflater.unused_data
+                inflater = zlib.decompressobj(16 + zlib.MAX_WBITS)
+            else:
+                data = b""
+    if inflater is not None:
+        tail = inflater.flush()
+        if tail:
+            yield tail
+
+
+async def ingest_log_stream(chunks: AsyncIterator[bytes]) -> Dict[str, Any]:
+    """
+    Ingest a streamed body of newline-delimited log lines (plain or gzip).
+    Lines are parsed as chunks arrive (the body is never held in memory),
+    aggregated per (status, ip), and flushed every LOG_INGEST_FLUSH_LINES lines.
+    Lines longer than LOG_INGEST_MAX_LINE_BYTES are rejected; the rest of such
+    a line is skipped up to its newline, however many chunks it spans.
+    """
+    start = time.perf_counter()
+    agg = LogAggregator()
+    flush_every = settings.LOG_INGEST_FLUSH_LINES
+    max_line = settings.LOG_INGEST_MAX_LINE_BYTES
+    next_flush = flush_every
+    pending = b""
+    skipping = False            # inside a line already rejected as too long
+    nbytes = 0
+
+    async for data in _decompressed(chunks):
+        nbytes += len(data)
+        if skipping:
+            end = data.find(b"\n")
+            if end < 0:
+                continue
+            data, skipping = data[end + 1:], False
+        lines = (pending + data).split(b"\n")
+        pending = lines.pop()
+        if len(pending) > max_line:
+            agg.rejected += 1
+            pending, skipping = b"", True
+        for raw in lines:
+            if len(raw) > max_line:
+                agg.rejected += 1
+            elif raw.strip():
+                agg.add_line(raw.decode("utf-8", "replace"))
+        if agg.parsed + agg.rejected >= next_flush:
+            await agg.flush()
+            next_flush += flush_every
+    if pending.strip():
+        agg.add_line(pending.decode("utf-8", "replace"))
+    await agg.flush()
+
+    elapsed = time.perf_counter() - start
+    lines_total = agg.parsed + agg.rejected
+    return {
+        "lines": lines_total,
+        "parsed": agg.parsed,
+        "rejected": agg.rejected,
+        "bytes": nbytes,
+        "flushes": agg.flushes,
+        "seconds": round(elapsed, 3),
+        "lines_per_sec": round(lines_total / elapsed, 1) if elapsed else 0.0,
+    }
+
+async def _union_top(r, keys: List[str], top_n: int) -> List[Tuple[str, int]]:
+    """Top-N members of the sum of several zsets (missing keys count as empty)."""
+    # MULTI so the scratch key never outlives the request
+    dest = f"logs:tmp:top_ips:{uuid.uuid4().hex}"
+    pipe = r.pipeline(transaction=True)
+    pipe.zunionstore(dest, keys)
+    pipe.zrevrange(dest, 0, top_n - 1, withscores=True)
+    pipe.delete(dest)
+    _, top, _ = await pipe.execute()
+    return [(ip, int(cnt)) for ip, cnt in top]
 
 async def top_error_ips(status: str = "400", top_n: int = 10) -> List[Tuple[str, int]]:
+    """
+    Top-N IPs by count for a status: ZREVRANGE of N members, O(log n + N).
+    A status class ("5xx") sums the zsets of its 100 statuses with one ZUNIONSTORE.
+    In sketch mode the counts are Count-Min estimates (see top_error_ips_bounds);
+    for a class they are sums of the per-status top-K scores, so an IP missing
+    from some status's top-K set is undercounted there.
+    """
+    sketch = settings.LOG_IP_COUNTS_MODE == "sketch"
+    r = await get_redis()
+    if STATUS_CLASS_RE.match(status):
+        key = heavy_hitters.k_hh_topk if sketch else k_ip_counts
+        return await _union_top(r, [key(s) for s in class_statuses(status)], top_n)
+    if sketch:
+        return await heavy_hitters.top(status, top_n)
+    top = await r.zrevrange(k_ip_counts(status), 0, top_n - 1, withscores=True)
+    return [(ip, int(cnt)) for ip, cnt in top]
+
+async def top_error_ips_bounds(status: str) -> Dict[str, Any] | None:
+    """
+    Error bounds of top_error_ips counts; None when they are exact.
+    For a status class: the bounds of each status seen so far, under "by_status".
+    """
+    if settings.LOG_IP_COUNTS_MODE != "sketch":
+        return None
+    if STATUS_CLASS_RE.match(status):
+        bounds = await heavy_hitters.error_bounds_many(class_statuses(status))
+        return {"by_status": {s: b for s, b in bounds.items() if b["total"]}}
+    return await heavy_hitters.error_bounds(status)
+
+async def top_ips_window(status: str, window_sec: int, top_n: int = 10) -> Dict[str, Any]:
+    """
+    Top-N IPs over the last window_sec for one status ("404") or a status class
+    ("4xx"), merged from the per-minute buckets with one ZUNIONSTORE.
+    Buckets are by ingest time and aligned down to whole minutes, so the window
+    may include up to one extra minute (reported as "covered_from").
+    In sketch mode the buckets are per-minute top-K, and counts are lower
+    bounds ("approximate": true).
+    """
+    is_class = bool(STATUS_CLASS_RE.match(status))
+    if window_sec <= 0 or window_sec > settings.LOG_WINDOW_RETENTION_SEC:
+        raise ValueError(f"window_sec must be in 1..{settings.LOG_WINDOW_RETENTION_SEC}")
+    now = int(time.time())
+    start = now - window_sec
+    minutes = list(range(start - start % MINUTE, now + 1, MINUTE))
+
+    r = await get_redis()
+    if is_class:
+        seen = await r.sunion([k_minute_statuses(m) for m in minutes])
+        statuses = sorted(s for s in seen if s[0] == status[0])
+    else:
+        statuses = [status]
+    result: Dict[str, Any] = {
+        "status": status,
+        "window_sec": window_sec,
+        "covered_from": minutes[0],
+        "approximate": settings.LOG_IP_COUNTS_MODE == "sketch",
+        "top": [],
+    }
+    if is_class:
+        result["statuses"] = statuses
+    keys = [k_ip_minute(s, m) for s in statuses for m in minutes]
+    if keys:
+        result["top"] = await _union_top(r, keys, top_n)
+    return result
+
+async def migrate_hash_counts(chunk: int = 1000) -> Dict[str, int]:
+    """
+    Fold legacy logs:status:{status}:by_ip hashes into the top_ips sorted sets.
+    Each HSCAN chunk is moved by one script call (ZINCRBY + HDEL per field), so
+    the migration is safe to interrupt, re-run or run from several instances at
+    once; ingest only writes the zsets. The emptied hash disappears with its
+    last field.
+    Returns migrated fields per status.
+    """
     r = await get_redis()
-    raw = await r.hgetall(k_errors_by_ip(status))
-    pairs = [(ip, int(cnt)) for ip, cnt in raw.items()]
-    pairs.sort(key=lambda x: x[1], reverse=True)
-    return pairs[:top_n]
+    migrated: Dict[str, int] = {}
+    async for key in r.scan_iter(match=k_errors_by_ip("*"), count=1000):
+        status = key.split(":")[2]
+        total = 0
+        cursor = 0
+        while True:
+            # an empty page does not mean the scan is done; only cursor 0 does
+            cursor, fields = await r.hscan(key, cursor, count=chunk)
+            if fields:
+                total += await redis_scripts.hash_to_zset(r, [key, k_ip_counts(status)], list(fields))
+            if cursor == 0:
+                break
+        migrated[status] = total
+    return migrated
@@ -0,0 +1,286 @@
+"""
+Streaming log template mining (Drain-style) for compact diagnostics.
+
+Counting (status, ip) pairs says who is failing, not what is failing. The miner
+groups error log lines into parameterised templates, e.g.
+    group 404:  GET /wp-admin /<*>          count 48211
+    group raw:  upstream timed out (<NUM>: Connection timed out) while reading ...
+each with a count, a few example lines and first/last-seen times. A diagnosis
+step (or a Cohere prompt) then reads a few dozen clusters instead of thousands
+of raw lines.
+
+Algorithm (Drain, He et al. 2017): lines are masked (timestamps, IPs, UUIDs,
+hex ids, numbers), split into tokens and routed through a fixed-depth prefix
+tree keyed by group, token count and the first LOG_TEMPLATES_DEPTH tokens
+(tokens containing digits share a "<*>" branch). In the leaf the line joins the
+most similar cluster (share of positions whose tokens are equal) if the
+similarity reaches LOG_TEMPLATES_SIM_THRESHOLD; differing positions become
+"<*>". Otherwise it starts a new cluster.
+
+Memory is bounded: at most LOG_TEMPLATES_MAX_CLUSTERS clusters (the least
+recently seen one is evicted, and tree branches it leaves empty are pruned),
+LOG_TEMPLATES_MAX_CHILDREN branches per tree node, LOG_TEMPLATES_MAX_TOKENS tokens per line and a few examples per cluster.
+
+Access log lines are mined as "METHOD path segments" per status group;
+unparseable lines (application errors, upstream messages) go to group "raw".
+
+The tree is per process, but every API worker and collector ingests lines, so
+the counts are shared through Redis: each log flush queues the clusters that
+changed since the last one (queue_flush, one script call) as deltas keyed by
+template id (group + hash of the template), and top_templates() reads the
+merged view. When a cluster generalises, the counts this process wrote under
+its old template move to the new one. The shared view keeps the
+LOG_TEMPLATES_MAX_CLUSTERS most recently seen templates.
+"""
+
+import hashlib
+import json
+import re
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+from redis.asyncio.client import Pipeline
+
+from api.core.config import settings
+from api.services import redis_scripts
+from api.services.redis_client import get_redis
+
+WILDCARD = "<*>"
+
+_MASKS = [
+    (re.compile(r"\[[^\]]{10,40}\]"), "<TS>"),
+    (re.compile(r"\b\d{4}[-/]\d\d[-/]\d\d[T ]\d\d:\d\d:\d\d(?:[.,]\d+)?(?:Z|[+-]\d\d:?\d\d)?"), "<TS>"),
+    (re.compile(r"\b[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}\b"), "<UUID>"),
+    (re.compile(r"\b\d{1,3}(?:\.\d{1,3}){3}(?::\d+)?\b"), "<IP>"),
+    (re.compile(r"\b(?:0x[0-9a-fA-F]+|[0-9a-fA-F]{12,})\b"), "<HEX>"),
+    (re.compile(r"(?<![\w.])[-+]?\d+(?:\.\d+)?(?:ms|s|KB|MB|B)?\b"), "<NUM>"),
+]
+
+
+def k_template_counts() -> str:
+    return "logs:templates:counts"       # zset: template id -> lines, summed over processes
+
+def k_template_seen() -> str:
+    return "logs:templates:last_seen"    # zset: template id -> last seen (unix time)
+
+def k_template_info() -> str:
+    return "logs:templates:info"         # hash: template id -> JSON {group, template, examples, first_seen}
+
+
+def template_id(group: str, template: str) -> str:
+    return f"{group}:{hashlib.blake2b(template.encode(), digest_size=8).hexdigest()}"
+
+
+def mask(text: str) -> str:
+    for pattern, repl in _MASKS:
+        text = pattern.sub(repl, text)
+    return text
+
+
+def path_tokens(path: str) -> List[str]:
+    """'/api/v1/users/42?x=1' -> ['/api', '/v1', '/users', '/<NUM>', '?<*>']"""
+    path, q, _ = path.partition("?")
+    tokens = ["/" + mask(seg) for seg in path.split("/")[1:]] or [path]
+    if q:
+        tokens.append("?" + WILDCARD)
+    return tokens
+
+
+class Cluster:
+    __slots__ = ("id", "group", "tokens", "count", "examples", "first_seen", "last_seen", "flushed", "flushed_id")
+
+    def __init__(self, cluster_id: int, group: str, tokens: List[str], example: str, now: float):
+        self.id = cluster_id
+        self.group = group
+        self.tokens = tokens
+        self.count = 1
+        self.examples = [example]
+        self.first_seen = now
+        self.last_seen = now
+        self.flushed = 0                       # count already written to Redis...
+        self.flushed_id: Optional[str] = None  # ...under this template id
+
+    @property
+    def template(self) -> str:
+        return " ".join(self.tokens)
+
+    def similarity(self, tokens: List[str]) -> float:
+        same = 0
+        for t, u in zip(self.tokens, tokens):
+            if t == u:
+                same += 1
+        return same / len(tokens)
+
+    def merge(self, tokens: List[str], example: str, now: float, max_examples: int) -> None:
+        for i, (t, u) in enumerate(zip(self.tokens, tokens)):
+            if t != u and t != WILDCARD:
+                self.tokens[i] = WILDCARD
+        self.count += 1
+        self.last_seen = now
+        if len(self.examples) < max_examples:
+            self.examples.append(example)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "id": self.id,
+            "group": self.group,
+            "template": self.template,
+            "count": self.count,
+            "examples": self.examples,
+            "first_seen": round(self.first_seen, 3),
+            "last_seen": round(self.last_seen, 3),
+        }
+
+
+class TemplateMiner:
+    """Bounded-memory Drain prefix tree of log clusters."""
+
+    def __init__(
+        self,
+        depth: int | None = None,
+        sim_threshold: float | None = None,
+        max_children: int | None = None,
+        max_clusters: int | None = None,
+        max_tokens: int | None = None,
+        max_examples: int = 3,
+    ):
+        self.depth = settings.LOG_TEMPLATES_DEPTH if depth is None else depth
+        self.sim_threshold = settings.LOG_TEMPLATES_SIM_THRESHOLD if sim_threshold is None else sim_threshold
+        self.max_children = settings.LOG_TEMPLATES_MAX_CHILDREN if max_children is None else max_children
+        self.max_clusters = settings.LOG_TEMPLATES_MAX_CLUSTERS if max_clusters is None else max_clusters
+        self.max_tokens = settings.LOG_TEMPLATES_MAX_TOKENS if max_tokens is None else max_tokens
+        self.max_examples = max_examples
+
+        # nested dicts: group -> token count -> first tokens... -> leaf list of clusters
+        self._root: Dict[Any, Any] = {}
+        self._clusters: "OrderedDict[int, Cluster]" = OrderedDict()   # LRU order
+        # cluster id -> (node, key) steps from the root to its leaf, for pruning
+        self._paths: Dict[int, List[Tuple[Dict[Any, Any], Any]]] = {}
+        self._dirty: Dict[int, Cluster] = {}    # changed since the last queue_flush
+        self._next_id = 1
+        self.lines = 0
+        self.evicted = 0
+
+    def _leaf(self, group: str, tokens: List[str]) -> List[Tuple[Dict[Any, Any], Any]]:
+        """Path to the leaf of a line; the leaf cluster list is path[-1][0][None]."""
+        group_node = self._root.setdefault(group, {})
+        path = [(self._root, group), (group_node, len(tokens))]
+        node = group_node.setdefault(len(tokens), {})
+        for token in tokens[:self.depth]:
+            key = WILDCARD if any(c.isdigit() for c in token) else token
+            child = node.get(key)
+            if child is None:
+                key = key if len(node) < self.max_children else WILDCARD
+                child = node.setdefault(key, {})
+            path.append((node, key))
+            node = child
+        node.setdefault(None, [])
+        path.append((node, None))
+        return path
+
+    def _evict(self, cluster: Cluster) -> None:
+        """Remove a cluster and prune the tree nodes it leaves empty."""
+        path = self._paths.pop(cluster.id)
+        node, key = path[-1]
+        node[key].remove(cluster)
+        for node, key in reversed(path):
+            if node[key]:
+                break
+            del node[key]
+
+    def add_tokens(self, group: str, tokens: List[str], example: str, now: Optional[float] = None) -> Cluster:
+        """Add one tokenised line; returns the cluster it joined or started."""
+        now = time.time() if now is None else now
+        tokens = tokens[:self.max_tokens] or [""]
+        self.lines += 1
+        path = self._leaf(group, tokens)
+        leaf = path[-1][0][None]
+
+        best, best_sim = None, -1.0
+        for cluster in leaf:
+            sim = cluster.similarity(tokens)
+            if sim > best_sim:
+                best, best_sim = cluster, sim
+        if best is not None and best_sim >= self.sim_threshold:
+            best.merge(tokens, example[:512], now, self.max_examples)
+            self._clusters.move_to_end(best.id)
+            self._dirty[best.id] = best
+            return best
+
+        cluster = Cluster(self._next_id, group, list(tokens), example[:512], now)
+        self._next_id += 1
+        leaf.append(cluster)
+        self._clusters[cluster.id] = cluster
+        self._dirty[cluster.id] = cluster
+        self._paths[cluster.id] = path
+        while len(self._clusters) > self.max_clusters:
+            _, old = self._clusters.popitem(last=False)
+            self._evict(old)
+            self.evicted += 1
+        return cluster
+
+    def add(self, line: str, group: str = "raw", now: Optional[float] = None) -> Cluster:
+        """Mask and whitespace-tokenise a raw line."""
+        return self.add_tokens(group, mask(line).split(), line, now)
+
+    def queue_flush(self, pipe: Pipeline) -> None:
+        """Queue the count deltas since the last flush into the shared view (best effort)."""
+        if not self._dirty:
+            return
+        args: List[Any] = [self.max_clusters]
+        for c in self._dirty.values():
+            tid = template_id(c.group, c.template)
+            delta = c.count - c.flushed
+            if c.flushed_id is not None and c.flushed_id != tid:
+                args.extend((c.flushed_id, -c.flushed, "", ""))
+                delta = c.count
+            info = {"group": c.group, "template": c.template, "examples": c.examples,
+                    "first_seen": round(c.first_seen, 3)}
+            args.extend((tid, delta, repr(round(c.last_seen, 3)), json.dumps(info)))
+            c.flushed, c.flushed_id = c.count, tid
+        self._dirty.clear()
+        redis_scripts.templates_merge.queue(pipe, [k_template_counts(), k_template_seen(), k_template_info()], args)
+
+    def top(self, limit: int = 30, group: Optional[str] = None, since: float = 0.0) -> List[Dict[str, Any]]:
+        """This process's clusters (top_templates() has every process's counts)."""
+        clusters = [
+            c for c in self._clusters.values()
+            if (group is None or c.group == group) and c.last_seen >= since
+        ]
+        clusters.sort(key=lambda c: c.count, reverse=True)
+        return [c.to_dict() for c in clusters[:limit]]
+
+    def metrics(self) -> Dict[str, Any]:
+        return {"lines": self.lines, "clusters": len(self._clusters), "evicted": self.evicted}
+
+
+miner = TemplateMiner()
+
+
+async def top_templates(limit: int = 30, group: Optional[str] = None, since: float = 0.0) -> List[Dict[str, Any]]:
+    """Most frequent templates across all processes; since keeps those seen after it."""
+    r = await get_redis()
+    pipe = r.pipeline(transaction=False)
+    pipe.zrevrange(k_template_counts(), 0, -1, withscores=True)
+    pipe.zrangebyscore(k_template_seen(), since, "+inf", withscores=True)
+    counts, seen = await pipe.execute()
+    seen = dict(seen)
+    prefix = None if group is None else f"{group}:"
+    picked = [(tid, n) for tid, n in counts if tid in seen and (prefix is None or tid.startswith(prefix))][:limit]
+    if not picked:
+        return []
+    infos = await r.hmget(k_template_info(), [tid for tid, _ in picked])
+    out = []
+    for (tid, n), info in zip(picked, infos):
+        info = json.loads(info) if info else {}
+        out.append({
+            "id": tid,
+            "group": tid.partition(":")[0],
+            "template": info.get("template"),
+            "count": int(n),
+            "examples": info.get("examples", []),
+            "first_seen": info.get("first_seen"),
+            "last_seen": round(seen[tid], 3),
+        })
+    return out
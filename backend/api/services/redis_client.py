@@ -2,6 +2,7 @@ from redis.asyncio import from_url, Redis
 from api.core.config import settings
 
 _redis: Redis | None = None
+_redis_binary: Redis | None = None
 
 async def get_redis() -> Redis:
     """Global Redis connection (async)."""
@@ -14,8 +15,22 @@ async def get_redis() -> Redis:
         )
     return _redis
 
+async def get_redis_binary() -> Redis:
+    """Global Redis connection returning raw bytes (compact binary snapshots)."""
+    global _redis_binary
+    if _redis_binary is None:
+        _redis_binary = from_url(
+            settings.REDIS_URL,
+            decode_responses=False,
+            health_check_interval=30,
+        )
+    return _redis_binary
+
 async def close_redis():
-    global _redis
+    global _redis, _redis_binary
     if _redis is not None:
         await _redis.aclose()
         _redis = None
+    if _redis_binary is not None:
+        await _redis_binary.aclose()
+        _redis_binary = None
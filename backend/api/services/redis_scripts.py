@@ -0,0 +1,513 @@
+"""
+Server-side Lua scripts for the ingest hot path.
+
+Each ingest script folds the presence ZADD and snapshot HSET into one EVALSHA
+round trip that Redis applies atomically (window trimming is done by the
+presence sweeper, see api/workers/presence_sweeper.py). Scripts are SCRIPT LOADed once
+per process and invoked by SHA; if the server's script cache was flushed
+(restart, failover, SCRIPT FLUSH) the NOSCRIPT reply triggers a reload and a
+single retry of the calls that failed. A NOSCRIPT reply means the script did
+not run, so this is safe even for non-idempotent scripts (counters, rollups).
+Other commands in a pipeline (HINCRBY, ZINCRBY, ...) are never replayed.
+
+Note: multi-key scripts assume a non-clustered Redis (as deployed), since the
+site zset and the per-device hashes hash to different slots (the sweep script
+also derives hash keys from zset members).
+"""
+
+import hashlib
+from typing import Any, Callable, Dict, List, Sequence
+
+from loguru import logger
+from redis.asyncio import Redis
+from redis.asyncio.client import Pipeline
+from redis.exceptions import NoScriptError, ResponseError
+
+# KEYS[1]     = devices:active:site:{site}
+# KEYS[2]     = devices:sites (site registry zset)
+# KEYS[3]     = devices:active:sitetype:{site}|{type}
+# KEYS[4]     = devices:site_types (site|type registry zset)
+# KEYS[5..N]  = device:{key} hash per device (all of this site and type)
+# ARGV[1]     = now (presence score), ARGV[2] = site_id, ARGV[3] = "{site}|{type}"
+# ARGV[4..]   = per device: member, field count, field/value pairs
+TELEMETRY_INGEST_LUA = """
+local now = ARGV[1]
+redis.call('ZADD', KEYS[2], now, ARGV[2])
+redis.call('ZADD', KEYS[4], now, ARGV[3])
+local i = 4
+for k = 5, #KEYS do
+  local member = ARGV[i]
+  local n = tonumber(ARGV[i + 1])
+  i = i + 2
+  redis.call('ZADD', KEYS[1], now, member)
+  redis.call('ZADD', KEYS[3], now, member)
+  if n > 0 then
+    -- drop the other snapshot format's fields: a compact snapshot replaces the
+    -- whole hash, a regular one must not leave a stale "c" that reads prefer
+    if n == 1 and ARGV[i] == 'c' then
+      redis.call('DEL', KEYS[k])
+    else
+      redis.call('HDEL', KEYS[k], 'c')
+    end
+    redis.call('HSET', KEYS[k], unpack(ARGV, i, i + 2 * n - 1))
+  end
+  i = i + 2 * n
+end
+return #KEYS - 4
+"""
+
+# Shared by user_ingest and user_presence: ZADD the session and keep the site's
+# per-role active counters in step. A session counts once, under its role
+# (or "unknown" until one is reported); a role change moves it between roles.
+# Expects locals zset, session, roles, now, session_id, role ('' = not reported).
+_SESSION_PRESENCE_LUA = """
+local old_role = redis.call('HGET', session, 'role')
+if redis.call('ZADD', zset, now, session_id) == 1 then
+  if role == '' then
+    role = old_role or 'unknown'
+  end
+  redis.call('HINCRBY', roles, role, 1)
+elseif role ~= '' and old_role ~= role then
+  redis.call('HINCRBY', roles, old_role or 'unknown', -1)
+  redis.call('HINCRBY', roles, role, 1)
+end
+"""
+
+# KEYS[1] = users:active:site:{site}
+# KEYS[2] = user:session:{id}
+# KEYS[3] = users:metrics:site:{site}
+# KEYS[4] = users:sites (site registry zset)
+# KEYS[5] = users:active:roles:site:{site}
+# KEYS[6..] = latency sketch hashes (minute, hour); only with a latency sample
+# ARGV[1] = now, ARGV[2] = session_id, ARGV[3] = site_id, ARGV[4] = role or ""
+# ARGV[5] = latency sketch bucket field ("" without a sample),
+#           then one EXPIREAT timestamp per sketch key,
+#           then the session field count, session field/value pairs,
+#           then the remaining pairs go to the site metrics hash
+# The sketch HINCRBYs live in the script so a sample is counted exactly once,
+# together with the presence write.
+USER_INGEST_LUA = """
+local zset, session, roles = KEYS[1], KEYS[2], KEYS[5]
+local now, session_id, role = ARGV[1], ARGV[2], ARGV[4]
+""" + _SESSION_PRESENCE_LUA + """
+redis.call('ZADD', KEYS[4], ARGV[1], ARGV[3])
+local nsketch = #KEYS - 5
+for k = 1, nsketch do
+  redis.call('HINCRBY', KEYS[5 + k], ARGV[5], 1)
+  redis.call('EXPIREAT', KEYS[5 + k], ARGV[5 + k])
+end
+local base = 6 + nsketch
+local n = tonumber(ARGV[base])
+if n > 0 then
+  redis.call('HSET', KEYS[2], unpack(ARGV, base + 1, base + 2 * n))
+end
+local rest = base + 1 + 2 * n
+if #ARGV >= rest then
+  redis.call('HSET', KEYS[3], unpack(ARGV, rest, #ARGV))
+end
+return 1
+"""
+
+# Presence ZADD of the command (non-REDIS_LUA_INGEST) user path: the role
+# counters need the ZADD result atomically.
+# KEYS[1] = users:active:site:{site}, KEYS[2] = user:session:{id},
+# KEYS[3] = users:active:roles:site:{site}; ARGV[1] = now, ARGV[2] = session_id,
+# ARGV[3] = role or ""
+USER_PRESENCE_LUA = """
+local zset, session, roles = KEYS[1], KEYS[2], KEYS[3]
+local now, session_id, role = ARGV[1], ARGV[2], ARGV[3]
+""" + _SESSION_PRESENCE_LUA + """
+return 1
+"""
+
+# Logout: remove the session from presence, its role counter and its snapshot.
+# KEYS[1] = users:active:site:{site}, KEYS[2] = user:session:{id},
+# KEYS[3] = users:active:roles:site:{site}; ARGV[1] = session_id
+SESSION_REMOVE_LUA = """
+local removed = redis.call('ZREM', KEYS[1], ARGV[1])
+if removed == 1 then
+  redis.call('HINCRBY', KEYS[3], redis.call('HGET', KEYS[2], 'role') or 'unknown', -1)
+end
+redis.call('DEL', KEYS[2])
+return removed
+"""
+
+# Used by the presence sweeper's consistency check: recount a site's role
+# counters from its presence zset and session hashes, replacing the hash if it
+# drifted. O(site sessions) in one call.
+# KEYS[1] = users:active:site:{site}, KEYS[2] = users:active:roles:site:{site}
+# ARGV[1] = session hash key prefix. Returns the total absolute drift.
+USER_ROLE_RECOUNT_LUA = """
+local counts = {}
+for _, m in ipairs(redis.call('ZRANGE', KEYS[1], 0, -1)) do
+  local role = redis.call('HGET', ARGV[1] .. m, 'role') or 'unknown'
+  counts[role] = (counts[role] or 0) + 1
+end
+local have = {}
+local stored = redis.call('HGETALL', KEYS[2])
+for i = 1, #stored, 2 do
+  have[stored[i]] = tonumber(stored[i + 1])
+end
+local drift, zeros = 0, false
+for role, n in pairs(have) do
+  drift = drift + math.abs(n - (counts[role] or 0))
+  zeros = zeros or n == 0
+end
+for role, n in pairs(counts) do
+  if have[role] == nil then
+    drift = drift + n
+  end
+end
+if drift > 0 or zeros then
+  redis.call('DEL', KEYS[2])
+  for role, n in pairs(counts) do
+    redis.call('HSET', KEYS[2], role, n)
+  end
+end
+return drift
+"""
+
+# Snapshot pagination over a presence zset, newest first.
+# KEYS[1] = presence zset, KEYS[2] = snapshot zset of this walk
+# ARGV[1] = as_of (max score), ARGV[2] = min score, ARGV[3] = page size,
+# ARGV[4] = offset into the snapshot or "" for the first page,
+# ARGV[5] = snapshot TTL (seconds, refreshed on every page)
+# Returns {more, {member, score, ...}} in ZREVRANGE order, or {-1} if the
+# snapshot expired. The first page copies the window into KEYS[2]
+# (ZRANGESTORE) unless it fits in one page; later pages read ranks of that
+# frozen copy, so refreshes and trims during the walk neither skip nor repeat
+# members. The snapshot is deleted with the last page.
+PRESENCE_PAGE_LUA = """
+local limit = tonumber(ARGV[3])
+if ARGV[4] == '' then
+  local page = redis.call('ZREVRANGEBYSCORE', KEYS[1], ARGV[1], ARGV[2], 'WITHSCORES', 'LIMIT', 0, limit + 1)
+  if #page <= 2 * limit then
+    return {0, page}
+  end
+  page[#page] = nil
+  page[#page] = nil
+  redis.call('ZRANGESTORE', KEYS[2], KEYS[1], ARGV[2], ARGV[1], 'BYSCORE')
+  redis.call('EXPIRE', KEYS[2], ARGV[5])
+  return {1, page}
+end
+if redis.call('EXPIRE', KEYS[2], ARGV[5]) == 0 then
+  return {-1}
+end
+local offset = tonumber(ARGV[4])
+local page = redis.call('ZREVRANGE', KEYS[2], offset, offset + limit - 1, 'WITHSCORES')
+if offset + limit >= redis.call('ZCARD', KEYS[2]) then
+  redis.call('DEL', KEYS[2])
+  return {0, page}
+end
+return {1, page}
+"""
+
+# KEYS[1..N]      = rollup bucket hashes (e.g. minute and hour bucket)
+# ARGV[1..N]      = EXPIREAT timestamp per bucket
+# ARGV[N+1..]     = per metric: name, count, sum, min, max (pre-aggregated partial)
+ROLLUP_MERGE_LUA = """
+local nkeys = #KEYS
+for k = 1, nkeys do
+  local key = KEYS[k]
+  local i = nkeys + 1
+  while i <= #ARGV do
+    local m = ARGV[i]
+    redis.call('HINCRBY', key, m .. ':count', ARGV[i + 1])
+    redis.call('HINCRBYFLOAT', key, m .. ':sum', ARGV[i + 2])
+    local cur = redis.call('HGET', key, m .. ':min')
+    if not cur or tonumber(ARGV[i + 3]) < tonumber(cur) then
+      redis.call('HSET', key, m .. ':min', ARGV[i + 3])
+    end
+    cur = redis.call('HGET', key, m .. ':max')
+    if not cur or tonumber(ARGV[i + 4]) > tonumber(cur) then
+      redis.call('HSET', key, m .. ':max', ARGV[i + 4])
+    end
+    i = i + 5
+  end
+  redis.call('EXPIREAT', key, ARGV[k])
+end
+return nkeys
+"""
+
+# Used by the presence sweeper, not the ingest path.
+# KEYS[1] = presence zset; optional KEYS[2] = per-role counter hash (users)
+# ARGV[1] = cutoff score, ARGV[2] = snapshot hash key prefix ("" = secondary
+# index, no hashes), ARGV[3] = max members per call.
+# Stale members, their snapshot hashes and role counts are removed atomically,
+# so a device or session that re-reports concurrently keeps its hash.
+PRESENCE_SWEEP_LUA = """
+local stale = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, tonumber(ARGV[3]))
+if #stale == 0 then
+  return 0
+end
+if ARGV[2] ~= '' then
+  for _, m in ipairs(stale) do
+    if KEYS[2] then
+      redis.call('HINCRBY', KEYS[2], redis.call('HGET', ARGV[2] .. m, 'role') or 'unknown', -1)
+    end
+    redis.call('DEL', ARGV[2] .. m)
+  end
+end
+redis.call('ZREM', KEYS[1], unpack(stale))
+return #stale
+"""
+
+# Used by the presence sweeper's orphan pass: delete snapshot hashes whose
+# last_seen is older than the cutoff. The check and the DEL run atomically, so a
+# hash re-reported between the SCAN and the delete is kept.
+# KEYS = candidate snapshot hashes; ARGV[1] = cutoff, ARGV[2] = compact field name
+# (device_codec: u8 version, then u32 little-endian last_seen_ts).
+# Hashes with neither timestamp are deleted. Returns the number deleted.
+ORPHAN_DELETE_LUA = """
+local cutoff = tonumber(ARGV[1])
+local deleted = 0
+for _, key in ipairs(KEYS) do
+  local ts = redis.call('HGET', key, 'last_seen_ts')
+  if ts then
+    ts = tonumber(ts)
+  else
+    local packed = redis.call('HGET', key, ARGV[2])
+    if packed and #packed >= 5 then
+      local b1, b2, b3, b4 = string.byte(packed, 2, 5)
+      ts = b1 + b2 * 256 + b3 * 65536 + b4 * 16777216
+    end
+  end
+  if not ts or ts < cutoff then
+    deleted = deleted + redis.call('DEL', key)
+  end
+end
+return deleted
+"""
+
+# Used by log_service.migrate_hash_counts: move counter fields from a hash into
+# a sorted set. Fields are re-read inside the script, so concurrent migrators
+# (every instance runs it at startup) never move a count twice.
+# KEYS[1] = source hash, KEYS[2] = destination zset; ARGV = fields to move
+HASH_TO_ZSET_LUA = """
+local moved = 0
+for _, f in ipairs(ARGV) do
+  local c = redis.call('HGET', KEYS[1], f)
+  if c then
+    redis.call('ZINCRBY', KEYS[2], c, f)
+    redis.call('HDEL', KEYS[1], f)
+    moved = moved + 1
+  end
+end
+return moved
+"""
+
+# KEYS[1] = logs:hh:{dims}:{status}:cms   (string of u32 counters)
+# KEYS[2] = logs:hh:{dims}:{status}:topk  (zset, at most K members)
+# KEYS[3] = logs:hh:{dims}:{status}:n     (total count)
+# ARGV[1] = depth, ARGV[2] = K
+# ARGV[3..] = per ip: member, n, then `depth` counter indexes
+# Adds n to the ip's counters, scores it with the minimum (the Count-Min
+# estimate) and keeps it in the top-K set if it is already there, there is room,
+# or its estimate beats the current minimum (which is then evicted).
+HEAVY_HITTERS_ADD_LUA = """
+local depth, k = tonumber(ARGV[1]), tonumber(ARGV[2])
+local size = redis.call('ZCARD', KEYS[2])
+local total = 0
+local i = 3
+while i <= #ARGV do
+  local member, n = ARGV[i], ARGV[i + 1]
+  local ops = {'OVERFLOW', 'SAT'}
+  for j = 1, depth do
+    local o = #ops
+    ops[o + 1] = 'INCRBY'
+    ops[o + 2] = 'u32'
+    ops[o + 3] = '#' .. ARGV[i + 1 + j]
+    ops[o + 4] = n
+  end
+  i = i + 2 + depth
+  total = total + tonumber(n)
+  local est = math.huge
+  for _, v in ipairs(redis.call('BITFIELD', KEYS[1], unpack(ops))) do
+    if v < est then est = v end
+  end
+  if redis.call('ZSCORE', KEYS[2], member) or size < k then
+    size = size + redis.call('ZADD', KEYS[2], est, member)
+  else
+    local low = redis.call('ZRANGE', KEYS[2], 0, 0, 'WITHSCORES')
+    if est > tonumber(low[2]) then
+      redis.call('ZREM', KEYS[2], low[1])
+      redis.call('ZADD', KEYS[2], est, member)
+    end
+  end
+end
+while size > k do
+  redis.call('ZPOPMIN', KEYS[2])
+  size = size - 1
+end
+redis.call('INCRBY', KEYS[3], total)
+return total
+"""
+
+
+# Used by log_templates: merge one process's template count deltas into the
+# shared view and keep it to the ARGV[1] most recently seen templates.
+# KEYS[1] = counts zset, KEYS[2] = last-seen zset, KEYS[3] = info hash
+# ARGV[2..] = per template: id, count delta, last seen ("" = unchanged), info JSON ("" = none)
+# A negative delta takes back counts a process wrote under a template that has
+# since generalised; a template left with no count is removed.
+TEMPLATES_MERGE_LUA = """
+local max = tonumber(ARGV[1])
+for i = 2, #ARGV, 4 do
+  local id = ARGV[i]
+  local count = tonumber(redis.call('ZINCRBY', KEYS[1], ARGV[i + 1], id))
+  if count <= 0 then
+    redis.call('ZREM', KEYS[1], id)
+    redis.call('ZREM', KEYS[2], id)
+    redis.call('HDEL', KEYS[3], id)
+  else
+    if ARGV[i + 2] ~= '' then
+      local seen = redis.call('ZSCORE', KEYS[2], id)
+      if not seen or tonumber(seen) < tonumber(ARGV[i + 2]) then
+        redis.call('ZADD', KEYS[2], ARGV[i + 2], id)
+      end
+    end
+    if ARGV[i + 3] ~= '' then
+      redis.call('HSETNX', KEYS[3], id, ARGV[i + 3])
+    end
+  end
+end
+local excess = redis.call('ZCARD', KEYS[2]) - max
+if excess > 0 then
+  for _, id in ipairs(redis.call('ZRANGE', KEYS[2], 0, excess - 1)) do
+    redis.call('ZREM', KEYS[1], id)
+    redis.call('HDEL', KEYS[3], id)
+  end
+  redis.call('ZREMRANGEBYRANK', KEYS[2], 0, excess - 1)
+end
+return excess
+"""
+
+# Used by the log file tailer: per-path leases, so only one tailer (of all API
+# workers and standalone runs sharing a collector id) reads a file at a time.
+# KEYS[1] = lease key; ARGV[1] = owner, ARGV[2] = ttl ms
+# Takes a free lease or renews our own; returns 1 if we hold it.
+LEASE_RENEW_LUA = """
+local owner = redis.call('GET', KEYS[1])
+if owner and owner ~= ARGV[1] then
+  return 0
+end
+redis.call('SET', KEYS[1], ARGV[1], 'PX', ARGV[2])
+return 1
+"""
+
+# KEYS[1] = lease key; ARGV[1] = owner. Deletes the lease only if we hold it.
+LEASE_RELEASE_LUA = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+  return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
+class IngestScript:
+    """A Lua script addressed by SHA, loaded lazily and reloaded on NOSCRIPT."""
+
+    def __init__(self, name: str, source: str):
+        self.name = name
+        self.source = source
+        self.sha = hashlib.sha1(source.encode()).hexdigest()
+        self._loaded = False
+
+    async def load(self, r: Redis) -> None:
+        sha = await r.script_load(self.source)
+        if sha != self.sha:
+            raise RuntimeError(f"SHA mismatch for Lua script {self.name}: {sha} != {self.sha}")
+        self._loaded = True
+
+    async def __call__(self, r: Redis, keys: Sequence[str], args: Sequence[Any]) -> Any:
+        if not self._loaded:
+            await self.load(r)
+        try:
+            return await r.evalsha(self.sha, len(keys), *keys, *args)
+        except NoScriptError:
+            logger.warning(f"Lua script {self.name} missing from Redis script cache, reloading")
+            await self.load(r)
+            return await r.evalsha(self.sha, len(keys), *keys, *args)
+
+    def queue(self, pipe: Pipeline, keys: Sequence[str], args: Sequence[Any]) -> None:
+        """Add an EVALSHA to a pipeline (see execute_pipeline for NOSCRIPT handling)."""
+        pipe.evalsha(self.sha, len(keys), *keys, *args)
+
+
+telemetry_ingest = IngestScript("telemetry_ingest", TELEMETRY_INGEST_LUA)
+user_ingest = IngestScript("user_ingest", USER_INGEST_LUA)
+user_presence = IngestScript("user_presence", USER_PRESENCE_LUA)
+session_remove = IngestScript("session_remove", SESSION_REMOVE_LUA)
+user_role_recount = IngestScript("user_role_recount", USER_ROLE_RECOUNT_LUA)
+presence_sweep = IngestScript("presence_sweep", PRESENCE_SWEEP_LUA)
+orphan_delete = IngestScript("orphan_delete", ORPHAN_DELETE_LUA)
+rollup_merge = IngestScript("rollup_merge", ROLLUP_MERGE_LUA)
+presence_page = IngestScript("presence_page", PRESENCE_PAGE_LUA)
+hash_to_zset = IngestScript("hash_to_zset", HASH_TO_ZSET_LUA)
+heavy_hitters_add = IngestScript("heavy_hitters_add", HEAVY_HITTERS_ADD_LUA)
+templates_merge = IngestScript("templates_merge", TEMPLATES_MERGE_LUA)
+lease_renew = IngestScript("lease_renew", LEASE_RENEW_LUA)
+lease_release = IngestScript("lease_release", LEASE_RELEASE_LUA)
+
+ALL_SCRIPTS = (
+    telemetry_ingest, user_ingest, user_presence, session_remove, user_role_recount,
+    presence_sweep, orphan_delete, rollup_merge, presence_page, hash_to_zset, heavy_hitters_add,
+    templates_merge, lease_renew, lease_release,
+)
+
+
+async def load_scripts(r: Redis) -> None:
+    """SCRIPT LOAD every script (startup, or after a cache flush)."""
+    for script in ALL_SCRIPTS:
+        await script.load(r)
+
+
+async def execute_pipeline(
+    r: Redis, build: Callable[[Pipeline], None], raise_on_error: bool = True, transaction: bool = False
+) -> List[Any]:
+    """
+    Build and execute a pipeline that may contain EVALSHA calls (non-transactional
+    unless transaction=True, which wraps it in MULTI/EXEC).
+
+    On NOSCRIPT the scripts are reloaded and only the commands that failed with
+    NOSCRIPT are sent again (the rest of the pipeline already ran and may not be
+    idempotent); with transaction=True that retry runs after the EXEC. Replies
+    come back in queue order. Like Pipeline.execute, the first command error is
+    raised unless raise_on_error=False, in which case failed commands are
+    returned as exception objects in their reply slots.
+    """
+    for script in ALL_SCRIPTS:
+        if not script._loaded:
+            await script.load(r)
+
+    pipe = r.pipeline(transaction=transaction)
+    build(pipe)
+    commands = [args for args, _ in pipe.command_stack]
+    replies = await pipe.execute(raise_on_error=False)
+
+    missing = [i for i, reply in enumerate(replies) if isinstance(reply, NoScriptError)]
+    if missing:
+        logger.warning(
+            f"Lua scripts missing from Redis script cache, reloading and retrying {len(missing)} script calls"
+        )
+        await load_scripts(r)
+        retry = r.pipeline(transaction=False)
+        for i in missing:
+            retry.execute_command(*commands[i])
+        for i, reply in zip(missing, await retry.execute(raise_on_error=False)):
+            replies[i] = reply
+
+    if raise_on_error:
+        for reply in replies:
+            if isinstance(reply, ResponseError):
+                raise reply
+    return replies
+
+
+def flatten_mapping(mapping: Dict[str, str]) -> List[str]:
+    """{'a': '1', 'b': '2'} -> ['a', '1', 'b', '2'] for HSET-style ARGV."""
+    out: List[str] = []
+    for k, v in mapping.items():
+        out.append(k)
+        out.append(v)
+    return out
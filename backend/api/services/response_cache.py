@@ -0,0 +1,80 @@
+"""
+Short-TTL read-through cache with single-flight coalescing for dashboard reads.
+
+Every dashboard viewer polls the same few endpoints. Results are cached per
+key for a small TTL (the maximum staleness a viewer can see), and concurrent
+misses for the same key share one in-flight computation instead of each
+hitting Redis. Failures are never cached; every waiter sees the exception.
+
+Process-local by design: each backend instance computes at most once per key
+per TTL.
+"""
+
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, Tuple
+
+from api.core.config import settings
+
+
+class ResponseCache:
+    def __init__(self, max_entries: int | None = None):
+        self.max_entries = max_entries or settings.RESPONSE_CACHE_MAX_ENTRIES
+        self._entries: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+        self._inflight: Dict[Hashable, asyncio.Task] = {}
+        self.stats: Dict[str, int] = {"hits": 0, "misses": 0, "coalesced": 0, "errors": 0}
+
+    async def get_or_compute(self, key: Hashable, ttl: float, compute: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Cached value for key if younger than ttl seconds, otherwise the result of
+        compute() shared by every concurrent caller. ttl <= 0 bypasses the cache.
+        """
+        if ttl <= 0:
+            return await compute()
+
+        entry = self._entries.get(key)
+        if entry is not None and time.monotonic() < entry[0]:
+            self.stats["hits"] += 1
+            self._entries.move_to_end(key)
+            return entry[1]
+
+        task = self._inflight.get(key)
+        if task is not None:
+            self.stats["coalesced"] += 1
+        else:
+            self.stats["misses"] += 1
+            task = asyncio.ensure_future(self._compute(key, ttl, compute))
+            self._inflight[key] = task
+        # shield: a disconnecting client must not cancel the shared computation
+        return await asyncio.shield(task)
+
+    async def _compute(self, key: Hashable, ttl: float, compute: Callable[[], Awaitable[Any]]) -> Any:
+        try:
+            value = await compute()
+        except Exception:
+            self.stats["errors"] += 1
+            raise
+        finally:
+            self._inflight.pop(key, None)
+        # TTL runs from completion, so staleness is bounded by ttl
+        self._entries[key] = (time.monotonic() + ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        return value
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    def metrics(self) -> Dict[str, Any]:
+        lookups = self.stats["hits"] + self.stats["misses"] + self.stats["coalesced"]
+        return {
+            **self.stats,
+            "entries": len(self._entries),
+            "inflight": len(self._inflight),
+            "hit_ratio": round((self.stats["hits"] + self.stats["coalesced"]) / lookups, 4) if lookups else 0.0,
+        }
+
+
+response_cache = ResponseCache()
@@ -0,0 +1,136 @@
+"""
+Per-site, per-device-type metric rollups.
+
+Ingest folds every numeric telemetry metric into two bucket hashes per
+(site, device_type): one per minute and one per hour. Each bucket keeps
+count/sum/min/max per metric (avg = sum / count), so trend queries read a few
+hundred small hashes instead of every device:{key} snapshot.
+
+Events in a batch are pre-aggregated in Python and merged with one
+rollup_merge script call per (site, device_type), queued on the ingest
+pipeline. Hour buckets are maintained incrementally alongside minute buckets
+(exact, no downsampling job); both expire after their own retention.
+"""
+
+import time
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from api.core.config import settings
+from api.models.schemas import TelemetryEvent
+from api.services import redis_scripts
+from api.services.redis_client import get_redis
+
+MINUTE = 60
+HOUR = 3600
+RESOLUTIONS = {"minute": MINUTE, "hour": HOUR}
+MAX_POINTS = 1440
+
+# metric -> [count, sum, min, max]
+Partial = Dict[str, List[float]]
+
+
+def k_rollup(resolution: str, site_id: str, device_type: str, bucket_ts: int) -> str:
+    return f"rollup:{resolution}:{site_id}:{device_type}:{bucket_ts}"   # hash: {metric}:{count|sum|min|max}
+
+
+def aggregate(events: Iterable[TelemetryEvent]) -> Dict[Tuple[str, str], Partial]:
+    """Pre-aggregate numeric metrics per (site_id, device_type)."""
+    groups: Dict[Tuple[str, str], Partial] = {}
+    for evt in events:
+        if not evt.metrics:
+            continue
+        partial = groups.setdefault((evt.site_id, evt.device_type), {})
+        for name, value in evt.metrics.items():
+            acc = partial.get(name)
+            if acc is None:
+                partial[name] = [1, value, value, value]
+            else:
+                acc[0] += 1
+                acc[1] += value
+                if value < acc[2]:
+                    acc[2] = value
+                if value > acc[3]:
+                    acc[3] = value
+    return groups
+
+
+def queue_merge(pipe, groups: Dict[Tuple[str, str], Partial], now: int) -> None:
+    """Queue one rollup_merge per (site, device_type) on an ingest pipeline."""
+    minute = now - now % MINUTE
+    hour = now - now % HOUR
+    minute_expire = minute + MINUTE + settings.ROLLUP_MINUTE_RETENTION_SEC
+    hour_expire = hour + HOUR + settings.ROLLUP_HOUR_RETENTION_SEC
+
+    for (site_id, device_type), partial in groups.items():
+        args: List[Any] = [minute_expire, hour_expire]
+        for name, (count, total, lo, hi) in partial.items():
+            args.extend((name, int(count), repr(total), repr(lo), repr(hi)))
+        redis_scripts.rollup_merge.queue(
+            pipe,
+            [k_rollup("minute", site_id, device_type, minute), k_rollup("hour", site_id, device_type, hour)],
+            args,
+        )
+
+
+def _decode_bucket(raw: Dict[str, str], metric: Optional[str]) -> Dict[str, Dict[str, float]]:
+    out: Dict[str, Dict[str, float]] = {}
+    for field, value in raw.items():
+        name, _, stat = field.rpartition(":")
+        if metric and name != metric:
+            continue
+        out.setdefault(name, {})[stat] = float(value)
+    for stats in out.values():
+        count = stats.get("count", 0)
+        stats["count"] = int(count)
+        stats["avg"] = stats.pop("sum", 0.0) / count if count else 0.0
+    return out
+
+
+async def get_rollups(
+    site_id: str,
+    device_type: str,
+    metric: Optional[str] = None,
+    start: Optional[int] = None,
+    end: Optional[int] = None,
+    resolution: str = "auto",
+) -> Dict[str, Any]:
+    """
+    Time series of min/max/avg/count per bucket for one site and device type.
+    resolution="auto" uses minutes for ranges up to 6h, hours beyond that.
+    Raises ValueError for an unknown resolution or a range over MAX_POINTS buckets.
+    """
+    end = end or int(time.time())
+    start = start if start is not None else end - HOUR
+    if start > end:
+        raise ValueError("start must be <= end")
+
+    if resolution == "auto":
+        resolution = "minute" if end - start <= 6 * HOUR else "hour"
+    if resolution not in RESOLUTIONS:
+        raise ValueError(f"resolution must be one of: auto, {', '.join(RESOLUTIONS)}")
+    step = RESOLUTIONS[resolution]
+
+    buckets = list(range(start - start % step, end + 1, step))
+    if len(buckets) > MAX_POINTS:
+        raise ValueError(f"range spans {len(buckets)} {resolution} buckets (max {MAX_POINTS})")
+
+    r = await get_redis()
+    pipe = r.pipeline(transaction=False)
+    for ts in buckets:
+        pipe.hgetall(k_rollup(resolution, site_id, device_type, ts))
+    raw_buckets = await pipe.execute()
+
+    points = [
+        {"ts": ts, "metrics": _decode_bucket(raw, metric)}
+        for ts, raw in zip(buckets, raw_buckets)
+        if raw
+    ]
+    return {
+        "site_id": site_id,
+        "device_type": device_type,
+        "metric": metric,
+        "resolution": resolution,
+        "start": start,
+        "end": end,
+        "points": points,
+    }
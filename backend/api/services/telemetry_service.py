@@ -1,6 +1,13 @@
+import base64
+import json
 import time
-from typing import Dict, Any
-from api.services.redis_client import get_redis
+import uuid
+from collections import defaultdict
+from typing import Dict, Any, AsyncIterator, List, Optional, Tuple
+from pydantic import ValidationError
+from api.services.redis_client import get_redis, get_redis_binary
+from api.services import device_codec
+from api.services import distinct_service, redis_scripts, rollup_service
 from api.core.config import settings
 from api.models.schemas import TelemetryEvent
 
@@ -8,25 +15,29 @@ from api.models.schemas import TelemetryEvent
 def k_device_zset_site(site_id: str) -> str:
     return f"devices:active:site:{site_id}"      # zset: member=device_key, score=last_seen_ts
 
+def k_device_sites() -> str:
+    return "devices:sites"                       # zset: member=site_id, score=last activity ts
+
+def k_device_zset_site_type(site_id: str, device_type: str) -> str:
+    return f"devices:active:sitetype:{site_id}|{device_type}"   # zset: same members, one device_type
+
+def k_device_site_types() -> str:
+    return "devices:site_types"                  # zset: member="site|type", score=last activity ts
+
 def k_device_hash(device_key: str) -> str:
     return f"device:{device_key}"                # hash: device metadata/metrics
 
+def k_device_page_snapshot(token: str) -> str:
+    return f"devices:page:{token}"               # zset: frozen presence window of one paginated walk
+
 def device_key(site_id: str, device_type: str, device_id: str) -> str:
     return f"{site_id}|{device_type}|{device_id}"
 
-async def ingest_telemetry(evt: TelemetryEvent) -> None:
-    """
-    Called by MQTT consumer worker each message.
-    Stores last_seen presence in a zset and cache metrics in hash.
-    """
-    r = await get_redis()
-    now = int(time.time())
-    dkey = device_key(evt.site_id, evt.device_type, evt.device_id)
-
-    # Update presence (zset per site)
-    await r.zadd(k_device_zset_site(evt.site_id), {dkey: now})
-
-    # Cache a small snapshot (hash)
+def _snapshot_mapping(evt: TelemetryEvent, now: int) -> Dict[str, Any]:
+    if settings.DEVICE_SNAPSHOT_COMPACT:
+        packed = device_codec.encode_snapshot(evt.device_type, evt.metrics, now)
+        if packed is not None:
+            return {device_codec.COMPACT_FIELD: packed}
     mapping = {
         "site_id": evt.site_id,
         "device_type": evt.device_type,
@@ -37,46 +48,269 @@ async def ingest_telemetry(evt: TelemetryEvent) -> None:
         # flatten a few numeric metrics; keep it small
         for mk, mv in evt.metrics.items():
             mapping[f"m:{mk}"] = str(mv)
-    await r.hset(k_device_hash(dkey), mapping=mapping)
+    return mapping
+
+def _queue_snapshot(pipe, dkey: str, mapping: Dict[str, Any]) -> None:
+    """HSET a snapshot and drop the other format's fields (DEVICE_SNAPSHOT_COMPACT may have toggled)."""
+    key = k_device_hash(dkey)
+    if device_codec.COMPACT_FIELD in mapping:
+        pipe.delete(key)                         # a compact snapshot replaces the whole hash
+    else:
+        pipe.hdel(key, device_codec.COMPACT_FIELD)
+    pipe.hset(key, mapping=mapping)
 
-    # Optional: trim old presence beyond window
-    window = settings.DEVICE_PRESENCE_WINDOW_SEC
-    await r.zremrangebyscore(k_device_zset_site(evt.site_id), 0, now - window)
+def _script_device_args(evt: TelemetryEvent, now: int) -> List[Any]:
+    """Per-device ARGV block for the telemetry_ingest script: member, field count, pairs."""
+    mapping = _snapshot_mapping(evt, now)
+    return [device_key(evt.site_id, evt.device_type, evt.device_id), str(len(mapping)),
+            *redis_scripts.flatten_mapping(mapping)]
 
-async def get_active_devices(site_id: str | None = None, limit: int = 20) -> Dict[str, Any]:
+async def ingest_telemetry(evt: TelemetryEvent) -> None:
     """
-    Returns 'active' devices within presence window (per site or all sites collected).
-    For demo: fetch per-site if provided; otherwise returns {site: count, details: []} across discovered sites.
+    Single-event HTTP ingest (the MQTT consumer uses ingest_telemetry_batch).
+    Stores last_seen presence in a zset and cache metrics in hash.
+    One round trip through a non-transactional pipeline: one EVALSHA with
+    REDIS_LUA_INGEST, otherwise presence and registry ZADDs plus the snapshot HSET.
+    Entries older than the presence window are trimmed by the presence sweeper.
+    Metric rollups and distinct-device HLLs ride along on the same pipeline.
     """
     r = await get_redis()
     now = int(time.time())
-    min_score = now - settings.DEVICE_PRESENCE_WINDOW_SEC
+    dkey = device_key(evt.site_id, evt.device_type, evt.device_id)
+    site_type = f"{evt.site_id}|{evt.device_type}"
+    rollups = rollup_service.aggregate([evt]) if settings.METRIC_ROLLUPS_ENABLED else {}
 
-    async def site_summary(sid: str):
-        # Count
-        count = await r.zcount(k_device_zset_site(sid), min_score, now)
-        # Top recently seen
-        members = await r.zrevrangebyscore(k_device_zset_site(sid), max=now, min=min_score, start=0, num=limit)
-        # Fetch hashes for details
-        pipe = r.pipeline(transaction=False)
-        for m in members:
-            pipe.hgetall(k_device_hash(m))
-        details = await pipe.execute()
-        return {"site_id": sid, "active_count": count, "devices": details}
+    def build(pipe) -> None:
+        if settings.REDIS_LUA_INGEST:
+            redis_scripts.telemetry_ingest.queue(
+                pipe,
+                [k_device_zset_site(evt.site_id), k_device_sites(),
+                 k_device_zset_site_type(evt.site_id, evt.device_type), k_device_site_types(),
+                 k_device_hash(dkey)],
+                [now, evt.site_id, site_type, *_script_device_args(evt, now)],
+            )
+        else:
+            # Presence (zset per site and per site+type), the registries and a small
+            # snapshot (hash; one packed field with DEVICE_SNAPSHOT_COMPACT)
+            pipe.zadd(k_device_zset_site(evt.site_id), {dkey: now})
+            pipe.zadd(k_device_sites(), {evt.site_id: now})
+            pipe.zadd(k_device_zset_site_type(evt.site_id, evt.device_type), {dkey: now})
+            pipe.zadd(k_device_site_types(), {site_type: now})
+            _queue_snapshot(pipe, dkey, _snapshot_mapping(evt, now))
+        rollup_service.queue_merge(pipe, rollups, now)
+        if settings.DISTINCT_HLL_ENABLED:
+            distinct_service.queue_pfadd(pipe, {evt.site_id: [dkey]}, now)
 
-    if site_id:
-        return await site_summary(site_id)
+    await redis_scripts.execute_pipeline(r, build)
+
+async def ingest_telemetry_batch(events: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Bulk variant of ingest_telemetry for HTTP batch ingest and the MQTT consumer.
+    Each raw event is validated on its own so one bad event does not sink the batch.
+    Valid events are grouped by (site, device_type) and written through one
+    non-transactional pipeline: presence ZADDs per site and per site+type, registry
+    ZADDs, one HSET per device (or, with REDIS_LUA_INGEST, one EVALSHA per group),
+    plus one rollup merge per group and one PFADD per site and HLL resolution.
+    """
+    now = int(time.time())
+    groups: Dict[Tuple[str, str], List[TelemetryEvent]] = defaultdict(list)
+    errors: List[Dict[str, Any]] = []
+
+    for idx, raw in enumerate(events):
+        try:
+            evt = TelemetryEvent.model_validate(raw)
+        except ValidationError as e:
+            first = e.errors(include_url=False)[0]
+            errors.append({
+                "index": idx,
+                "field": ".".join(str(part) for part in first["loc"]),
+                "error": first["msg"],
+            })
+            continue
+        groups[(evt.site_id, evt.device_type)].append(evt)
+
+    accepted = sum(len(evts) for evts in groups.values())
+    if accepted:
+        r = await get_redis()
+
+        def build(pipe) -> None:
+            for (sid, dtype), evts in groups.items():
+                if settings.REDIS_LUA_INGEST:
+                    keys = [k_device_zset_site(sid), k_device_sites(),
+                            k_device_zset_site_type(sid, dtype), k_device_site_types()]
+                    args: List[Any] = [now, sid, f"{sid}|{dtype}"]
+                    for evt in evts:
+                        keys.append(k_device_hash(device_key(evt.site_id, evt.device_type, evt.device_id)))
+                        args.extend(_script_device_args(evt, now))
+                    redis_scripts.telemetry_ingest.queue(pipe, keys, args)
+                    continue
+                presence: Dict[str, int] = {}
+                for evt in evts:
+                    dkey = device_key(evt.site_id, evt.device_type, evt.device_id)
+                    presence[dkey] = now
+                    _queue_snapshot(pipe, dkey, _snapshot_mapping(evt, now))
+                pipe.zadd(k_device_zset_site(sid), presence)
+                pipe.zadd(k_device_zset_site_type(sid, dtype), presence)
+            if not settings.REDIS_LUA_INGEST:
+                pipe.zadd(k_device_sites(), {sid: now for sid, _ in groups})
+                pipe.zadd(k_device_site_types(), {f"{sid}|{dtype}": now for sid, dtype in groups})
+            if settings.METRIC_ROLLUPS_ENABLED:
+                rollup_service.queue_merge(
+                    pipe, rollup_service.aggregate(e for evts in groups.values() for e in evts), now
+                )
+            if settings.DISTINCT_HLL_ENABLED:
+                members_by_site: Dict[str, List[str]] = defaultdict(list)
+                for (sid, _), evts in groups.items():
+                    members_by_site[sid].extend(device_key(e.site_id, e.device_type, e.device_id) for e in evts)
+                distinct_service.queue_pfadd(pipe, members_by_site, now)
+
+        await redis_scripts.execute_pipeline(r, build)
+
+    return {
+        "accepted": accepted,
+        "rejected": len(errors),
+        "sites": len({sid for sid, _ in groups}),
+        "errors": errors,
+    }
+
+async def active_sites(min_score: float = 0) -> List[str]:
+    """
+    Sites with device activity at or after min_score, read from the site registry
+    maintained at ingest: O(log S + sites) instead of a keyspace SCAN.
+    """
+    r = await get_redis()
+    return await r.zrangebyscore(k_device_sites(), min_score, "+inf")
+
+async def fetch_device_details(members: List[str]) -> List[Dict[str, str]]:
+    """
+    HGETALL the snapshot of each presence member in one pipeline. Read as bytes so
+    compact snapshots can be decoded; both formats come back as the same dict.
+    """
+    if not members:
+        return []
+    rb = await get_redis_binary()
+    pipe = rb.pipeline(transaction=False)
+    for m in members:
+        pipe.hgetall(k_device_hash(m))
+    raws = await pipe.execute()
+    return [device_codec.decode_snapshot(m, raw) for m, raw in zip(members, raws)]
 
-    # Discover sites (lightweight heuristic: scan for our zset key pattern)
-    sites = []
-    async for key in r.scan_iter(match="devices:active:site:*", count=100):
-        sites.append(key.split(":")[-1])
+async def site_summaries(
+    sites: List[str], min_score: float, max_score: float, limit: int, counts_only: bool = False
+) -> List[Dict[str, Any]]:
+    """
+    Counts and top-`limit` details for many sites in at most two round trips:
+    one pipeline for every site's ZCOUNT/ZREVRANGEBYSCORE, then one pipeline for
+    every detail hash. counts_only skips member lists and hashes entirely.
+    """
+    if not sites:
+        return []
+    r = await get_redis()
 
-    result = []
-    total = 0
+    pipe = r.pipeline(transaction=False)
     for sid in sites:
-        s = await site_summary(sid)
-        total += s["active_count"]
-        result.append(s)
+        pipe.zcount(k_device_zset_site(sid), min_score, max_score)
+        if not counts_only:
+            pipe.zrevrangebyscore(k_device_zset_site(sid), max=max_score, min=min_score, start=0, num=limit)
+    replies = await pipe.execute()
+
+    step = 1 if counts_only else 2
+    counts = replies[0::step]
+    if counts_only:
+        return [{"site_id": sid, "active_count": c} for sid, c in zip(sites, counts)]
+
+    members_by_site = replies[1::step]
+    details = await fetch_device_details([m for members in members_by_site for m in members])
+
+    result, offset = [], 0
+    for sid, count, members in zip(sites, counts, members_by_site):
+        result.append({"site_id": sid, "active_count": count, "devices": details[offset:offset + len(members)]})
+        offset += len(members)
+    return result
+
+async def get_active_devices(
+    site_id: str | None = None, limit: int = 20, counts_only: bool = False
+) -> Dict[str, Any]:
+    """
+    Returns 'active' devices within presence window (per site or all sites collected).
+    Per-site if site_id is given; otherwise {total, sites: [...]} across registered sites.
+    counts_only returns just the per-site counts (dashboard header tiles).
+    """
+    now = int(time.time())
+    min_score = now - settings.DEVICE_PRESENCE_WINDOW_SEC
+
+    if site_id:
+        return (await site_summaries([site_id], min_score, now, limit, counts_only))[0]
+
+    sites = await active_sites(min_score)
+    result = await site_summaries(sites, min_score, now, limit, counts_only)
+    total = sum(s["active_count"] for s in result)
 
     return {"total_active_devices": total, "sites": result}
+
+def _encode_cursor(as_of: int, token: str, offset: int) -> str:
+    raw = json.dumps([as_of, token, offset], separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def _decode_cursor(cursor: str) -> Tuple[int, str, int]:
+    try:
+        as_of, token, offset = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        return int(as_of), uuid.UUID(token).hex, int(offset)
+    except (ValueError, TypeError) as e:
+        raise ValueError("invalid cursor") from e
+
+async def get_active_devices_page(
+    site_id: str, device_type: str | None = None, limit: int = 100, cursor: str | None = None
+) -> Dict[str, Any]:
+    """
+    One page of a site's active devices, newest first, with hash details.
+
+    The first page pins the window (`as_of`) and, when more pages follow,
+    copies it into a snapshot zset (ZRANGESTORE, DEVICE_PAGE_SNAPSHOT_TTL_SEC);
+    the cursor is an offset into that copy. Every device active at as_of is
+    returned exactly once even if it is refreshed or trimmed during the walk;
+    devices that appear later are not. device_type reads the per-type presence
+    zset, so the filter costs no scan. Raises ValueError on a malformed or
+    expired cursor.
+    """
+    r = await get_redis()
+    if cursor:
+        as_of, token, offset = _decode_cursor(cursor)
+    else:
+        as_of, token, offset = int(time.time()), uuid.uuid4().hex, None
+    min_score = as_of - settings.DEVICE_PRESENCE_WINDOW_SEC
+    zkey = k_device_zset_site_type(site_id, device_type) if device_type else k_device_zset_site(site_id)
+
+    reply = await redis_scripts.presence_page(
+        r, [zkey, k_device_page_snapshot(token)],
+        [as_of, min_score, limit, "" if offset is None else offset, settings.DEVICE_PAGE_SNAPSHOT_TTL_SEC],
+    )
+    if reply[0] == -1:
+        raise ValueError("cursor expired; restart from the first page")
+    more, flat = reply
+    members = flat[0::2]
+
+    next_cursor = None
+    if more:
+        next_cursor = _encode_cursor(as_of, token, (offset or 0) + len(members))
+
+    return {
+        "site_id": site_id,
+        "device_type": device_type,
+        "as_of": as_of,
+        "devices": await fetch_device_details(members),
+        "next_cursor": next_cursor,
+    }
+
+async def iter_active_devices(
+    site_id: str, device_type: str | None = None, page_size: int = 500
+) -> AsyncIterator[Dict[str, str]]:
+    """Walk every active device of a site page by page (see get_active_devices_page)."""
+    cursor: Optional[str] = None
+    while True:
+        page = await get_active_devices_page(site_id, device_type, page_size, cursor)
+        for device in page["devices"]:
+            yield device
+        cursor = page["next_cursor"]
+        if cursor is None:
+            return
@@ -1,6 +1,9 @@
 import time
-from typing import Dict, Any
+from typing import Dict, Any, List, Tuple
+from pydantic import ValidationError
 from api.services.redis_client import get_redis
+from api.services import redis_scripts
+from api.services.quantile_sketch import DDSketch
 from api.core.config import settings
 from api.models.schemas import UserMetric
 
@@ -10,16 +13,46 @@ def k_user_zset_site(site_id: str) -> str:
 def k_user_hash(session_id: str) -> str:
     return f"user:session:{session_id}"          # hash: small snapshot
 
+def k_user_sites() -> str:
+    return "users:sites"                         # zset: member=site_id, score=last activity ts
+
+def k_user_role_counts(site_id: str) -> str:
+    return f"users:active:roles:site:{site_id}"  # hash: role -> sessions in the presence zset
+
 def k_user_metrics_site(site_id: str) -> str:
     return f"users:metrics:site:{site_id}"       # hash: cpu/latency/mem aggregates (last)
 
-async def ingest_user_metric(m: UserMetric) -> None:
-    r = await get_redis()
-    now = int(time.time())
+def k_latency_sketch(site_id: str, resolution: str, bucket_ts: int) -> str:
+    # hash: DDSketch bucket -> count; alpha is part of the key so sketches never mix
+    return f"users:latency_sketch:{settings.USER_LATENCY_SKETCH_ALPHA}:{site_id}:{resolution}:{bucket_ts}"
+
+# Sketch time buckets: resolution -> (bucket seconds, retention setting)
+SKETCH_RESOLUTIONS = {
+    "minute": (60, "USER_SKETCH_MINUTE_RETENTION_SEC"),
+    "hour": (3600, "USER_SKETCH_HOUR_RETENTION_SEC"),
+}
+SKETCH_MAX_BUCKETS = 1440
 
-    # mark presence
-    await r.zadd(k_user_zset_site(m.site_id), {m.session_id: now})
+def _latency_sketch() -> DDSketch:
+    return DDSketch(settings.USER_LATENCY_SKETCH_ALPHA)
 
+def _latency_sketch_targets(site_id: str, now: int) -> List[Tuple[str, int]]:
+    """(sketch key, EXPIREAT) of the site's current minute and hour sketches."""
+    targets = []
+    for resolution, (step, retention_attr) in SKETCH_RESOLUTIONS.items():
+        bucket = now - now % step
+        targets.append((k_latency_sketch(site_id, resolution, bucket), bucket + step + getattr(settings, retention_attr)))
+    return targets
+
+def _queue_latency_sample(pipe, site_id: str, latency_ms: float, now: int) -> None:
+    """Add one latency sample to the site's minute and hour sketches (command path)."""
+    field = _latency_sketch().bucket_key(latency_ms)
+    for key, expire_at in _latency_sketch_targets(site_id, now):
+        pipe.hincrby(key, field, 1)
+        pipe.expireat(key, expire_at)
+
+def _queue_user_metric(pipe, m: UserMetric, now: int) -> None:
+    """Queue presence, session snapshot, site metrics and latency sketch writes for one metric."""
     # small session snapshot
     mapping = {
         "session_id": m.session_id,
@@ -27,23 +60,144 @@ async def ingest_user_metric(m: UserMetric) -> None:
         "user_id": m.user_id,
         "last_seen_ts": str(now),
     }
+    if m.role       is not None: mapping["role"]       = m.role
     if m.latency_ms is not None: mapping["latency_ms"] = str(m.latency_ms)
     if m.cpu_pct    is not None: mapping["cpu_pct"]    = str(m.cpu_pct)
     if m.mem_pct    is not None: mapping["mem_pct"]    = str(m.mem_pct)
 
-    await r.hset(k_user_hash(m.session_id), mapping=mapping)
-
-    # keep last metrics per site (you can evolve this to percentiles)
+    # keep last metrics per site (latency percentiles come from the sketches)
     latest = {}
     if m.latency_ms is not None: latest["latency_ms_last"] = str(m.latency_ms)
     if m.cpu_pct    is not None: latest["cpu_pct_last"]    = str(m.cpu_pct)
     if m.mem_pct    is not None: latest["mem_pct_last"]    = str(m.mem_pct)
-    if latest:
-        await r.hset(k_user_metrics_site(m.site_id), mapping=latest)
 
-    # trim presence window
-    window = settings.USER_PRESENCE_WINDOW_SEC
-    await r.zremrangebyscore(k_user_zset_site(m.site_id), 0, now - window)
+    if settings.REDIS_LUA_INGEST:
+        # presence + role counters + latency sketches + snapshot + site metrics in one script call
+        sketches = _latency_sketch_targets(m.site_id, now) if m.latency_ms is not None else []
+        field = _latency_sketch().bucket_key(m.latency_ms) if sketches else ""
+        redis_scripts.user_ingest.queue(
+            pipe,
+            [k_user_zset_site(m.site_id), k_user_hash(m.session_id),
+             k_user_metrics_site(m.site_id), k_user_sites(), k_user_role_counts(m.site_id),
+             *(key for key, _ in sketches)],
+            [now, m.session_id, m.site_id, m.role or "", field, *(expire_at for _, expire_at in sketches),
+             len(mapping), *redis_scripts.flatten_mapping(mapping), *redis_scripts.flatten_mapping(latest)],
+        )
+    else:
+        # mark presence (scripted: the role counters need the ZADD result)
+        redis_scripts.user_presence.queue(
+            pipe,
+            [k_user_zset_site(m.site_id), k_user_hash(m.session_id), k_user_role_counts(m.site_id)],
+            [now, m.session_id, m.role or ""],
+        )
+        pipe.zadd(k_user_sites(), {m.site_id: now})
+
+        pipe.hset(k_user_hash(m.session_id), mapping=mapping)
+        if latest:
+            pipe.hset(k_user_metrics_site(m.site_id), mapping=latest)
+
+        if m.latency_ms is not None:
+            _queue_latency_sample(pipe, m.site_id, m.latency_ms, now)
+
+async def ingest_user_metric(m: UserMetric) -> None:
+    """
+    One pipelined round trip (a single EVALSHA with REDIS_LUA_INGEST).
+    Presence entries older than the window are trimmed by the presence sweeper.
+    """
+    r = await get_redis()
+    now = int(time.time())
+    await redis_scripts.execute_pipeline(r, lambda pipe: _queue_user_metric(pipe, m, now))
+
+async def ingest_user_batch(events: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Bulk variant of ingest_user_metric (stream consumer). Each raw event is
+    validated on its own; valid ones are written in order through one pipeline.
+    """
+    now = int(time.time())
+    metrics: List[UserMetric] = []
+    errors: List[Dict[str, Any]] = []
+
+    for idx, raw in enumerate(events):
+        try:
+            metrics.append(UserMetric.model_validate(raw))
+        except ValidationError as e:
+            first = e.errors(include_url=False)[0]
+            errors.append({
+                "index": idx,
+                "field": ".".join(str(part) for part in first["loc"]),
+                "error": first["msg"],
+            })
+
+    if metrics:
+        r = await get_redis()
+
+        def build(pipe) -> None:
+            for m in metrics:
+                _queue_user_metric(pipe, m, now)
+
+        await redis_scripts.execute_pipeline(r, build)
+
+    return {"accepted": len(metrics), "rejected": len(errors), "errors": errors}
+
+async def apply_session_events(events: List[Tuple[str, Dict[str, Any]]]) -> Dict[str, Any]:
+    """
+    Apply an ordered batch of session events from the user_activity queue in one
+    pipeline (plus one HMGET round trip when the batch contains logouts).
+    ("metric", UserMetric fields) upserts the session like ingest_user_metric;
+    ("logout", {session_id}) removes it from its site's presence zset and role
+    counter right away instead of waiting for the window to expire, and
+    deletes the snapshot.
+    """
+    now = int(time.time())
+    r = await get_redis()
+
+    # site of each session, from the batch itself first, then from the snapshots
+    sites: Dict[str, str] = {}
+    unknown: List[str] = []
+    for kind, data in events:
+        if kind == "metric" and data.get("session_id") and data.get("site_id"):
+            sites.setdefault(data["session_id"], data["site_id"])
+        elif kind == "logout" and data.get("session_id") and data["session_id"] not in sites:
+            unknown.append(data["session_id"])
+    if unknown:
+        pipe = r.pipeline(transaction=False)
+        for session_id in unknown:
+            pipe.hget(k_user_hash(session_id), "site_id")
+        for session_id, site_id in zip(unknown, await pipe.execute()):
+            if site_id:
+                sites[session_id] = site_id
+
+    ops: List[Tuple[str, Any]] = []
+    rejected = logouts = 0
+    for kind, data in events:
+        if kind == "metric":
+            try:
+                ops.append(("metric", UserMetric.model_validate(data)))
+            except ValidationError:
+                rejected += 1
+        elif kind == "logout" and data.get("session_id"):
+            ops.append(("logout", data["session_id"]))
+            logouts += 1
+        else:
+            rejected += 1
+
+    if ops:
+        def build(pipe) -> None:
+            for kind, op in ops:
+                if kind == "metric":
+                    _queue_user_metric(pipe, op, now)
+                    continue
+                site_id = sites.get(op)
+                if site_id:
+                    redis_scripts.session_remove.queue(
+                        pipe, [k_user_zset_site(site_id), k_user_hash(op), k_user_role_counts(site_id)], [op]
+                    )
+                else:
+                    pipe.delete(k_user_hash(op))
+
+        await redis_scripts.execute_pipeline(r, build)
+
+    return {"accepted": len(ops), "rejected": rejected, "logouts": logouts}
 
 async def get_active_users(site_id: str, limit: int = 50) -> Dict[str, Any]:
     r = await get_redis()
@@ -66,3 +220,87 @@ async def get_active_users(site_id: str, limit: int = 50) -> Dict[str, Any]:
         "latest_site_metrics": metrics,
         "window_sec": settings.USER_PRESENCE_WINDOW_SEC
     }
+
+async def get_latency_percentiles(
+    site_id: str | None = None, window_sec: int = 300, quantiles: List[float] | None = None
+) -> Dict[str, Any]:
+    """
+    Latency percentiles over the last window_sec, merged from per-minute (or,
+    beyond 6h, per-hour) sketches. No raw samples are read. Without site_id
+    every registered user site is reported, plus an all-sites merge.
+    Raises ValueError if the window spans more than SKETCH_MAX_BUCKETS buckets.
+    """
+    quantiles = quantiles or [0.5, 0.9, 0.99]
+    r = await get_redis()
+    now = int(time.time())
+    resolution = "minute" if window_sec <= 6 * 3600 else "hour"
+    step = SKETCH_RESOLUTIONS[resolution][0]
+    start = now - window_sec
+    buckets = list(range(start - start % step, now + 1, step))
+    if len(buckets) > SKETCH_MAX_BUCKETS:
+        raise ValueError(f"window spans {len(buckets)} {resolution} buckets (max {SKETCH_MAX_BUCKETS})")
+
+    sites = [site_id] if site_id else await r.zrange(k_user_sites(), 0, -1)
+
+    pipe = r.pipeline(transaction=False)
+    for sid in sites:
+        for ts in buckets:
+            pipe.hgetall(k_latency_sketch(sid, resolution, ts))
+    raws = await pipe.execute() if sites else []
+
+    def summarize(sketch: DDSketch) -> Dict[str, Any]:
+        out: Dict[str, Any] = {"count": sketch.count}
+        for q in quantiles:
+            out[f"p{q * 100:g}"] = sketch.quantile(q)
+        return out
+
+    overall = _latency_sketch()
+    per_site = []
+    for i, sid in enumerate(sites):
+        sketch = DDSketch.from_hashes(raws[i * len(buckets):(i + 1) * len(buckets)], settings.USER_LATENCY_SKETCH_ALPHA)
+        overall.merge(sketch)
+        per_site.append({"site_id": sid, **summarize(sketch)})
+
+    result: Dict[str, Any] = {
+        "window_sec": window_sec,
+        "resolution": resolution,
+        "relative_accuracy": settings.USER_LATENCY_SKETCH_ALPHA,
+    }
+    if site_id:
+        result.update(per_site[0])
+    else:
+        result["all_sites"] = summarize(overall)
+        result["sites"] = per_site
+    return result
+
+async def get_active_user_breakdown() -> Dict[str, Any]:
+    """
+    Active sessions per region (= site_id; the RabbitMQ consumer files users
+    under their region) and per role, without reading any session.
+    Per region is the ZCARD of the site's presence zset, per role the site's
+    role counter hash (kept in step by ingest, logout and the presence sweeper),
+    so the cost is O(regions + roles). Both count sessions until the sweeper
+    trims them, so the two breakdowns always sum to the same total.
+    """
+    r = await get_redis()
+    sites = await r.zrange(k_user_sites(), 0, -1)
+    pipe = r.pipeline(transaction=False)
+    for sid in sites:
+        pipe.zcard(k_user_zset_site(sid))
+        pipe.hgetall(k_user_role_counts(sid))
+    replies = await pipe.execute() if sites else []
+
+    by_region: Dict[str, int] = {}
+    by_role: Dict[str, int] = {}
+    for sid, count, roles in zip(sites, replies[0::2], replies[1::2]):
+        if count:
+            by_region[sid] = count
+        for role, n in roles.items():
+            if int(n) > 0:
+                by_role[role] = by_role.get(role, 0) + int(n)
+
+    return {
+        "total": sum(by_region.values()),
+        "by_region": by_region,
+        "by_role": by_role,
+    }
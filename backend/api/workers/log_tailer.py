@@ -0,0 +1,333 @@
+"""
+Access Log File Tailer
+
+Follows the access logs listed in LOG_TAIL_PATHS (comma-separated) and counts
+new lines through log_service.LogAggregator, resuming where it left off after a
+restart.
+
+Each poll (LOG_TAIL_POLL_SEC) reads every file from its offset in chunks of up
+to LOG_TAIL_READ_BYTES, parses the complete lines, writes the aggregated
+(status, ip) counts together with the "{inode}:{offset}" checkpoint in the
+logs:tail:offsets:{LOG_TAIL_COLLECTOR_ID} hash, in one MULTI/EXEC: a chunk is
+counted and checkpointed together or not at all. A path without a checkpoint
+is read from the beginning. The collector id (not the hostname, which changes
+when a container is recreated) names the set of files being followed; tailers
+on machines with different files at the same paths need different ids.
+
+Every API worker (gunicorn -w N) starts a tailer, so each path is read under a
+lease (logs:tail:lease:{id}:{path}, LOG_TAIL_LEASE_SEC) renewed before every
+read: only its holder follows the file, from the shared checkpoint, and another
+tailer takes over once it is released (stop) or expires (crash).
+
+Rotation:
+- rename (logrotate default): once a new inode is at the path, the open file
+  is drained to EOF (including a last line without a newline), then the new
+  file is followed from offset 0
+- copytruncate: a file shorter than the offset is re-read from 0
+- on startup, if the checkpointed inode is no longer at the path, a rotated
+  sibling ("{path}.1", ...) with that inode is drained first
+Lines longer than LOG_INGEST_MAX_LINE_BYTES are skipped and counted as rejected.
+
+Backpressure is the file itself: the tailer reads only as fast as Redis
+accepts the counts, and lag_bytes in metrics() shows how far behind it is.
+
+Enabled by LOG_TAIL_ENABLED; see api.workers.runner for standalone runs.
+"""
+
+import asyncio
+import glob
+import os
+import socket
+import time
+import uuid
+from typing import Any, BinaryIO, Dict, List, Optional, Tuple
+
+from loguru import logger
+from redis.asyncio.client import Pipeline
+
+from api.core.config import settings
+from api.services import redis_scripts
+from api.services.log_service import LogAggregator
+from api.services.redis_client import get_redis
+from api.workers import runner
+
+
+def k_tail_offsets() -> str:
+    return f"logs:tail:offsets:{settings.LOG_TAIL_COLLECTOR_ID}"    # hash: path -> "{inode}:{offset}"
+
+
+def k_tail_lease(path: str) -> str:
+    return f"logs:tail:lease:{settings.LOG_TAIL_COLLECTOR_ID}:{path}"  # string: owner, expires after the lease
+
+
+class _TailedFile:
+    def __init__(self, path: str):
+        self.path = path
+        self.fh: Optional[BinaryIO] = None
+        self.inode = 0
+        self.offset = 0
+        self.skipping = False          # inside an oversized line, discarding up to the next newline
+        self.size = 0
+        self.leased = False            # this tailer holds the path's lease and has resumed it
+
+
+def _open_at(path: str, offset: int) -> Tuple[BinaryIO, int]:
+    fh = open(path, "rb")
+    fh.seek(offset)
+    return fh, os.fstat(fh.fileno()).st_ino
+
+
+def _find_rotated(path: str, inode: int) -> Optional[str]:
+    for candidate in sorted(glob.glob(glob.escape(path) + ".*")):
+        try:
+            if os.stat(candidate).st_ino == inode and not candidate.endswith(".gz"):
+                return candidate
+        except OSError:
+            continue
+    return None
+
+
+class LogFileTailer:
+    """Checkpointed multi-file tail -> batched log_service counts."""
+
+    def __init__(
+        self,
+        paths: List[str] | None = None,
+        poll_sec: float | None = None,
+        read_bytes: int | None = None,
+    ):
+        self.paths = paths or [p.strip() for p in settings.LOG_TAIL_PATHS.split(",") if p.strip()]
+        self.poll_sec = poll_sec or settings.LOG_TAIL_POLL_SEC
+        self.read_bytes = read_bytes or settings.LOG_TAIL_READ_BYTES
+        self.max_line = settings.LOG_INGEST_MAX_LINE_BYTES
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+        self._files: Dict[str, _TailedFile] = {p: _TailedFile(p) for p in self.paths}
+        self._agg = LogAggregator()
+        self._task: Optional[asyncio.Task] = None
+        self._rate = runner.RateWindow()
+
+        self.stats: Dict[str, Any] = {
+            "polls": 0,
+            "lines": 0,
+            "bytes": 0,
+            "chunks": 0,
+            "rotations": 0,
+            "truncations": 0,
+            "errors": 0,
+            "lease_losses": 0,
+            "last_flush_ms": 0.0,
+            "max_flush_ms": 0.0,
+        }
+
+    # ------------------------------------------------------------------
+    # files
+    # ------------------------------------------------------------------
+    async def _resume(self, tf: _TailedFile, checkpoint: Optional[str]) -> None:
+        """Open a file at its checkpoint (or a rotated sibling still holding unread lines)."""
+        inode, offset = (int(x) for x in checkpoint.split(":")) if checkpoint else (0, 0)
+        try:
+            current = os.stat(tf.path).st_ino
+        except FileNotFoundError:
+            current = 0
+        path = tf.path
+        if inode and inode != current:
+            path = await asyncio.to_thread(_find_rotated, tf.path, inode)
+            if path is None:
+                logger.warning(f"Tail checkpoint for {tf.path} points at a file that is gone; starting at 0")
+                path, offset = tf.path, 0
+        elif not inode:
+            offset = 0
+        if not os.path.exists(path):
+            return
+        tf.fh, tf.inode = await asyncio.to_thread(_open_at, path, offset)
+        tf.offset = offset
+        logger.info(f"Tailing {path} from offset {offset}")
+
+    async def _reopen_if_rotated(self, tf: _TailedFile) -> None:
+        """At EOF: switch to a new file at the path, or rewind after copytruncate."""
+        try:
+            st = os.stat(tf.path)
+        except FileNotFoundError:
+            return
+        if tf.fh is None or st.st_ino != tf.inode:
+            if tf.fh is not None:
+                # lines written to the old file since our last read are still unread
+                await self._drain(tf)
+                tf.fh.close()
+                self.stats["rotations"] += 1
+            tf.fh, tf.inode = await asyncio.to_thread(_open_at, tf.path, 0)
+            tf.offset, tf.skipping = 0, False
+            await self._checkpoint(tf)
+        elif st.st_size < tf.offset:
+            self.stats["truncations"] += 1
+            tf.fh.seek(0)
+            tf.offset, tf.skipping = 0, False
+            await self._checkpoint(tf)
+        tf.size = st.st_size
+
+    def _close(self, tf: _TailedFile) -> None:
+        if tf.fh is not None:
+            tf.fh.close()
+            tf.fh = None
+        tf.skipping = False
+
+    async def _hold(self, tf: _TailedFile) -> bool:
+        """
+        Take or renew the path's lease; True if this tailer may read the file now.
+        A newly taken path is resumed from the shared checkpoint; a lost one is
+        closed (its holder carries on from the checkpoints we wrote).
+        """
+        r = await get_redis()
+        ttl_ms = max(1, int(settings.LOG_TAIL_LEASE_SEC * 1000))
+        if not await redis_scripts.lease_renew(r, [k_tail_lease(tf.path)], [self.owner, ttl_ms]):
+            if tf.leased:
+                logger.warning(f"Lost the tail lease for {tf.path}; another tailer follows it now")
+                self.stats["lease_losses"] += 1
+                self._close(tf)
+                tf.leased = False
+            return False
+        if not tf.leased:
+            self._close(tf)
+            await self._resume(tf, await r.hget(k_tail_offsets(), tf.path))
+            tf.leased = True
+        return True
+
+    async def _checkpoint(self, tf: _TailedFile) -> None:
+        r = await get_redis()
+        await r.hset(k_tail_offsets(), tf.path, f"{tf.inode}:{tf.offset}")
+
+    def _queue_checkpoint(self, pipe: Pipeline, tf: _TailedFile, offset: int) -> None:
+        pipe.hset(k_tail_offsets(), tf.path, f"{tf.inode}:{offset}")
+
+    def _parse_chunk(self, tf: _TailedFile, chunk: bytes) -> int:
+        """Count the complete lines of a chunk; returns how many bytes were consumed."""
+        end = chunk.rfind(b"\n")
+        if end < 0:
+            if len(chunk) < self.read_bytes:
+                return 0                    # partial last line, wait for the rest
+            # a single line longer than a read: skip it
+            if not tf.skipping:
+                self._agg.rejected += 1
+            tf.skipping = True
+            return len(chunk)
+        lines = chunk[:end].split(b"\n")
+        if tf.skipping:
+            lines = lines[1:]
+            tf.skipping = False
+        for raw in lines:
+            if len(raw) > self.max_line:
+                self._agg.rejected += 1
+            elif raw.strip():
+                self._agg.add_line(raw.decode("utf-8", "replace"))
+        self.stats["lines"] += len(lines)
+        self._rate.add(len(lines))
+        return end + 1
+
+    async def _consume(self, tf: _TailedFile, final: bool = False) -> int:
+        """
+        Read one chunk, count its complete lines and write the counts plus the new
+        checkpoint in one MULTI/EXEC. final (a rotated-away file) also counts a
+        last line without a newline. Returns the bytes read.
+        """
+        chunk = await asyncio.to_thread(tf.fh.read, self.read_bytes)
+        tf.size = os.fstat(tf.fh.fileno()).st_size
+        if final and chunk and len(chunk) < self.read_bytes and not chunk.endswith(b"\n"):
+            used = min(self._parse_chunk(tf, chunk + b"\n"), len(chunk))
+        else:
+            used = self._parse_chunk(tf, chunk) if chunk else 0
+        if used:
+            start = time.perf_counter()
+            try:
+                await self._agg.flush(lambda pipe: self._queue_checkpoint(pipe, tf, tf.offset + used))
+            except Exception:
+                tf.fh.seek(tf.offset)        # re-read the chunk on the next poll
+                raise
+            flush_ms = (time.perf_counter() - start) * 1000
+            self.stats["last_flush_ms"] = round(flush_ms, 3)
+            self.stats["max_flush_ms"] = max(self.stats["max_flush_ms"], self.stats["last_flush_ms"])
+            tf.offset += used
+            self.stats["bytes"] += used
+            self.stats["chunks"] += 1
+        if used < len(chunk):
+            tf.fh.seek(tf.offset)            # re-read the partial line next time
+        return len(chunk)
+
+    async def _drain(self, tf: _TailedFile) -> None:
+        """Read a rotated-away file to EOF before following its replacement."""
+        while await self._consume(tf, final=True) == self.read_bytes:
+            pass
+
+    async def _follow(self, tf: _TailedFile) -> None:
+        while await self._hold(tf):
+            if tf.fh is None:
+                await self._reopen_if_rotated(tf)
+                if tf.fh is None:
+                    return
+            if await self._consume(tf) < self.read_bytes:
+                await self._reopen_if_rotated(tf)
+                return
+
+    async def _run(self) -> None:
+        while True:
+            for tf in self._files.values():
+                try:
+                    await self._follow(tf)
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    self.stats["errors"] += 1
+                    logger.error(f"Tail of {tf.path} failed: {e}")
+            self.stats["polls"] += 1
+            await asyncio.sleep(self.poll_sec)
+
+    # ------------------------------------------------------------------
+    # lifecycle
+    # ------------------------------------------------------------------
+    async def start(self) -> None:
+        if not self.paths:
+            logger.warning("Log tailer enabled without LOG_TAIL_PATHS; nothing to follow")
+        self._task = asyncio.create_task(self._run(), name="log-file-tailer")
+        logger.info(f"Log tailer started for {self.paths} (poll {self.poll_sec}s)")
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        # lines counted but not flushed were not checkpointed either; they are re-read next start
+        for tf in self._files.values():
+            self._close(tf)
+            if tf.leased:
+                tf.leased = False
+                try:
+                    r = await get_redis()
+                    await redis_scripts.lease_release(r, [k_tail_lease(tf.path)], [self.owner])
+                except Exception as e:
+                    logger.warning(f"Tail lease release for {tf.path} failed (expires on its own): {e}")
+        logger.info("Log tailer stopped")
+
+    def metrics(self) -> Dict[str, Any]:
+        return {
+            **self.stats,
+            "parsed": self._agg.parsed,
+            "rejected": self._agg.rejected,
+            "lines_per_sec": self._rate.per_sec(),
+            "files": [
+                {
+                    "path": tf.path,
+                    "leased": tf.leased,
+                    "inode": tf.inode,
+                    "offset": tf.offset,
+                    "lag_bytes": max(0, tf.size - tf.offset),
+                }
+                for tf in self._files.values()
+            ],
+        }
+
+
+if __name__ == "__main__":
+    runner.main(LogFileTailer, "Log tailer")
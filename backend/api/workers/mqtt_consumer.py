@@ -0,0 +1,278 @@
+"""
+MQTT Telemetry Consumer
+
+Subscribes to the device topic tree (og/field/{site}/{type}/{id}) and feeds
+telemetry_service in size/time-bounded micro-batches.
+
+Threading model:
+- paho-mqtt runs its own network thread; JSON decoding and payload
+  normalisation happen there, off the asyncio event loop.
+- Normalised events are handed to the loop with call_soon_threadsafe and
+  buffered in a bounded asyncio.Queue (drops are counted when it is full).
+- A single flusher coroutine drains the queue into batches and writes each
+  batch with one pipelined Redis round trip (ingest_telemetry_batch).
+- stop() disconnects first, lets an in-flight flush finish, then flushes the
+  partly collected batch and whatever is still queued.
+
+Scaling out: every process connects with its own client id (region, host, pid)
+and, with MQTT_SHARED_GROUP set, subscribes through $share/{group}/{topic}, so
+the broker spreads messages across the instances instead of each one consuming
+(and counting) every message.
+
+Enabled by MQTT_CONSUMER_ENABLED; see api.workers.runner for standalone runs.
+"""
+
+import asyncio
+import json
+import os
+import socket
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+import paho.mqtt.client as mqtt
+from loguru import logger
+
+from api.core.config import settings
+from api.services import telemetry_service
+from api.workers import runner
+
+# Payload fields that describe the device rather than a metric
+_ID_FIELDS = {"site_id", "device_type", "device_id", "timestamp"}
+
+
+def parse_payload(topic: str, payload: bytes) -> Optional[Dict[str, Any]]:
+    """
+    Turn a simulator message into a TelemetryEvent-shaped dict.
+    Numeric top-level fields become metrics; site/type/id fall back to the topic.
+    Returns None for undecodable payloads.
+    """
+    try:
+        data = json.loads(payload)
+    except (ValueError, UnicodeDecodeError):
+        return None
+    if not isinstance(data, dict):
+        return None
+
+    # og/field/{site}/{type}/{id}
+    parts = topic.split("/")
+    topic_ids = parts[2:5] if len(parts) >= 5 else [None, None, None]
+
+    metrics = {
+        k: float(v) for k, v in data.items()
+        if k not in _ID_FIELDS and isinstance(v, (int, float)) and not isinstance(v, bool)
+    }
+    evt = {
+        "site_id": data.get("site_id") or topic_ids[0],
+        "device_type": data.get("device_type") or topic_ids[1],
+        "device_id": data.get("device_id") or topic_ids[2],
+        "metrics": metrics or None,
+    }
+    if data.get("timestamp"):
+        evt["timestamp"] = data["timestamp"]
+    return evt
+
+
+def _event_epoch(evt: Dict[str, Any], default: float) -> float:
+    ts = evt.get("timestamp")
+    if not ts:
+        return default
+    try:
+        return datetime.fromisoformat(ts).timestamp()
+    except (TypeError, ValueError):
+        return default
+
+
+class MqttTelemetryConsumer:
+    """Micro-batching MQTT -> Redis consumer with lag/batch/flush metrics."""
+
+    def __init__(
+        self,
+        host: str | None = None,
+        port: int | None = None,
+        topic: str | None = None,
+        batch_max_size: int | None = None,
+        batch_max_wait_ms: int | None = None,
+        queue_max: int | None = None,
+    ):
+        self.host = host or settings.MQTT_HOST
+        self.port = int(port or settings.MQTT_PORT)
+        self.topic = topic or settings.MQTT_TOPIC
+        self.batch_max_size = batch_max_size or settings.MQTT_BATCH_MAX_SIZE
+        self.batch_max_wait = (batch_max_wait_ms or settings.MQTT_BATCH_MAX_WAIT_MS) / 1000.0
+        self.queue_max = queue_max or settings.MQTT_QUEUE_MAX
+        self.client_id = f"sre-backend-{settings.ACTIVE_REGION}-telemetry-{socket.gethostname()}-{os.getpid()}"
+        group = settings.MQTT_SHARED_GROUP
+        self.subscription = f"$share/{group}/{self.topic}" if group else self.topic
+
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._queue: Optional[asyncio.Queue] = None
+        self._client: Optional[mqtt.Client] = None
+        self._flusher: Optional[asyncio.Task] = None
+        self._batch: List = []                          # being collected by _next_batch
+        self._inflight: Optional[asyncio.Future] = None  # current _flush
+        self._running = False
+
+        self.stats: Dict[str, Any] = {
+            "connected": False,
+            "received": 0,
+            "parse_errors": 0,
+            "dropped": 0,
+            "accepted": 0,
+            "rejected": 0,
+            "batches": 0,
+            "flush_errors": 0,
+            "last_batch_size": 0,
+            "max_batch_size": 0,
+            "last_flush_ms": 0.0,
+            "max_flush_ms": 0.0,
+            "total_flush_ms": 0.0,
+            "last_lag_sec": 0.0,
+            "last_queue_wait_ms": 0.0,
+        }
+
+    # ------------------------------------------------------------------
+    # paho callbacks (network thread)
+    # ------------------------------------------------------------------
+    def _on_connect(self, client, userdata, flags, reason_code, properties):
+        if reason_code.is_failure:
+            logger.error(f"MQTT connect failed: {reason_code}")
+            return
+        client.subscribe(self.subscription, qos=0)
+        self.stats["connected"] = True
+        logger.success(f"✅ MQTT consumer {self.client_id} subscribed to {self.subscription} @ {self.host}:{self.port}")
+
+    def _on_disconnect(self, client, userdata, flags, reason_code, properties):
+        self.stats["connected"] = False
+        if self._running:
+            logger.warning(f"MQTT consumer disconnected ({reason_code}), paho will reconnect")
+
+    def _on_message(self, client, userdata, msg):
+        self.stats["received"] += 1
+        evt = parse_payload(msg.topic, msg.payload)
+        if evt is None:
+            self.stats["parse_errors"] += 1
+            return
+        self._loop.call_soon_threadsafe(self._enqueue, (time.monotonic(), evt))
+
+    # ------------------------------------------------------------------
+    # event loop side
+    # ------------------------------------------------------------------
+    def _enqueue(self, item) -> None:
+        try:
+            self._queue.put_nowait(item)
+        except asyncio.QueueFull:
+            self.stats["dropped"] += 1
+
+    async def _next_batch(self) -> List:
+        # collected in self._batch so stop() can flush a batch cancelled half-way
+        batch = self._batch = [await self._queue.get()]
+        deadline = self._loop.time() + self.batch_max_wait
+        while len(batch) < self.batch_max_size:
+            # Take whatever is already buffered without yielding
+            while len(batch) < self.batch_max_size and not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+            if len(batch) >= self.batch_max_size:
+                break
+            remaining = deadline - self._loop.time()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _flush(self, batch: List) -> None:
+        events = [evt for _, evt in batch]
+        start = time.perf_counter()
+        try:
+            res = await telemetry_service.ingest_telemetry_batch(events)
+        except Exception as e:
+            self.stats["flush_errors"] += 1
+            logger.error(f"MQTT batch flush failed ({len(events)} events): {e}")
+            return
+        flush_ms = (time.perf_counter() - start) * 1000
+
+        now_wall, now_mono = time.time(), time.monotonic()
+        s = self.stats
+        s["accepted"] += res["accepted"]
+        s["rejected"] += res["rejected"]
+        s["batches"] += 1
+        s["last_batch_size"] = len(events)
+        s["max_batch_size"] = max(s["max_batch_size"], len(events))
+        s["last_flush_ms"] = round(flush_ms, 3)
+        s["max_flush_ms"] = max(s["max_flush_ms"], s["last_flush_ms"])
+        s["total_flush_ms"] += flush_ms
+        # Lag = age of the oldest event in the batch when it reached Redis
+        s["last_lag_sec"] = round(now_wall - min(_event_epoch(e, now_wall) for e in events), 3)
+        s["last_queue_wait_ms"] = round((now_mono - batch[0][0]) * 1000, 3)
+
+    async def _run_flusher(self) -> None:
+        while True:
+            batch = await self._next_batch()
+            self._batch = []
+            # shielded: cancelling the flusher (stop) never interrupts a batch mid-write
+            self._inflight = asyncio.ensure_future(self._flush(batch))
+            await asyncio.shield(self._inflight)
+
+    async def start(self) -> None:
+        self._loop = asyncio.get_running_loop()
+        self._queue = asyncio.Queue(maxsize=self.queue_max)
+        self._running = True
+
+        client = mqtt.Client(
+            callback_api_version=mqtt.CallbackAPIVersion.VERSION2,
+            client_id=self.client_id,
+        )
+        client.on_connect = self._on_connect
+        client.on_disconnect = self._on_disconnect
+        client.on_message = self._on_message
+        client.reconnect_delay_set(min_delay=1, max_delay=30)
+        client.connect_async(self.host, self.port, keepalive=60)
+        client.loop_start()
+        self._client = client
+
+        self._flusher = asyncio.create_task(self._run_flusher(), name="mqtt-telemetry-flusher")
+        logger.info(
+            f"MQTT consumer started (batch<= {self.batch_max_size}, "
+            f"wait<= {int(self.batch_max_wait * 1000)}ms, queue<= {self.queue_max})"
+        )
+
+    async def stop(self) -> None:
+        self._running = False
+        if self._client is not None:
+            self._client.disconnect()
+            self._client.loop_stop()
+            self._client = None
+            await asyncio.sleep(0)          # run enqueues the network thread scheduled last
+        if self._flusher is not None:
+            self._flusher.cancel()
+            try:
+                await self._flusher
+            except asyncio.CancelledError:
+                pass
+            self._flusher = None
+        if self._inflight is not None:
+            await self._inflight            # _flush handles its own errors
+            self._inflight = None
+        # Flush the batch being collected and whatever is still buffered
+        leftover, self._batch = self._batch, []
+        while self._queue is not None and not self._queue.empty():
+            leftover.append(self._queue.get_nowait())
+        for i in range(0, len(leftover), self.batch_max_size):
+            await self._flush(leftover[i:i + self.batch_max_size])
+        logger.info("MQTT consumer stopped")
+
+    def metrics(self) -> Dict[str, Any]:
+        s = dict(self.stats)
+        s["queue_depth"] = self._queue.qsize() if self._queue is not None else 0
+        s["avg_batch_size"] = round((s["accepted"] + s["rejected"]) / s["batches"], 1) if s["batches"] else 0.0
+        s["avg_flush_ms"] = round(s.pop("total_flush_ms") / s["batches"], 3) if s["batches"] else 0.0
+        s["topic"] = self.subscription
+        s["client_id"] = self.client_id
+        return s
+
+
+if __name__ == "__main__":
+    runner.main(MqttTelemetryConsumer, "MQTT consumer")
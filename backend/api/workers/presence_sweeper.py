@@ -0,0 +1,256 @@
+"""
+Presence Window Sweeper
+
+Ingest only records presence (ZADD) and snapshots (HSET). This worker keeps the
+presence zsets bounded instead: once per tick it removes members older than the
+presence window from every devices:active:site:* / users:active:site:* zset and
+deletes their device:{key} / user:session:{id} snapshot hashes in the same
+atomic script call (redis_scripts.presence_sweep). Sites come from the site
+registries (devices:sites / users:sites); sites idle for a whole window are
+dropped from the registry once their zset has been emptied.
+
+The same script decrements the per-site role counters of swept user sessions;
+a periodic recount (USER_COUNT_RECONCILE_INTERVAL_SEC) corrects any drift.
+
+A slower SCAN-based pass deletes snapshot hashes whose presence entry is
+already gone (e.g. trimmed by older builds that never deleted hashes) and
+re-registers presence zsets written before the registries existed. Each hash is
+re-checked and deleted inside one script call (redis_scripts.orphan_delete), so
+a device or session that reports between the SCAN and the delete is kept.
+
+Enabled by PRESENCE_SWEEPER_ENABLED (every API worker); see api.workers.runner
+for standalone runs.
+Every instance ticks, but each pass (sweep, orphan scan, role recount) first
+claims a Redis key with SET NX and a TTL of its interval, so one instance runs
+each pass per interval and a crashed holder is replaced when the key expires.
+The orphan scan is not run at startup, only once its interval has elapsed.
+Every operation is idempotent, should two instances overlap anyway.
+"""
+
+import asyncio
+import os
+import socket
+import time
+from typing import Any, Dict, List, Optional
+
+from loguru import logger
+
+from api.core.config import settings
+from api.services import device_codec, redis_scripts
+from api.services.redis_client import get_redis, get_redis_binary
+from api.services.telemetry_service import k_device_sites, k_device_site_types
+from api.services.user_service import k_user_hash, k_user_role_counts, k_user_sites, k_user_zset_site
+from api.workers import runner
+
+# kind -> (site registry key, presence zset prefix, snapshot hash prefix, window setting)
+# An empty hash prefix marks a secondary index: trimmed, but owns no hashes.
+PRESENCE_KINDS = {
+    "devices": (k_device_sites(), "devices:active:site:", "device:", "DEVICE_PRESENCE_WINDOW_SEC"),
+    "device_types": (k_device_site_types(), "devices:active:sitetype:", "", "DEVICE_PRESENCE_WINDOW_SEC"),
+    "users": (k_user_sites(), "users:active:site:", "user:session:", "USER_PRESENCE_WINDOW_SEC"),
+}
+# kind -> per-site role counter key, decremented for every swept member
+ROLE_COUNTS = {"users": k_user_role_counts}
+ORPHAN_DELETE_BATCH = 500
+
+
+def k_sweeper_claim(task: str) -> str:
+    return f"presence:sweeper:claim:{task}"      # string: owner, expires after the task interval
+
+
+async def claim(task: str, ttl_sec: float) -> bool:
+    """True if this instance may run `task` now (no other instance ran it within ttl_sec)."""
+    r = await get_redis()
+    owner = f"{socket.gethostname()}:{os.getpid()}"
+    return bool(await r.set(k_sweeper_claim(task), owner, nx=True, px=max(1, int(ttl_sec * 1000))))
+
+
+async def sweep_presence(now: Optional[int] = None) -> Dict[str, int]:
+    """Trim every presence zset once; returns removed members per kind."""
+    r = await get_redis()
+    now = now or int(time.time())
+    batch = settings.PRESENCE_SWEEP_BATCH
+    removed: Dict[str, int] = {}
+
+    for kind, (registry, zset_prefix, hash_prefix, window_attr) in PRESENCE_KINDS.items():
+        cutoff = now - getattr(settings, window_attr)
+        counts_key = ROLE_COUNTS.get(kind)
+        total = 0
+        for site_id in await r.zrange(registry, 0, -1):
+            keys = [zset_prefix + site_id] + ([counts_key(site_id)] if counts_key else [])
+            # Bounded script calls so one huge site never blocks Redis for long
+            while True:
+                n = await redis_scripts.presence_sweep(r, keys, [cutoff, hash_prefix, batch])
+                total += n
+                if n < batch:
+                    break
+        # Every member of a site idle since cutoff was just removed; a site that
+        # re-reported meanwhile has a fresh registry score and is kept.
+        await r.zremrangebyscore(registry, "-inf", cutoff)
+        removed[kind] = total
+    return removed
+
+
+async def reconcile_user_role_counts() -> Dict[str, int]:
+    """
+    Consistency check for the per-role active user counters: recount every
+    registered site from its presence zset (one atomic script call per site)
+    and overwrite counters that drifted. Returns sites checked and total drift.
+    """
+    r = await get_redis()
+    sites = await r.zrange(k_user_sites(), 0, -1)
+    drift = 0
+    for site_id in sites:
+        drift += await redis_scripts.user_role_recount(
+            r, [k_user_zset_site(site_id), k_user_role_counts(site_id)], [k_user_hash("")]
+        )
+    return {"sites": len(sites), "drift": drift}
+
+
+async def rebuild_site_registries() -> Dict[str, int]:
+    """Register presence zsets that predate the site registries (SCAN, run rarely)."""
+    r = await get_redis()
+    added: Dict[str, int] = {}
+    for kind, (registry, zset_prefix, _, _) in PRESENCE_KINDS.items():
+        total = 0
+        async for zkey in r.scan_iter(match=f"{zset_prefix}*", count=100):
+            newest = await r.zrevrange(zkey, 0, 0, withscores=True)
+            if newest:
+                total += await r.zadd(registry, {zkey[len(zset_prefix):]: newest[0][1]}, gt=True)
+        added[kind] = total
+    return added
+
+
+async def sweep_orphan_hashes(now: Optional[int] = None) -> Dict[str, int]:
+    """
+    Delete snapshot hashes not refreshed within the presence window.
+    O(total keys) via SCAN, so it runs far less often than sweep_presence.
+    Raw binary keys are passed through so packed snapshots are read intact.
+    """
+    rb = await get_redis_binary()
+    now = now or int(time.time())
+    deleted: Dict[str, int] = {}
+
+    for kind, (_, _, hash_prefix, window_attr) in PRESENCE_KINDS.items():
+        if not hash_prefix:
+            continue
+        cutoff = now - getattr(settings, window_attr)
+        total = 0
+        keys: List[bytes] = []
+        async for key in rb.scan_iter(match=f"{hash_prefix}*", count=1000):
+            keys.append(key)
+            if len(keys) >= ORPHAN_DELETE_BATCH:
+                total += await redis_scripts.orphan_delete(rb, keys, [cutoff, device_codec.COMPACT_FIELD])
+                keys = []
+        if keys:
+            total += await redis_scripts.orphan_delete(rb, keys, [cutoff, device_codec.COMPACT_FIELD])
+        deleted[kind] = total
+    return deleted
+
+
+class PresenceSweeper:
+    """Periodic presence trimming + orphan hash cleanup."""
+
+    def __init__(
+        self,
+        interval_sec: float | None = None,
+        orphan_scan_interval_sec: float | None = None,
+        reconcile_interval_sec: float | None = None,
+    ):
+        self.interval = interval_sec or settings.PRESENCE_SWEEP_INTERVAL_SEC
+        self.orphan_interval = (
+            orphan_scan_interval_sec
+            if orphan_scan_interval_sec is not None
+            else settings.PRESENCE_ORPHAN_SCAN_INTERVAL_SEC
+        )
+        self.reconcile_interval = (
+            reconcile_interval_sec
+            if reconcile_interval_sec is not None
+            else settings.USER_COUNT_RECONCILE_INTERVAL_SEC
+        )
+        self._task: Optional[asyncio.Task] = None
+        # not at startup: N workers restarting together would each SCAN the keyspace
+        self._last_orphan_scan = time.monotonic()
+        self._last_reconcile: Optional[float] = None
+        self.stats: Dict[str, Any] = {
+            "ticks": 0,
+            "claimed_by_other": 0,
+            "errors": 0,
+            "removed_devices": 0,
+            "removed_device_type_index": 0,
+            "removed_users": 0,
+            "orphans_deleted": 0,
+            "role_count_drift": 0,
+            "last_sweep_ms": 0.0,
+            "last_orphan_scan_ms": 0.0,
+        }
+
+    async def _claim(self, task: str, ttl_sec: float) -> bool:
+        if await claim(task, ttl_sec):
+            return True
+        self.stats["claimed_by_other"] += 1
+        return False
+
+    async def tick(self) -> None:
+        self.stats["ticks"] += 1
+        # a bit under the interval, so the next tick of any instance finds it free
+        if await self._claim("sweep", self.interval * 0.9):
+            start = time.perf_counter()
+            removed = await sweep_presence()
+            self.stats["removed_devices"] += removed["devices"]
+            self.stats["removed_device_type_index"] += removed["device_types"]
+            self.stats["removed_users"] += removed["users"]
+            self.stats["last_sweep_ms"] = round((time.perf_counter() - start) * 1000, 3)
+
+        due = time.monotonic() - self._last_orphan_scan >= self.orphan_interval
+        if self.orphan_interval and due:
+            self._last_orphan_scan = time.monotonic()
+            if await self._claim("orphan_scan", self.orphan_interval):
+                start = time.perf_counter()
+                deleted = await sweep_orphan_hashes()
+                registered = await rebuild_site_registries()
+                self.stats["orphans_deleted"] += sum(deleted.values())
+                self.stats["last_orphan_scan_ms"] = round((time.perf_counter() - start) * 1000, 3)
+                logger.info(f"Presence orphan scan deleted {deleted}, re-registered sites {registered}")
+
+        due = self._last_reconcile is None or time.monotonic() - self._last_reconcile >= self.reconcile_interval
+        if self.reconcile_interval and due:
+            self._last_reconcile = time.monotonic()
+            if not await self._claim("role_recount", self.reconcile_interval):
+                return
+            result = await reconcile_user_role_counts()
+            self.stats["role_count_drift"] += result["drift"]
+            if result["drift"]:
+                logger.warning(f"User role counters drifted by {result['drift']} across {result['sites']} sites, corrected")
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await self.tick()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.stats["errors"] += 1
+                logger.error(f"Presence sweep failed: {e}")
+            await asyncio.sleep(self.interval)
+
+    async def start(self) -> None:
+        self._task = asyncio.create_task(self._run(), name="presence-sweeper")
+        logger.info(f"Presence sweeper started (every {self.interval}s)")
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        logger.info("Presence sweeper stopped")
+
+    def metrics(self) -> Dict[str, Any]:
+        return {"interval_sec": self.interval, **self.stats}
+
+
+if __name__ == "__main__":
+    runner.main(PresenceSweeper, "Presence sweeper", interval_sec=60)
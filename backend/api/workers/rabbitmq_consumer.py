@@ -0,0 +1,271 @@
+"""
+RabbitMQ User Activity Consumer
+
+Consumes the durable user_activity queue fed by
+simulators/rabbitmq_user_simulator.py and applies the events to user_service:
+- user_login / user_activity -> session upsert (site_id = the user's region, role,
+  response_time_ms -> latency_ms)
+- user_logout                -> immediate removal from users:active:site:*
+- user_metrics               -> skipped (the backend derives its own counts)
+
+Flow control and acks:
+- basic.qos prefetch (RABBITMQ_PREFETCH) bounds unacked deliveries in flight
+- deliveries are buffered and flushed every RABBITMQ_BATCH_MAX_SIZE messages or
+  RABBITMQ_BATCH_MAX_WAIT_MS, with one pipelined Redis write per batch
+  (user_service.apply_session_events)
+- after the write, one basic.ack(multiple=True) acknowledges the whole batch
+- if the write fails, first deliveries are nacked with requeue (retried once);
+  redelivered messages are retried one at a time and those that still fail are
+  published to the dead-letter exchange (RABBITMQ_DEAD_LETTER_EXCHANGE, bound to
+  <queue>.dead) and acked, so a poison message cannot loop forever and does not
+  take the rest of its batch with it. Redis connection errors never dead-letter.
+Keep RABBITMQ_BATCH_MAX_SIZE <= RABBITMQ_PREFETCH, otherwise batches only ever
+flush on the timer.
+
+Enabled by RABBITMQ_CONSUMER_ENABLED; see api.workers.runner for standalone runs.
+"""
+
+import asyncio
+import json
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import aio_pika
+from loguru import logger
+from redis.exceptions import ConnectionError, TimeoutError
+
+from api.core.config import settings
+from api.services import user_service
+from api.workers import runner
+
+
+def parse_message(body: bytes) -> Optional[Tuple[str, Dict[str, Any]]]:
+    """
+    Map a simulator message onto a user_service session event, ("skip", {}) for
+    event types without a session effect, or None if it is malformed.
+    """
+    try:
+        msg = json.loads(body)
+        event_type, data = msg["event_type"], msg["data"]
+    except (ValueError, UnicodeDecodeError, TypeError, KeyError):
+        return None
+    if not isinstance(data, dict):
+        return None
+
+    if event_type in ("user_login", "user_activity"):
+        metric = {
+            "site_id": data.get("region"),
+            "session_id": data.get("session_id"),
+            "user_id": data.get("user_id"),
+        }
+        if data.get("role"):
+            metric["role"] = data["role"]
+        if data.get("response_time_ms") is not None:
+            metric["latency_ms"] = data["response_time_ms"]
+        if msg.get("timestamp"):
+            metric["timestamp"] = msg["timestamp"]
+        return "metric", metric
+    if event_type == "user_logout":
+        return "logout", {"session_id": data.get("session_id"), "user_id": data.get("user_id")}
+    if event_type == "user_metrics":
+        return "skip", {}
+    return None
+
+
+class RabbitUserActivityConsumer:
+    """Prefetch-bounded, batch-acking user_activity -> Redis consumer."""
+
+    def __init__(
+        self,
+        url: str | None = None,
+        queue: str | None = None,
+        prefetch: int | None = None,
+        batch_max_size: int | None = None,
+        batch_max_wait_ms: int | None = None,
+    ):
+        self.url = url or settings.RABBITMQ_URL
+        self.queue_name = queue or settings.RABBITMQ_QUEUE
+        self.prefetch = prefetch or settings.RABBITMQ_PREFETCH
+        self.batch_max_size = batch_max_size or settings.RABBITMQ_BATCH_MAX_SIZE
+        self.batch_max_wait = (batch_max_wait_ms or settings.RABBITMQ_BATCH_MAX_WAIT_MS) / 1000.0
+
+        self._connection: Optional[aio_pika.abc.AbstractRobustConnection] = None
+        self._dead_letter: Optional[aio_pika.abc.AbstractExchange] = None
+        self._buffer: List[aio_pika.abc.AbstractIncomingMessage] = []
+        self._full = asyncio.Event()
+        self._flusher: Optional[asyncio.Task] = None
+        self._rate = runner.RateWindow()
+        self._started = 0.0
+
+        self.stats: Dict[str, Any] = {
+            "received": 0,
+            "accepted": 0,
+            "rejected": 0,
+            "logouts": 0,
+            "skipped": 0,
+            "parse_errors": 0,
+            "batches": 0,
+            "acked": 0,
+            "requeued": 0,
+            "dead_lettered": 0,
+            "flush_errors": 0,
+            "last_batch_size": 0,
+            "last_flush_ms": 0.0,
+            "max_flush_ms": 0.0,
+        }
+
+    async def _on_message(self, message: aio_pika.abc.AbstractIncomingMessage) -> None:
+        self.stats["received"] += 1
+        self._buffer.append(message)
+        if len(self._buffer) >= self.batch_max_size:
+            self._full.set()
+
+    def _parse(self, message: aio_pika.abc.AbstractIncomingMessage) -> Optional[Tuple[str, Dict[str, Any]]]:
+        parsed = parse_message(message.body)
+        if parsed is None:
+            self.stats["parse_errors"] += 1
+        elif parsed[0] == "skip":
+            self.stats["skipped"] += 1
+            return None
+        return parsed
+
+    async def _flush(self, batch: List[aio_pika.abc.AbstractIncomingMessage]) -> None:
+        parsed = [(message, self._parse(message)) for message in batch]
+        events = [event for _, event in parsed if event is not None]
+
+        start = time.perf_counter()
+        try:
+            res = await user_service.apply_session_events(events) if events else {}
+        except Exception as e:
+            self.stats["flush_errors"] += 1
+            logger.error(f"RabbitMQ batch flush failed ({len(batch)} messages): {e}")
+            await self._settle_failed(parsed, e)
+            return
+        flush_ms = (time.perf_counter() - start) * 1000
+
+        try:
+            # acks every delivery up to and including the last one of the batch
+            await batch[-1].ack(multiple=True)
+            self.stats["acked"] += len(batch)
+        except Exception as e:
+            # channel was re-established: these deliveries will be redelivered
+            logger.warning(f"RabbitMQ batch ack failed ({len(batch)} messages): {e}")
+
+        s = self.stats
+        s["accepted"] += res.get("accepted", 0)
+        s["rejected"] += res.get("rejected", 0)
+        s["logouts"] += res.get("logouts", 0)
+        s["batches"] += 1
+        s["last_batch_size"] = len(batch)
+        s["last_flush_ms"] = round(flush_ms, 3)
+        s["max_flush_ms"] = max(s["max_flush_ms"], s["last_flush_ms"])
+        self._rate.add(len(batch))
+
+    async def _settle_failed(
+        self, parsed: List[Tuple[aio_pika.abc.AbstractIncomingMessage, Optional[Tuple[str, Dict[str, Any]]]]],
+        error: Exception,
+    ) -> None:
+        """Requeue first deliveries once; retry redelivered ones alone and dead-letter those that fail."""
+        try:
+            for message, event in parsed:
+                if not message.redelivered or isinstance(error, (ConnectionError, TimeoutError)):
+                    await message.nack(requeue=True)
+                    self.stats["requeued"] += 1
+                    continue
+                try:
+                    res = await user_service.apply_session_events([event]) if event else {}
+                except (ConnectionError, TimeoutError) as e:
+                    error = e                   # Redis is down: requeue the rest as well
+                    await message.nack(requeue=True)
+                    self.stats["requeued"] += 1
+                    continue
+                except Exception as e:
+                    await self._dead_letter_message(message, e)
+                    continue
+                await message.ack()
+                self.stats["acked"] += 1
+                self.stats["accepted"] += res.get("accepted", 0)
+                self.stats["rejected"] += res.get("rejected", 0)
+                self.stats["logouts"] += res.get("logouts", 0)
+        except Exception as settle_error:
+            # channel gone: the broker requeues unacked deliveries itself
+            logger.warning(f"RabbitMQ nack/ack after failed flush failed: {settle_error}")
+
+    async def _dead_letter_message(self, message: aio_pika.abc.AbstractIncomingMessage, error: Exception) -> None:
+        await self._dead_letter.publish(
+            aio_pika.Message(
+                body=message.body,
+                headers={**(message.headers or {}), "x-original-queue": self.queue_name, "x-error": str(error)[:500]},
+                content_type=message.content_type,
+                delivery_mode=aio_pika.DeliveryMode.PERSISTENT,
+            ),
+            routing_key=self.queue_name,
+        )
+        await message.ack()
+        self.stats["dead_lettered"] += 1
+        logger.warning(f"RabbitMQ message dead-lettered after a redelivery failed: {error}")
+
+    async def _run_flusher(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._full.wait(), self.batch_max_wait)
+            except asyncio.TimeoutError:
+                pass
+            self._full.clear()
+            if self._buffer:
+                batch, self._buffer = self._buffer, []
+                await self._flush(batch)
+
+    async def start(self) -> None:
+        self._connection = await aio_pika.connect_robust(
+            self.url, client_properties={"connection_name": f"sre-backend-{settings.ACTIVE_REGION}-users"}
+        )
+        channel = await self._connection.channel()
+        await channel.set_qos(prefetch_count=self.prefetch)
+        queue = await channel.declare_queue(self.queue_name, durable=True)
+        self._dead_letter = await channel.declare_exchange(
+            settings.RABBITMQ_DEAD_LETTER_EXCHANGE, aio_pika.ExchangeType.FANOUT, durable=True
+        )
+        dead_queue = await channel.declare_queue(f"{self.queue_name}.dead", durable=True)
+        await dead_queue.bind(self._dead_letter)
+        self._started = time.monotonic()
+        self._flusher = asyncio.create_task(self._run_flusher(), name="rabbitmq-user-flusher")
+        await queue.consume(self._on_message)
+        logger.info(
+            f"RabbitMQ consumer started on {self.queue_name} (prefetch {self.prefetch}, "
+            f"batch<= {self.batch_max_size}, wait<= {int(self.batch_max_wait * 1000)}ms)"
+        )
+
+    async def stop(self) -> None:
+        if self._flusher is not None:
+            self._flusher.cancel()
+            try:
+                await self._flusher
+            except asyncio.CancelledError:
+                pass
+            self._flusher = None
+        # Flush what was delivered while the channel is still open
+        if self._buffer:
+            batch, self._buffer = self._buffer, []
+            await self._flush(batch)
+        if self._connection is not None:
+            await self._connection.close()
+            self._connection = None
+        logger.info("RabbitMQ consumer stopped")
+
+    def metrics(self) -> Dict[str, Any]:
+        s = self.stats
+        elapsed = time.monotonic() - self._started if self._started else 0.0
+        return {
+            **s,
+            "buffered": len(self._buffer),
+            "prefetch": self.prefetch,
+            "queue": self.queue_name,
+            # processed (flushed) messages per second, recent and since start
+            "msgs_per_sec": self._rate.per_sec(),
+            "avg_msgs_per_sec": round(s["acked"] / elapsed, 1) if elapsed else 0.0,
+        }
+
+
+if __name__ == "__main__":
+    runner.main(RabbitUserActivityConsumer, "RabbitMQ consumer")
@@ -0,0 +1,80 @@
+"""
+Shared pieces of the background workers.
+
+Every worker in this package has start() / stop() / metrics(). It runs inside
+the FastAPI lifespan when its *_ENABLED flag is set, or standalone:
+    python -m api.workers.<module>
+which calls main() below: load the Key Vault settings, start the worker, log
+its metrics periodically until interrupted, then stop it and close Redis.
+"""
+
+import asyncio
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Optional, Protocol, Tuple
+
+from loguru import logger
+
+from api.core.config import settings
+
+
+class Worker(Protocol):
+    async def start(self) -> None: ...
+    async def stop(self) -> None: ...
+    def metrics(self) -> Dict[str, Any]: ...
+
+
+class RateWindow:
+    """Events per second over the last window_sec seconds (for metrics())."""
+
+    def __init__(self, window_sec: float = 10.0):
+        self.window_sec = window_sec
+        self._events: Deque[Tuple[float, int]] = deque()
+
+    def add(self, n: int) -> None:
+        self._events.append((time.monotonic(), n))
+
+    def per_sec(self) -> float:
+        cutoff = time.monotonic() - self.window_sec
+        while self._events and self._events[0][0] < cutoff:
+            self._events.popleft()
+        return round(sum(n for _, n in self._events) / self.window_sec, 1)
+
+
+async def run_standalone(
+    factory: Callable[[], Worker],
+    name: str,
+    interval_sec: float = 30.0,
+    extra: Optional[Callable[[], Awaitable[Dict[str, Any]]]] = None,
+) -> None:
+    """
+    Run a worker until cancelled, logging metrics() (plus extra(), if given)
+    every interval_sec. The worker is built after the Key Vault settings load.
+    """
+    await settings.load_from_keyvault()
+    worker = factory()
+    await worker.start()
+    try:
+        while True:
+            await asyncio.sleep(interval_sec)
+            metrics = worker.metrics()
+            if extra is not None:
+                metrics.update(await extra())
+            logger.info(f"{name} metrics: {metrics}")
+    finally:
+        await worker.stop()
+        from api.services.redis_client import close_redis
+        await close_redis()
+
+
+def main(
+    factory: Callable[[], Worker],
+    name: str,
+    interval_sec: float = 30.0,
+    extra: Optional[Callable[[], Awaitable[Dict[str, Any]]]] = None,
+) -> None:
+    """Standalone entry point of a worker module: run until interrupted."""
+    try:
+        asyncio.run(run_standalone(factory, name, interval_sec, extra))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,243 @@
+"""
+Redis Streams ingest workers
+
+Consume the ingest streams filled by the HTTP endpoints in stream mode
+(INGEST_VIA_STREAM, see api.services.ingest_stream) and apply them to the
+regular key layout.
+
+Each worker is one consumer of the shared "ingest-workers" group, so any
+number of workers in any number of processes split the streams between them.
+A worker loops over:
+- XREADGROUP ... > : up to INGEST_STREAM_BATCH new entries per stream, blocking
+  up to INGEST_STREAM_BLOCK_MS when idle
+- apply the batch with ingest_telemetry_batch / ingest_user_batch, then XACK it
+  (a failed write leaves the entries pending)
+- every INGEST_STREAM_CLAIM_INTERVAL_SEC, XAUTOCLAIM entries pending for more than
+  INGEST_STREAM_CLAIM_IDLE_MS (crashed consumers, failed writes) and apply them
+  one at a time, so a poison entry fails alone and the rest are acked; entries
+  delivered more than INGEST_STREAM_MAX_DELIVERIES times go to the dead-letter
+  stream instead (ingest_stream.dead_letter)
+
+Enabled by INGEST_STREAM_CONSUMER_ENABLED; standalone runs (see
+api.workers.runner) scale by starting more processes.
+"""
+
+import asyncio
+import os
+import socket
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Tuple
+
+from loguru import logger
+from redis.exceptions import ConnectionError, TimeoutError
+
+from api.core.config import settings
+from api.services import ingest_stream, telemetry_service, user_service
+from api.services.redis_client import get_redis
+from api.workers import runner
+
+# kind -> batch apply function
+APPLY: Dict[str, Callable[[List[Dict[str, Any]]], Awaitable[Dict[str, Any]]]] = {
+    "telemetry": telemetry_service.ingest_telemetry_batch,
+    "users": user_service.ingest_user_batch,
+}
+
+STALE_CONSUMER_IDLE_MS = 3600 * 1000
+
+
+class StreamIngestWorkers:
+    """Pool of consumer-group workers for the ingest streams."""
+
+    def __init__(
+        self,
+        workers: int | None = None,
+        batch: int | None = None,
+        block_ms: int | None = None,
+        claim_idle_ms: int | None = None,
+        claim_interval_sec: float | None = None,
+    ):
+        self.workers = workers or settings.INGEST_STREAM_WORKERS
+        self.batch = batch or settings.INGEST_STREAM_BATCH
+        self.block_ms = block_ms or settings.INGEST_STREAM_BLOCK_MS
+        self.claim_idle_ms = claim_idle_ms or settings.INGEST_STREAM_CLAIM_IDLE_MS
+        self.claim_interval = claim_interval_sec or settings.INGEST_STREAM_CLAIM_INTERVAL_SEC
+        self.max_deliveries = settings.INGEST_STREAM_MAX_DELIVERIES
+        # unique per process so pending entries can be told apart and reclaimed
+        self.consumer_prefix = f"{socket.gethostname()}-{os.getpid()}"
+
+        self._tasks: List[asyncio.Task] = []
+        self.stats: Dict[str, Any] = {
+            "read": 0,
+            "reclaimed": 0,
+            "accepted": 0,
+            "rejected": 0,
+            "undecodable": 0,
+            "acked": 0,
+            "batches": 0,
+            "apply_errors": 0,
+            "entry_errors": 0,
+            "dead_lettered": 0,
+            "last_batch_size": 0,
+            "last_apply_ms": 0.0,
+            "max_apply_ms": 0.0,
+            "last_lag_sec": 0.0,
+        }
+
+    async def _apply(self, kind: str, entries: List) -> None:
+        """Apply one batch of (id, fields) entries and XACK them on success."""
+        if not entries:
+            return
+        events = ingest_stream.decode_entries(entries)
+        start = time.perf_counter()
+        try:
+            res = await APPLY[kind](events) if events else {"accepted": 0, "rejected": 0}
+        except Exception as e:
+            # left pending; reclaimed (one entry at a time) after INGEST_STREAM_CLAIM_IDLE_MS
+            self.stats["apply_errors"] += 1
+            logger.error(f"Stream ingest batch failed ({kind}, {len(entries)} entries): {e}")
+            return
+        await self._ack(kind, entries, res, len(entries) - len(events), time.perf_counter() - start)
+
+    async def _apply_each(self, kind: str, entries: List) -> None:
+        """
+        Apply entries one at a time and XACK those that succeed: a poison entry
+        fails alone and stays pending until it is dead-lettered. Connection
+        errors abort the pass (every entry would fail the same way).
+        """
+        res = {"accepted": 0, "rejected": 0}
+        done, undecodable = [], 0
+        start = time.perf_counter()
+        for entry in entries:
+            events = ingest_stream.decode_entries([entry])
+            try:
+                one = await APPLY[kind](events) if events else {"accepted": 0, "rejected": 0}
+            except (ConnectionError, TimeoutError):
+                raise
+            except Exception as e:
+                self.stats["entry_errors"] += 1
+                logger.error(f"Stream ingest entry {entry[0]} failed ({kind}): {e}")
+                continue
+            res["accepted"] += one["accepted"]
+            res["rejected"] += one["rejected"]
+            undecodable += 0 if events else 1
+            done.append(entry)
+        if done:
+            await self._ack(kind, done, res, undecodable, time.perf_counter() - start)
+
+    async def _ack(self, kind: str, entries: List, res: Dict[str, Any], undecodable: int, elapsed: float) -> None:
+        r = await get_redis()
+        ids = [entry_id for entry_id, _ in entries]
+        self.stats["acked"] += await r.xack(ingest_stream.k_ingest_stream(kind), ingest_stream.GROUP, *ids)
+
+        s = self.stats
+        s["accepted"] += res["accepted"]
+        s["rejected"] += res["rejected"]
+        s["undecodable"] += undecodable
+        s["batches"] += 1
+        s["last_batch_size"] = len(entries)
+        s["last_apply_ms"] = round(elapsed * 1000, 3)
+        s["max_apply_ms"] = max(s["max_apply_ms"], s["last_apply_ms"])
+        # Lag = age of the oldest entry in the batch (entry ids carry the XADD time)
+        s["last_lag_sec"] = round(time.time() - int(ids[0].split("-")[0]) / 1000, 3)
+
+    async def _delivery_counts(self, stream: str, entries: List) -> Dict[str, int]:
+        """Times each pending entry was delivered (XPENDING per id, one round trip)."""
+        r = await get_redis()
+        pipe = r.pipeline(transaction=False)
+        for entry_id, _ in entries:
+            pipe.xpending_range(stream, ingest_stream.GROUP, min=entry_id, max=entry_id, count=1)
+        return {p["message_id"]: p["times_delivered"] for reply in await pipe.execute() for p in reply}
+
+    async def _reclaim(self, consumer: str) -> None:
+        r = await get_redis()
+        for kind, stream in ingest_stream.STREAMS.items():
+            cursor = "0-0"
+            while True:
+                reply = await r.xautoclaim(
+                    stream, ingest_stream.GROUP, consumer, self.claim_idle_ms, start_id=cursor, count=self.batch
+                )
+                cursor, entries = reply[0], reply[1]
+                # entries trimmed from the stream while pending come back as None
+                entries = [e for e in entries if e and e[1] is not None]
+                if entries:
+                    await self._retry(kind, stream, entries)
+                if cursor == "0-0":
+                    break
+            # forget consumers of exited processes once they hold nothing pending
+            for c in await r.xinfo_consumers(stream, ingest_stream.GROUP):
+                if c["pending"] == 0 and c["idle"] > STALE_CONSUMER_IDLE_MS and c["name"] != consumer:
+                    await r.xgroup_delconsumer(stream, ingest_stream.GROUP, c["name"])
+
+    async def _retry(self, kind: str, stream: str, entries: List) -> None:
+        """Dead-letter reclaimed entries past INGEST_STREAM_MAX_DELIVERIES, apply the rest one by one."""
+        deliveries = await self._delivery_counts(stream, entries)
+        poison = [e for e in entries if deliveries.get(e[0], 0) > self.max_deliveries]
+        if poison:
+            self.stats["dead_lettered"] += await ingest_stream.dead_letter(kind, poison, deliveries)
+            logger.warning(
+                f"Dead-lettered {len(poison)} {kind} stream entries after {self.max_deliveries} deliveries "
+                f"(first {poison[0][0]})"
+            )
+        retry = [e for e in entries if deliveries.get(e[0], 0) <= self.max_deliveries]
+        self.stats["reclaimed"] += len(retry)
+        await self._apply_each(kind, retry)
+
+    async def _run(self, index: int) -> None:
+        consumer = f"{self.consumer_prefix}-{index}"
+        r = await get_redis()
+        # stagger reclaim passes across workers
+        next_claim = time.monotonic() + self.claim_interval * index / self.workers
+        streams = {stream: ">" for stream in ingest_stream.STREAMS.values()}
+        kinds = {stream: kind for kind, stream in ingest_stream.STREAMS.items()}
+
+        while True:
+            try:
+                if time.monotonic() >= next_claim:
+                    next_claim = time.monotonic() + self.claim_interval
+                    await self._reclaim(consumer)
+
+                reply = await r.xreadgroup(
+                    ingest_stream.GROUP, consumer, streams, count=self.batch, block=self.block_ms
+                )
+                for stream, entries in reply or []:
+                    self.stats["read"] += len(entries)
+                    await self._apply(kinds[stream], entries)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.stats["apply_errors"] += 1
+                logger.error(f"Stream consumer {consumer} error: {e}")
+                await asyncio.sleep(1.0)
+
+    async def start(self) -> None:
+        await ingest_stream.ensure_groups()
+        self._tasks = [
+            asyncio.create_task(self._run(i), name=f"stream-ingest-{i}") for i in range(self.workers)
+        ]
+        logger.info(
+            f"Stream ingest workers started ({self.workers} x batch<= {self.batch}, "
+            f"claim idle>= {self.claim_idle_ms}ms)"
+        )
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        for task in self._tasks:
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self._tasks = []
+        # anything read but not acked stays pending and is reclaimed by another consumer
+        logger.info("Stream ingest workers stopped")
+
+    def metrics(self) -> Dict[str, Any]:
+        return {**self.stats, "workers": len(self._tasks), "consumer_prefix": self.consumer_prefix}
+
+
+async def _lag() -> Dict[str, Any]:
+    return {"lag": await ingest_stream.stream_lag()}
+
+
+if __name__ == "__main__":
+    runner.main(StreamIngestWorkers, "Stream ingest", extra=_lag)
@@ -0,0 +1,286 @@
+"""
+Syslog Log Collector
+
+Listens for access-log lines forwarded over syslog (nginx/haproxy
+`access_log syslog:server=...`, rsyslog/syslog-ng forwarding) and counts them
+through log_service.LogAggregator:
+- UDP (one message per datagram) on LOG_SYSLOG_UDP_PORT
+- TCP (newline-delimited or RFC 6587 octet-counted frames) on LOG_SYSLOG_TCP_PORT
+The syslog header (RFC 3164 or 5424) is stripped before parsing, so the
+relay's hostname is not mistaken for the client IP.
+
+Backpressure: received lines go into a bounded queue (LOG_SYSLOG_QUEUE_MAX).
+When it is full, UDP datagrams are dropped and counted, and TCP readers wait,
+which pushes back on the sender through TCP flow control. A single flusher
+drains the queue in batches of up to LOG_COLLECTOR_BATCH_LINES lines (or
+LOG_COLLECTOR_BATCH_WAIT_MS) and writes each batch as aggregated, pipelined
+(status, ip) increments.
+
+Both sockets are bound with SO_REUSEPORT where the platform has it, so every
+API worker (gunicorn -w N) can run a collector on the same ports and the kernel
+spreads datagrams and connections across them; the counts all land in Redis.
+
+Enabled by LOG_SYSLOG_ENABLED; see api.workers.runner for standalone runs.
+"""
+
+import asyncio
+import re
+import socket
+import time
+from typing import Any, Dict, List, Optional, Set
+
+from loguru import logger
+
+from api.core.config import settings
+from api.services.log_service import LogAggregator
+from api.workers import runner
+
+DISCARD_CHUNK = 65536               # read size when skipping an oversized octet-counted frame
+REUSE_PORT = hasattr(socket, "SO_REUSEPORT")   # asyncio rejects reuse_port where it is missing
+
+# <PRI>VERSION TIMESTAMP HOST APP PROCID MSGID SD MSG  (SD is "-" or [..][..])
+_RFC5424_RE = re.compile(r"^1 \S+ \S+ \S+ \S+ \S+ (?:-|(?:\[(?:[^\]\\]|\\.)*\])+) ?")
+# <PRI>Mmm dd hh:mm:ss HOST TAG: MSG
+_RFC3164_RE = re.compile(r"^[A-Z][a-z]{2} [ \d]\d \d\d:\d\d:\d\d \S+ [^:\s]+: ?")
+
+
+def strip_syslog_header(msg: str) -> str:
+    """Return the message part of a syslog line; lines without a header pass through."""
+    if not msg.startswith("<"):
+        return msg
+    end = msg.find(">", 1, 5)
+    if end < 0:
+        return msg
+    body = msg[end + 1:]
+    m = _RFC5424_RE.match(body) or _RFC3164_RE.match(body)
+    return body[m.end():] if m else body
+
+
+class _UdpProtocol(asyncio.DatagramProtocol):
+    def __init__(self, collector: "SyslogCollector"):
+        self.collector = collector
+
+    def datagram_received(self, data: bytes, addr) -> None:
+        self.collector._offer(data)
+
+
+class SyslogCollector:
+    """UDP/TCP syslog listener -> batched log_service counts."""
+
+    def __init__(
+        self,
+        host: str | None = None,
+        udp_port: int | None = None,
+        tcp_port: int | None = None,
+        queue_max: int | None = None,
+        batch_lines: int | None = None,
+        batch_wait_ms: int | None = None,
+    ):
+        self.host = host or settings.LOG_SYSLOG_HOST
+        self.udp_port = settings.LOG_SYSLOG_UDP_PORT if udp_port is None else udp_port
+        self.tcp_port = settings.LOG_SYSLOG_TCP_PORT if tcp_port is None else tcp_port
+        self.queue_max = queue_max or settings.LOG_SYSLOG_QUEUE_MAX
+        self.batch_lines = batch_lines or settings.LOG_COLLECTOR_BATCH_LINES
+        self.batch_wait = (batch_wait_ms or settings.LOG_COLLECTOR_BATCH_WAIT_MS) / 1000.0
+        self.max_line = settings.LOG_INGEST_MAX_LINE_BYTES
+
+        self._queue: Optional[asyncio.Queue] = None
+        self._transport: Optional[asyncio.DatagramTransport] = None
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._connections: Set[asyncio.Task] = set()
+        self._flusher: Optional[asyncio.Task] = None
+        self._agg = LogAggregator()
+        self._rate = runner.RateWindow()
+
+        self.stats: Dict[str, Any] = {
+            "udp_datagrams": 0,
+            "tcp_connections": 0,
+            "received": 0,
+            "dropped": 0,
+            "oversized": 0,
+            "batches": 0,
+            "flush_errors": 0,
+            "lost": 0,
+            "last_batch_size": 0,
+            "last_flush_ms": 0.0,
+            "max_flush_ms": 0.0,
+        }
+
+    # ------------------------------------------------------------------
+    # receive
+    # ------------------------------------------------------------------
+    def _offer(self, data: bytes) -> None:
+        """UDP: never wait; drop and count when the queue is full."""
+        self.stats["udp_datagrams"] += 1
+        for line in data.split(b"\n"):
+            if not line.strip():
+                continue
+            self.stats["received"] += 1
+            try:
+                self._queue.put_nowait(line)
+            except asyncio.QueueFull:
+                self.stats["dropped"] += 1
+
+    async def _read_frame(self, reader: asyncio.StreamReader) -> Optional[bytes]:
+        """Next TCP frame: octet-counted ("LEN SP MSG") or newline-terminated; None at EOF."""
+        first = await reader.read(1)
+        if not first:
+            return None
+        if first.isdigit():
+            head = first + await reader.readuntil(b" ")
+            if head[:-1].isdigit():
+                n = int(head[:-1])
+                if n > self.max_line:
+                    # discard without buffering it: the count is the peer's claim, not a size we accept
+                    self.stats["oversized"] += 1
+                    while n:
+                        chunk = await reader.read(min(n, DISCARD_CHUNK))
+                        if not chunk:
+                            raise asyncio.IncompleteReadError(b"", n)
+                        n -= len(chunk)
+                    return b""
+                return await reader.readexactly(n)
+            return head + await reader.readline()
+        return first + await reader.readline()
+
+    async def _handle_tcp(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        self.stats["tcp_connections"] += 1
+        task = asyncio.current_task()
+        self._connections.add(task)
+        try:
+            while True:
+                try:
+                    frame = await self._read_frame(reader)
+                except asyncio.LimitOverrunError:
+                    # unterminated line longer than the stream limit: drop the connection
+                    self.stats["oversized"] += 1
+                    break
+                except asyncio.IncompleteReadError:
+                    break
+                if frame is None:
+                    break
+                frame = frame.rstrip(b"\r\n")
+                if not frame.strip():
+                    continue
+                self.stats["received"] += 1
+                await self._queue.put(frame)
+        except (ConnectionError, asyncio.CancelledError):
+            pass
+        finally:
+            self._connections.discard(task)
+            writer.close()
+
+    # ------------------------------------------------------------------
+    # flush
+    # ------------------------------------------------------------------
+    async def _next_batch(self) -> List[bytes]:
+        loop = asyncio.get_running_loop()
+        batch = [await self._queue.get()]
+        deadline = loop.time() + self.batch_wait
+        while len(batch) < self.batch_lines:
+            while len(batch) < self.batch_lines and not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+            if len(batch) >= self.batch_lines:
+                break
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _flush(self, batch: List[bytes]) -> None:
+        for raw in batch:
+            self._agg.add_line(strip_syslog_header(raw.decode("utf-8", "replace")))
+        start = time.perf_counter()
+        try:
+            await self._agg.flush()
+        except Exception as e:
+            # the aggregated counts of this batch are gone; syslog has no redelivery
+            self.stats["flush_errors"] += 1
+            self.stats["lost"] += len(batch)
+            logger.error(f"Syslog batch flush failed ({len(batch)} lines): {e}")
+            return
+        flush_ms = (time.perf_counter() - start) * 1000
+
+        s = self.stats
+        s["batches"] += 1
+        s["last_batch_size"] = len(batch)
+        s["last_flush_ms"] = round(flush_ms, 3)
+        s["max_flush_ms"] = max(s["max_flush_ms"], s["last_flush_ms"])
+        self._rate.add(len(batch))
+
+    async def _run_flusher(self) -> None:
+        while True:
+            await self._flush(await self._next_batch())
+
+    # ------------------------------------------------------------------
+    # lifecycle
+    # ------------------------------------------------------------------
+    async def start(self) -> None:
+        loop = asyncio.get_running_loop()
+        self._queue = asyncio.Queue(maxsize=self.queue_max)
+        if self.udp_port:
+            self._transport, _ = await loop.create_datagram_endpoint(
+                lambda: _UdpProtocol(self), local_addr=(self.host, self.udp_port),
+                reuse_port=REUSE_PORT or None,
+            )
+        if self.tcp_port:
+            try:
+                # the stream limit bounds unterminated lines
+                self._server = await asyncio.start_server(
+                    self._handle_tcp, self.host, self.tcp_port, limit=self.max_line + 1,
+                    reuse_port=REUSE_PORT or None,
+                )
+            except Exception:
+                if self._transport is not None:
+                    self._transport.close()
+                    self._transport = None
+                raise
+        self._flusher = asyncio.create_task(self._run_flusher(), name="syslog-log-flusher")
+        logger.info(
+            f"Syslog collector listening on {self.host} (udp {self.udp_port or 'off'}, "
+            f"tcp {self.tcp_port or 'off'}, batch<= {self.batch_lines}, queue<= {self.queue_max})"
+        )
+
+    async def stop(self) -> None:
+        if self._transport is not None:
+            self._transport.close()
+            self._transport = None
+        if self._server is not None:
+            self._server.close()
+            for task in list(self._connections):
+                task.cancel()
+            await self._server.wait_closed()
+            self._server = None
+        if self._flusher is not None:
+            self._flusher.cancel()
+            try:
+                await self._flusher
+            except asyncio.CancelledError:
+                pass
+            self._flusher = None
+        # Flush whatever is still buffered
+        if self._queue is not None and not self._queue.empty():
+            leftover = []
+            while not self._queue.empty():
+                leftover.append(self._queue.get_nowait())
+            for i in range(0, len(leftover), self.batch_lines):
+                await self._flush(leftover[i:i + self.batch_lines])
+        logger.info("Syslog collector stopped")
+
+    def metrics(self) -> Dict[str, Any]:
+        return {
+            **self.stats,
+            "parsed": self._agg.parsed,
+            "rejected": self._agg.rejected,
+            "queue_depth": self._queue.qsize() if self._queue is not None else 0,
+            "open_connections": len(self._connections),
+            "lines_per_sec": self._rate.per_sec(),
+        }
+
+
+if __name__ == "__main__":
+    runner.main(SyslogCollector, "Syslog collector")
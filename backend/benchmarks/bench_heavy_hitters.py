@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""
+Benchmark: per-status IP counts under a scan — exact sorted set vs heavy-hitter sketch
+
+Generates a scan-like workload for the unassigned status 598: --ips distinct source IPs
+seen a few times each, plus --hitters attacking IPs that send --hitter-share of
+all lines. The same lines are ingested through log_service.LogAggregator in
+both LOG_IP_COUNTS_MODE settings, then:
+- memory: MEMORY USAGE of the exact zset vs the Count-Min string + top-K zset
+- ingest: lines/sec for each mode
+- accuracy: recall of the true top --top IPs, and the largest overcount seen
+  against the documented bound (e/width * N)
+
+Usage (from backend/):
+    python benchmarks/bench_heavy_hitters.py --ips 1000000 --hitters 50 --top 20
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import sys
+import time
+from collections import Counter
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from api.core.config import settings
+from api.services import heavy_hitters, log_service
+from api.services.redis_client import get_redis, close_redis
+
+# log lines need a 3-digit status; 598 is unassigned, so no real traffic shares its keys
+STATUS = "598"
+
+
+def workload(n_ips: int, n_hitters: int, hitter_share: float):
+    rng = random.Random(273)
+    hitters = [f"203.0.113.{i % 250}" if i < 250 else f"198.51.{i // 250}.{i % 250}" for i in range(n_hitters)]
+    weights = [1 / (i + 1) for i in range(n_hitters)]
+    n_lines = int(n_ips * 3 / (1 - hitter_share))
+    scanners = [f"10.{(i >> 16) & 255}.{(i >> 8) & 255}.{i & 255}" for i in range(n_ips)]
+    lines = []
+    for _ in range(n_lines):
+        if rng.random() < hitter_share:
+            ip = rng.choices(hitters, weights)[0]
+        else:
+            ip = scanners[rng.randrange(n_ips)]
+        lines.append(f'{ip} - - [17/Oct/2026:10:00:00 +0000] "GET /wp-login.php HTTP/1.1" {STATUS} 0')
+    return lines
+
+
+async def ingest(lines, mode: str) -> float:
+    settings.LOG_IP_COUNTS_MODE = mode
+    agg = log_service.LogAggregator()
+    start = time.perf_counter()
+    for i, line in enumerate(lines, 1):
+        agg.add_line(line)
+        if i % settings.LOG_INGEST_FLUSH_LINES == 0:
+            await agg.flush()
+    await agg.flush()
+    return len(lines) / (time.perf_counter() - start)
+
+
+async def memory(r, *keys) -> str:
+    try:
+        total = 0
+        for key in keys:
+            total += await r.memory_usage(key, samples=0) or 0
+        return f"{total / 2**20:8.2f} MiB"
+    except Exception as e:
+        return f"unavailable ({e})"
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--ips", type=int, default=1000000)
+    parser.add_argument("--hitters", type=int, default=50)
+    parser.add_argument("--hitter-share", type=float, default=0.3)
+    parser.add_argument("--top", type=int, default=20)
+    args = parser.parse_args()
+
+    lines = workload(args.ips, args.hitters, args.hitter_share)
+    true = Counter(log_service.LOG_RE.search(line).group("ip") for line in lines)
+    print(f"{len(lines):,} lines, {len(true):,} distinct IPs, sketch {settings.LOG_HH_DEPTH}x{settings.LOG_HH_WIDTH}, "
+          f"top-K {settings.LOG_HH_TOP_K}")
+
+    r = await get_redis()
+    keys = [log_service.k_ip_counts(STATUS), heavy_hitters.k_hh_cms(STATUS),
+            heavy_hitters.k_hh_topk(STATUS), heavy_hitters.k_hh_total(STATUS)]
+    mode = settings.LOG_IP_COUNTS_MODE
+    try:
+        await r.delete(*keys)
+        exact_rate = await ingest(lines, "exact")
+        sketch_rate = await ingest(lines, "sketch")
+        print(f"ingest  exact : {exact_rate:12,.0f} lines/sec   memory {await memory(r, keys[0])}")
+        print(f"ingest  sketch: {sketch_rate:12,.0f} lines/sec   memory {await memory(r, *keys[1:])}")
+
+        want = {ip for ip, _ in true.most_common(args.top)}
+        top = await heavy_hitters.top(STATUS, args.top)
+        bounds = await heavy_hitters.error_bounds(STATUS)
+        over = max((c - true[ip] for ip, c in await heavy_hitters.top(STATUS, settings.LOG_HH_TOP_K)), default=0)
+        under = sum(1 for ip, c in top if c < true[ip])
+        print(f"recall@{args.top}: {len(want & {ip for ip, _ in top}) / len(want):.3f}")
+        print(f"max overcount: {over:,} (bound {bounds['max_overcount']:,} at {bounds['confidence']:.1%}), "
+              f"undercounts: {under}")
+        print(f"guaranteed above: {bounds['guaranteed_above']:,} lines")
+    finally:
+        settings.LOG_IP_COUNTS_MODE = mode
+        await r.delete(*keys)
+        await close_redis()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
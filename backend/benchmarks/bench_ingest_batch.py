@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""
+Benchmark: single-event telemetry ingest vs pipelined batch ingest
+
+Runs both code paths of telemetry_service against the Redis in REDIS_URL and
+reports events/sec. Uses BENCH-* site ids and deletes its keys afterwards.
+
+Usage (from backend/):
+    python benchmarks/bench_ingest_batch.py --events 20000 --batch-size 2000
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from api.models.schemas import TelemetryEvent
+from api.services import telemetry_service
+from api.services.redis_client import close_redis
+from benchmarks.cleanup import delete_bench_keys
+
+SITES = [f"BENCH-{i:02d}" for i in range(10)]
+DEVICE_TYPES = ["turbine", "thermal-engine", "electrical-rotor", "connected-device"]
+
+
+def generate_events(n: int):
+    events = []
+    for i in range(n):
+        site_id = SITES[i % len(SITES)]
+        device_type = DEVICE_TYPES[i % len(DEVICE_TYPES)]
+        events.append({
+            "site_id": site_id,
+            "device_type": device_type,
+            "device_id": f"{site_id}-{device_type[:3].upper()}-{i:06d}",
+            "metrics": {
+                "temperature": round(random.uniform(85.0, 95.0), 2),
+                "vibration": round(random.uniform(0.1, 2.5), 2),
+            },
+        })
+    return events
+
+
+async def bench_single(events) -> float:
+    parsed = [TelemetryEvent.model_validate(e) for e in events]
+    start = time.perf_counter()
+    for evt in parsed:
+        await telemetry_service.ingest_telemetry(evt)
+    return time.perf_counter() - start
+
+
+async def bench_batch(events, batch_size: int) -> float:
+    start = time.perf_counter()
+    for i in range(0, len(events), batch_size):
+        await telemetry_service.ingest_telemetry_batch(events[i:i + batch_size])
+    return time.perf_counter() - start
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--events", type=int, default=20000)
+    parser.add_argument("--batch-size", type=int, default=2000)
+    args = parser.parse_args()
+
+    events = generate_events(args.events)
+    await delete_bench_keys()
+
+    try:
+        single = await bench_single(events)
+        await delete_bench_keys()
+        batch = await bench_batch(events, args.batch_size)
+    finally:
+        await delete_bench_keys()
+        await close_redis()
+
+    print(f"Events: {args.events:,}  batch size: {args.batch_size:,}")
+    print(f"  single-event path : {single:8.3f}s  {args.events / single:12,.0f} events/sec")
+    print(f"  batch pipeline    : {batch:8.3f}s  {args.events / batch:12,.0f} events/sec")
+    print(f"  speedup           : {single / batch:8.1f}x")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""
+Benchmark: per-event ingest latency, multi-command path vs Lua EVALSHA path
+
+Measures p50/p99 latency of telemetry_service.ingest_telemetry and
+user_service.ingest_user_metric with REDIS_LUA_INGEST off and on. Uses BENCH-* keys.
+
+With --flush-scripts it then runs SCRIPT FLUSH and checks the NOSCRIPT reload
+fallback. SCRIPT FLUSH empties the script cache for every client of the server,
+so only pass it against a private Redis, never the shared one.
+
+Usage (from backend/):
+    python benchmarks/bench_ingest_scripts.py --events 5000 [--flush-scripts]
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from api.core.config import settings
+from api.models.schemas import TelemetryEvent, UserMetric
+from api.services import telemetry_service, user_service
+from api.services.redis_client import get_redis, close_redis
+from benchmarks.cleanup import delete_bench_keys
+
+SITES = [f"BENCH-{i:02d}" for i in range(10)]
+
+
+def percentile(samples, pct: float) -> float:
+    ordered = sorted(samples)
+    idx = min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1))))
+    return ordered[idx]
+
+
+def make_events(n: int):
+    telemetry, users = [], []
+    for i in range(n):
+        site = SITES[i % len(SITES)]
+        telemetry.append(TelemetryEvent(
+            site_id=site, device_type="turbine", device_id=f"{site}-TUR-{i:06d}",
+            metrics={"rpm": random.randint(3000, 3600), "temperature": round(random.uniform(85, 95), 2)},
+        ))
+        users.append(UserMetric(
+            site_id=site, session_id=f"bench-{i:06d}", user_id=f"user-{i % 5000}",
+            latency_ms=random.uniform(5, 250), cpu_pct=random.uniform(1, 90), mem_pct=random.uniform(10, 80),
+        ))
+    return telemetry, users
+
+
+async def measure(fn, items):
+    samples = []
+    for item in items:
+        start = time.perf_counter()
+        await fn(item)
+        samples.append((time.perf_counter() - start) * 1000)
+    return samples
+
+
+def report(label: str, samples):
+    print(f"  {label:<28} p50 {percentile(samples, 50):7.3f}ms  "
+          f"p99 {percentile(samples, 99):7.3f}ms  mean {statistics.fmean(samples):7.3f}ms")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--events", type=int, default=5000)
+    parser.add_argument("--flush-scripts", action="store_true",
+                        help="also test the NOSCRIPT fallback (SCRIPT FLUSH: private Redis only)")
+    args = parser.parse_args()
+
+    telemetry, users = make_events(args.events)
+    original = settings.REDIS_LUA_INGEST
+    await delete_bench_keys()
+
+    try:
+        print(f"Per-event ingest latency over {args.events:,} events")
+        for lua in (False, True):
+            settings.REDIS_LUA_INGEST = lua
+            mode = "lua evalsha" if lua else "multi-command"
+            report(f"telemetry ({mode})", await measure(telemetry_service.ingest_telemetry, telemetry))
+            report(f"user metric ({mode})", await measure(user_service.ingest_user_metric, users))
+            await delete_bench_keys()
+
+        if args.flush_scripts:
+            # Script cache flushed under our feet: first call must reload and succeed
+            settings.REDIS_LUA_INGEST = True
+            r = await get_redis()
+            await r.script_flush()
+            await telemetry_service.ingest_telemetry(telemetry[0])
+            await telemetry_service.ingest_telemetry_batch([e.model_dump() for e in telemetry[:100]])
+            await user_service.ingest_user_metric(users[0])
+            print("  NOSCRIPT fallback after SCRIPT FLUSH: ok")
+    finally:
+        settings.REDIS_LUA_INGEST = original
+        await delete_bench_keys()
+        await close_redis()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
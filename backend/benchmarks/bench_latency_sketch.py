@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""
+Benchmark: DDSketch latency percentiles — error bounds and memory per site
+
+1. Accuracy: feeds --samples synthetic latencies (lognormal body + slow tail)
+   into a sketch and compares p50/p90/p99/p99.9 against exact sorted-sample
+   quantiles; the relative error must stay within alpha.
+2. Mergeability: two half-sketches ("AZ1" and "AZ2") merged must equal the
+   sketch of all samples, bucket for bucket.
+3. Memory: writes the sketch to Redis as a hash (the same field layout as
+   user_service's sketches) and reports MEMORY USAGE bytes, compared with
+   keeping the raw samples in a list.
+
+Usage (from backend/):
+    python benchmarks/bench_latency_sketch.py --samples 1000000 --alpha 0.02
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from api.services.quantile_sketch import DDSketch
+from api.services.redis_client import get_redis, close_redis
+
+QUANTILES = (0.5, 0.9, 0.99, 0.999)
+
+
+def synthetic_latencies(n: int):
+    rng = random.Random(273)
+    out = []
+    for _ in range(n):
+        if rng.random() < 0.02:
+            out.append(rng.uniform(500, 5000))          # slow tail (timeouts, GC)
+        else:
+            out.append(rng.lognormvariate(3.5, 0.7))    # ~33ms median
+    return out
+
+
+async def redis_memory(sketch: DDSketch, samples) -> None:
+    r = await get_redis()
+    sketch_key, raw_key = "bench:latency_sketch", "bench:latency_raw"
+    try:
+        await r.delete(sketch_key, raw_key)
+        mapping = {str(i): c for i, c in sketch.buckets.items()}
+        if sketch.zero_count:
+            mapping["z"] = sketch.zero_count
+        await r.hset(sketch_key, mapping=mapping)
+        raw = samples[:100000]
+        for i in range(0, len(raw), 10000):
+            await r.rpush(raw_key, *(f"{x:.3f}" for x in raw[i:i + 10000]))
+        sketch_bytes = await r.memory_usage(sketch_key)
+        raw_bytes = await r.memory_usage(raw_key, samples=0)
+        encoding = await r.object("encoding", sketch_key)
+        print(f"  Redis sketch hash : {sketch_bytes:,} bytes ({len(mapping)} fields, {encoding})")
+        print(f"  Redis raw list    : {raw_bytes:,} bytes for {len(raw):,} samples "
+              f"(~{raw_bytes / len(raw) * len(samples):,.0f} bytes at {len(samples):,})")
+    except Exception as e:
+        print(f"  Redis MEMORY USAGE unavailable: {e}")
+    finally:
+        await r.delete(sketch_key, raw_key)
+        await close_redis()
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--samples", type=int, default=1000000)
+    parser.add_argument("--alpha", type=float, default=0.02)
+    args = parser.parse_args()
+
+    samples = synthetic_latencies(args.samples)
+
+    start = time.perf_counter()
+    sketch = DDSketch(args.alpha)
+    for x in samples:
+        sketch.add(x)
+    add_s = time.perf_counter() - start
+
+    exact = sorted(samples)
+    print(f"Samples: {args.samples:,}  alpha: {args.alpha}  buckets: {len(sketch.buckets)}  "
+          f"insert: {args.samples / add_s:,.0f} samples/sec")
+    worst = 0.0
+    for q in QUANTILES:
+        truth = exact[int(q * (len(exact) - 1))]
+        est = sketch.quantile(q)
+        err = abs(est - truth) / truth
+        worst = max(worst, err)
+        print(f"  p{q * 100:<5g} exact {truth:10.3f}ms  sketch {est:10.3f}ms  rel err {err:.4%}")
+    print(f"  worst relative error {worst:.4%} (bound {args.alpha:.2%}) -> {'ok' if worst <= args.alpha else 'VIOLATED'}")
+
+    az1, az2 = DDSketch(args.alpha), DDSketch(args.alpha)
+    for i, x in enumerate(samples):
+        (az1 if i % 2 else az2).add(x)
+    az1.merge(az2)
+    print(f"  AZ1+AZ2 merge identical to single sketch: {az1.buckets == sketch.buckets}")
+
+    await redis_memory(sketch, samples)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
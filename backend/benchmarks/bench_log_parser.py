@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+"""
+Benchmark: access log parsing — LOG_RE.search vs anchored parsers
+
+Generates --lines synthetic access log lines (combined format with realistic
+user agents, plus the odd shapes real logs contain: common format without
+referrer/UA, "-" requests from 408s, escaped quotes, syslog-prefixed lines,
+truncated lines and junk) and reports lines/sec for:
+- LOG_RE.search + groups          (what log ingest used before)
+- log_service.parse_ip_status     (what log ingest uses now)
+- log_service.parse_log_line      (all combined-format fields)
+It also checks that both parsers give exactly the same (ip, status) as the
+regex on every line, and exits non-zero if they do not.
+
+--long-lines adds unterminated lines of IP-like tokens, where the regex's
+unanchored .*? backtracks (quadratic in line length).
+
+No Redis needed. Usage (from backend/):
+    python benchmarks/bench_log_parser.py --lines 2000000
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from api.services.log_service import LOG_RE, parse_ip_status, parse_log_line
+
+METHODS = ["GET"] * 8 + ["POST", "PUT", "DELETE", "HEAD", "OPTIONS"]
+PATHS = ["/", "/api/v1/devices", "/api/v1/users/42/sessions", "/static/app.3f9a1c.js",
+         "/wp-login.php", "/search?q=a+b&page=2", "/images/site%20map.png"]
+STATUSES = ["200"] * 12 + ["201", "204", "301", "304", "400", "401", "403", "404", "404", "429", "500", "502", "503"]
+AGENTS = [
+    "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/126.0 Safari/537.36",
+    "Mozilla/5.0 (iPhone; CPU iPhone OS 17_5 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) Mobile/15E148",
+    "curl/8.5.0",
+    "python-requests/2.32.3",
+    "-",
+]
+
+
+def gen_line(rng: random.Random) -> str:
+    ip = f"{rng.randrange(1, 224)}.{rng.randrange(256)}.{rng.randrange(256)}.{rng.randrange(256)}"
+    ts = f"[17/Oct/2026:10:{rng.randrange(60):02d}:{rng.randrange(60):02d} +0000]"
+    req = f"{rng.choice(METHODS)} {rng.choice(PATHS)} HTTP/1.1"
+    status = rng.choice(STATUSES)
+    size = str(rng.randrange(20000)) if rng.random() < 0.9 else "-"
+    kind = rng.random()
+    if kind < 0.85:
+        return f'{ip} - - {ts} "{req}" {status} {size} "https://example.com/" "{rng.choice(AGENTS)}"'
+    if kind < 0.90:
+        return f'{ip} - frank {ts} "{req}" {status} {size}'
+    if kind < 0.92:
+        return f'{ip} - - {ts} "-" 408 0 "-" "-"'
+    if kind < 0.94:
+        return f'{ip} - - {ts} "{req}" {status} {size} "-" "Mozilla/5.0 \\"quoted\\" agent"'
+    if kind < 0.96:
+        return f'<134>Oct 17 10:00:00 10.0.0.5 nginx: {ip} - - {ts} "{req}" {status} {size}'
+    if kind < 0.98:
+        line = f'{ip} - - {ts} "{req}" {status} {size}'
+        return line[:rng.randrange(len(line))]
+    return rng.choice(["", "-", "health check ok", f"{ip} connection reset", "1111.2.3.4 - - \"GET / x\" 2000"])
+
+
+def gen_long_line(rng: random.Random, n: int) -> str:
+    return " ".join(f"10.0.{rng.randrange(256)}.{rng.randrange(256)}" for _ in range(n // 12))
+
+
+def rate(fn, lines) -> float:
+    start = time.perf_counter()
+    for line in lines:
+        fn(line)
+    return len(lines) / (time.perf_counter() - start)
+
+
+def regex_ip_status(line):
+    m = LOG_RE.search(line)
+    return (m.group("ip"), m.group("status")) if m else None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--lines", type=int, default=2000000)
+    parser.add_argument("--long-lines", type=int, default=5, help="unterminated lines of --long-bytes each")
+    parser.add_argument("--long-bytes", type=int, default=20000)
+    args = parser.parse_args()
+
+    rng = random.Random(273)
+    lines = [gen_line(rng) for _ in range(args.lines)]
+    print(f"{len(lines):,} lines, {sum(map(len, lines)) / 2**20:.0f} MiB")
+
+    mismatches = 0
+    for line in lines:
+        want = regex_ip_status(line)
+        rec = parse_log_line(line)
+        if parse_ip_status(line) != want or (rec and (rec.ip, rec.status)) != (want or None):
+            mismatches += 1
+            if mismatches <= 5:
+                print(f"  MISMATCH: {line!r}")
+    parsed = sum(1 for line in lines if regex_ip_status(line))
+    print(f"identical (ip, status) on all lines: {mismatches == 0} ({parsed:,} parsed, {mismatches} mismatches)")
+
+    base = rate(regex_ip_status, lines)
+    print(f"  {'LOG_RE.search':16s}: {base:12,.0f} lines/sec")
+    for name, fn in (("parse_ip_status", parse_ip_status), ("parse_log_line", parse_log_line)):
+        r = rate(fn, lines)
+        print(f"  {name:16s}: {r:12,.0f} lines/sec  ({r / base:4.2f}x)")
+
+    if args.long_lines:
+        long_lines = [gen_long_line(rng, args.long_bytes) for _ in range(args.long_lines)]
+        print(f"{args.long_lines} unterminated {args.long_bytes:,}-byte lines of IP-like tokens")
+        for name, fn in (("LOG_RE.search", regex_ip_status), ("parse_ip_status", parse_ip_status)):
+            start = time.perf_counter()
+            for line in long_lines:
+                fn(line)
+            print(f"  {name:16s}: {(time.perf_counter() - start) * 1000 / args.long_lines:10.2f} ms/line")
+
+    sys.exit(1 if mismatches else 0)
+
+
+if __name__ == "__main__":
+    main()
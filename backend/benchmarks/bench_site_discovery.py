@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""
+Benchmark: site discovery via keyspace SCAN vs the devices:sites registry
+
+Seeds --devices device hashes spread over 10 BENCH-* sites through
+ingest_telemetry_batch (which maintains the registry), then times both
+discovery strategies. SCAN cost grows with total keys; the registry read
+grows with the number of sites.
+
+SCAN walks the whole keyspace of the target Redis, so any other data there
+adds to its cost exactly as it would in production.
+
+Usage (from backend/):
+    python benchmarks/bench_site_discovery.py --devices 100000 --rounds 20
+"""
+
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from api.services import telemetry_service
+from api.services.redis_client import get_redis, close_redis
+from benchmarks.cleanup import delete_bench_keys
+
+SITES = [f"BENCH-{i:02d}" for i in range(10)]
+
+
+async def seed(n: int) -> None:
+    batch = []
+    for i in range(n):
+        site = SITES[i % len(SITES)]
+        batch.append({"site_id": site, "device_type": "turbine", "device_id": f"{site}-TUR-{i:06d}",
+                      "metrics": {"rpm": 3300.0}})
+        if len(batch) == 5000:
+            await telemetry_service.ingest_telemetry_batch(batch)
+            batch = []
+    if batch:
+        await telemetry_service.ingest_telemetry_batch(batch)
+
+
+async def discover_scan():
+    r = await get_redis()
+    return [key.split(":")[-1] async for key in r.scan_iter(match="devices:active:site:*", count=100)]
+
+
+async def discover_registry():
+    return await telemetry_service.active_sites(int(time.time()) - 120)
+
+
+async def timed(fn, rounds: int):
+    samples, found = [], None
+    for _ in range(rounds):
+        start = time.perf_counter()
+        found = await fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples), found
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--devices", type=int, default=100000)
+    parser.add_argument("--rounds", type=int, default=20)
+    args = parser.parse_args()
+
+    await delete_bench_keys()
+    try:
+        await seed(args.devices)
+        r = await get_redis()
+        dbsize = await r.dbsize()
+
+        scan_ms, scan_sites = await timed(discover_scan, args.rounds)
+        reg_ms, reg_sites = await timed(discover_registry, args.rounds)
+
+        print(f"Keyspace: {dbsize:,} keys ({args.devices:,} seeded device hashes)")
+        print(f"  SCAN devices:active:site:*  median {scan_ms:9.3f}ms  -> {len(scan_sites)} sites")
+        print(f"  ZRANGEBYSCORE devices:sites median {reg_ms:9.3f}ms  -> {len(reg_sites)} sites")
+        print(f"  speedup: {scan_ms / reg_ms:.1f}x")
+        missing = set(SITES) - set(reg_sites)
+        if missing:
+            print(f"  ⚠️  registry missing seeded sites: {sorted(missing)}")
+    finally:
+        await delete_bench_keys()
+        await close_redis()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""
+Memory report: regular vs compact (DEVICE_SNAPSHOT_COMPACT) device snapshots
+
+Seeds --devices simulator-shaped devices (4 device types, 10 BENCH-* sites)
+through ingest_telemetry_batch in each format, then reports:
+- MEMORY USAGE averaged over --sample random device:{key} hashes
+- used_memory delta from INFO memory for the whole seed (includes zsets)
+
+Usage (from backend/):
+    python benchmarks/bench_snapshot_memory.py --devices 100000 --sample 2000
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from api.core.config import settings
+from api.services import telemetry_service
+from api.services.redis_client import get_redis, close_redis
+from benchmarks.cleanup import delete_bench_keys
+
+SITES = [f"BENCH-{i:02d}" for i in range(10)]
+
+
+def telemetry(device_type: str, rng: random.Random):
+    # Same shapes and ranges as simulators/mqtt_device_simulator.py
+    if device_type == "turbine":
+        return {"rpm": rng.randint(3000, 3600), "temperature": round(rng.uniform(85, 95), 2),
+                "vibration": round(rng.uniform(0.1, 2.5), 2), "power_output": round(rng.uniform(50, 100), 2),
+                "fuel_consumption": round(rng.uniform(10, 15), 2)}
+    if device_type == "thermal-engine":
+        return {"temperature": round(rng.uniform(120, 180), 2), "pressure": round(rng.uniform(100, 150), 2),
+                "efficiency": round(rng.uniform(85, 98), 2), "coolant_level": round(rng.uniform(70, 100), 2)}
+    if device_type == "electrical-rotor":
+        return {"voltage": round(rng.uniform(220, 240), 2), "current": round(rng.uniform(15, 25), 2),
+                "frequency": round(rng.uniform(59.8, 60.2), 2), "power_factor": round(rng.uniform(0.85, 0.95), 2)}
+    return {"battery_level": rng.randint(20, 100), "signal_strength": rng.randint(-90, -40),
+            "data_transmitted": rng.randint(100, 10000)}
+
+
+def generate(n: int):
+    rng = random.Random(273)
+    types = ["turbine", "thermal-engine", "electrical-rotor", "connected-device"]
+    events = []
+    for i in range(n):
+        site, dtype = SITES[i % len(SITES)], types[(i // len(SITES)) % len(types)]
+        events.append({"site_id": site, "device_type": dtype,
+                       "device_id": f"{site}-{dtype[:3].upper()}-{i:06d}", "metrics": telemetry(dtype, rng)})
+    return events
+
+
+async def measure(events, sample: int, compact: bool):
+    r = await get_redis()
+    settings.DEVICE_SNAPSHOT_COMPACT = compact
+    await delete_bench_keys()
+    before = (await r.info("memory"))["used_memory"]
+    for i in range(0, len(events), 5000):
+        await telemetry_service.ingest_telemetry_batch(events[i:i + 5000])
+    after = (await r.info("memory"))["used_memory"]
+
+    keys = [telemetry_service.k_device_hash(telemetry_service.device_key(e["site_id"], e["device_type"], e["device_id"]))
+            for e in random.Random(1).sample(events, min(sample, len(events)))]
+    pipe = r.pipeline(transaction=False)
+    for k in keys:
+        pipe.memory_usage(k, samples=0)
+    sizes = [s for s in await pipe.execute() if s]
+    return sum(sizes) / len(sizes), after - before
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--devices", type=int, default=100000)
+    parser.add_argument("--sample", type=int, default=2000)
+    args = parser.parse_args()
+
+    events = generate(args.devices)
+    original = settings.DEVICE_SNAPSHOT_COMPACT
+    try:
+        regular_hash, regular_total = await measure(events, args.sample, compact=False)
+        compact_hash, compact_total = await measure(events, args.sample, compact=True)
+    finally:
+        settings.DEVICE_SNAPSHOT_COMPACT = original
+        await delete_bench_keys()
+        await close_redis()
+
+    print(f"Devices: {args.devices:,}  (MEMORY USAGE sampled over {args.sample:,} hashes)")
+    print(f"  regular snapshot : {regular_hash:7.1f} bytes/device hash   used_memory +{regular_total / 2**20:8.2f} MiB")
+    print(f"  compact snapshot : {compact_hash:7.1f} bytes/device hash   used_memory +{compact_total / 2**20:8.2f} MiB")
+    print(f"  saving           : {1 - compact_hash / regular_hash:7.1%} per hash, "
+          f"{(regular_total - compact_total) / 2**20:.2f} MiB total")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
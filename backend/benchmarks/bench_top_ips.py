@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""
+Benchmark: top-N error IPs — HGETALL + Python sort vs sorted set ZREVRANGE
+
+Seeds --ips distinct IPs with Zipf-like counts into both layouts for one
+BENCH status code:
+- legacy:  logs:status:{status}:by_ip   hash, read with HGETALL + sort (old top_error_ips)
+- current: logs:status:{status}:top_ips zset, read with ZREVRANGE 0 N-1 (log_service.top_error_ips)
+then reports per-query latency (p50/p99 over --repeat), the write cost of
+HINCRBY vs ZINCRBY (pipelined, --writes increments), and MEMORY USAGE of each key.
+
+Usage (from backend/):
+    python benchmarks/bench_top_ips.py --ips 1000000 --top 10 --repeat 20
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from api.services import log_service
+from api.services.redis_client import get_redis, close_redis
+
+STATUS = "BENCH-599"
+
+
+def ip(i: int) -> str:
+    return f"{10 + (i >> 24) % 200}.{(i >> 16) & 255}.{(i >> 8) & 255}.{i & 255}"
+
+
+async def seed(r, n: int) -> None:
+    rng = random.Random(273)
+    hkey, zkey = log_service.k_errors_by_ip(STATUS), log_service.k_ip_counts(STATUS)
+    for start in range(0, n, 10000):
+        counts = {ip(i): int(1000 / (1 + rng.random() * i)) + 1 for i in range(start, min(start + 10000, n))}
+        pipe = r.pipeline(transaction=False)
+        pipe.hset(hkey, mapping=counts)
+        pipe.zadd(zkey, counts)
+        await pipe.execute()
+
+
+async def legacy_top(r, top_n: int):
+    raw = await r.hgetall(log_service.k_errors_by_ip(STATUS))
+    pairs = [(k, int(v)) for k, v in raw.items()]
+    pairs.sort(key=lambda x: x[1], reverse=True)
+    return pairs[:top_n]
+
+
+async def timed(fn, repeat: int):
+    samples = []
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = await fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    samples.sort()
+    return result, statistics.median(samples), samples[min(len(samples) - 1, int(len(samples) * 0.99))]
+
+
+async def write_rate(r, key_fn, writes: int, n_ips: int) -> float:
+    rng = random.Random(1)
+    start = time.perf_counter()
+    for chunk in range(0, writes, 1000):
+        pipe = r.pipeline(transaction=False)
+        for _ in range(min(1000, writes - chunk)):
+            key_fn(pipe, ip(rng.randrange(n_ips)))
+        await pipe.execute()
+    return writes / (time.perf_counter() - start)
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--ips", type=int, default=1000000)
+    parser.add_argument("--top", type=int, default=10)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--writes", type=int, default=100000)
+    args = parser.parse_args()
+
+    r = await get_redis()
+    hkey, zkey = log_service.k_errors_by_ip(STATUS), log_service.k_ip_counts(STATUS)
+    try:
+        await r.delete(hkey, zkey)
+        start = time.perf_counter()
+        await seed(r, args.ips)
+        print(f"Seeded {args.ips:,} distinct IPs in {time.perf_counter() - start:.1f}s")
+
+        legacy, l50, l99 = await timed(lambda: legacy_top(r, args.top), args.repeat)
+        current, c50, c99 = await timed(lambda: log_service.top_error_ips(STATUS, args.top), args.repeat)
+        same = [c for _, c in legacy] == [c for _, c in current]
+        print(f"top-{args.top} query ({args.repeat} runs)")
+        print(f"  HGETALL + sort : p50 {l50:9.2f} ms   p99 {l99:9.2f} ms")
+        print(f"  ZREVRANGE      : p50 {c50:9.2f} ms   p99 {c99:9.2f} ms   ({l50 / c50:,.0f}x faster at p50)")
+        print(f"  same counts: {same}")
+
+        h_rate = await write_rate(r, lambda p, a: p.hincrby(hkey, a, 1), args.writes, args.ips)
+        z_rate = await write_rate(r, lambda p, a: p.zincrby(zkey, 1, a), args.writes, args.ips)
+        print(f"increments ({args.writes:,}, pipelined x1000)")
+        print(f"  HINCRBY        : {h_rate:12,.0f} ops/sec")
+        print(f"  ZINCRBY        : {z_rate:12,.0f} ops/sec")
+
+        try:
+            h_mem = await r.memory_usage(hkey, samples=0)
+            z_mem = await r.memory_usage(zkey, samples=0)
+            print(f"memory: hash {h_mem / 2**20:.1f} MiB, zset {z_mem / 2**20:.1f} MiB")
+        except Exception as e:
+            print(f"MEMORY USAGE unavailable: {e}")
+    finally:
+        await r.delete(hkey, zkey)
+        await close_redis()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,40 @@
+"""
+Cleanup shared by the benchmarks that drive the ingest paths.
+
+Ingest fans one event out to many key families (presence zsets per site and
+per site|type, snapshot hashes, rollup buckets, HyperLogLogs, latency sketches,
+role counters) and to registry zsets shared with real traffic. Every key and
+registry member a benchmark writes carries its BENCH- site id (sessions:
+bench-), so cleanup matches on that rather than listing families one by one,
+and new key families are covered without touching every benchmark.
+"""
+
+from typing import Iterable
+
+from api.services.distinct_service import k_hll_sites
+from api.services.redis_client import get_redis
+from api.services.telemetry_service import k_device_site_types, k_device_sites
+from api.services.user_service import k_user_sites
+
+KEY_PATTERNS = ("*BENCH-*", "user:session:bench-*")
+REGISTRIES = (k_device_sites(), k_device_site_types(), k_user_sites(), k_hll_sites())
+
+
+async def delete_bench_keys(patterns: Iterable[str] = KEY_PATTERNS) -> int:
+    """Delete BENCH keys (SCAN) and BENCH members of the shared registries; returns keys deleted."""
+    r = await get_redis()
+    deleted = 0
+    for pattern in patterns:
+        batch = []
+        async for key in r.scan_iter(match=pattern, count=1000):
+            batch.append(key)
+            if len(batch) >= 1000:
+                deleted += await r.delete(*batch)
+                batch = []
+        if batch:
+            deleted += await r.delete(*batch)
+    for registry in REGISTRIES:
+        members = [m async for m, _ in r.zscan_iter(registry, match="BENCH-*", count=1000)]
+        for i in range(0, len(members), 1000):
+            await r.zrem(registry, *members[i:i + 1000])
+    return deleted
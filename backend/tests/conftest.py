@@ -0,0 +1,40 @@
+"""
+Shared fixtures for the backend test suite.
+
+Tests run against fakeredis (with Lua support via lupa), so they need no Redis
+server. Run from backend/:
+    pip install -r requirements-dev.txt
+    python -m pytest -q
+"""
+
+import os
+import sys
+
+import fakeredis
+import pytest
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from api.services import redis_client, redis_scripts
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+@pytest.fixture
+def redis():
+    """
+    A fresh fake Redis server behind redis_client.get_redis()/get_redis_binary().
+    Yields the text (decode_responses=True) client.
+    """
+    server = fakeredis.FakeServer()
+    redis_client._redis = fakeredis.aioredis.FakeRedis(server=server, decode_responses=True)
+    redis_client._redis_binary = fakeredis.aioredis.FakeRedis(server=server, decode_responses=False)
+    # every test starts with an empty script cache
+    for script in redis_scripts.ALL_SCRIPTS:
+        script._loaded = False
+    yield redis_client._redis
+    redis_client._redis = None
+    redis_client._redis_binary = None
@@ -0,0 +1,38 @@
+import math
+import struct
+
+from api.services import device_codec
+
+
+def raw(packed):
+    return {device_codec.COMPACT_FIELD.encode(): packed}
+
+
+def test_snapshot_round_trip():
+    packed = device_codec.encode_snapshot("turbine", {"rpm": 1200.0, "vibration": 0.5}, 1_700_000_000)
+    snap = device_codec.decode_snapshot("S1|turbine|d1", raw(packed))
+    assert snap == {
+        "site_id": "S1", "device_type": "turbine", "device_id": "d1",
+        "last_seen_ts": "1700000000", "m:rpm": "1200.0", "m:vibration": "0.5",
+    }
+
+
+def test_snapshots_written_with_a_shorter_or_longer_schema_decode_their_known_prefix():
+    older = struct.pack("<BI4f", device_codec.SCHEMA_VERSION, 7, 1.0, 2.0, math.nan, 4.0)
+    snap = device_codec.decode_snapshot("S1|turbine|d1", raw(older))
+    assert (snap["m:rpm"], snap["m:temperature"], snap["m:power_output"]) == ("1.0", "2.0", "4.0")
+    assert "m:fuel_consumption" not in snap
+
+    newer = struct.pack("<BI6f", device_codec.SCHEMA_VERSION, 7, *range(1, 7))
+    snap = device_codec.decode_snapshot("S1|turbine|d1", raw(newer))
+    assert snap["m:fuel_consumption"] == "5.0" and len(snap) == 4 + 5
+
+
+def test_unknown_type_version_or_length_degrades_to_identity():
+    identity = {"site_id": "S1", "device_type": "pump", "device_id": "d1", "last_seen_ts": "7"}
+    assert device_codec.decode_snapshot("S1|pump|d1", raw(struct.pack("<BIf", 1, 7, 1.0))) == identity
+    assert device_codec.decode_snapshot("S1|turbine|d1", raw(struct.pack("<BIf", 9, 7, 1.0)))["last_seen_ts"] == "7"
+    assert "m:rpm" not in device_codec.decode_snapshot("S1|turbine|d1", raw(struct.pack("<BI", 1, 7) + b"xx"))
+    assert device_codec.decode_snapshot("S1|turbine|d1", raw(b"\x01")) == {
+        "site_id": "S1", "device_type": "turbine", "device_id": "d1",
+    }
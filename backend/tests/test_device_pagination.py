@@ -0,0 +1,48 @@
+import pytest
+
+from api.services import telemetry_service as ts
+
+pytestmark = pytest.mark.anyio
+
+
+async def seed(n):
+    await ts.ingest_telemetry_batch([
+        {"site_id": "S1", "device_type": "turbine", "device_id": f"d{i:02d}"} for i in range(n)
+    ])
+
+
+async def test_walk_returns_every_device_once_while_devices_are_refreshed(redis):
+    await seed(10)
+    zkey = ts.k_device_zset_site("S1")
+
+    seen, cursor = [], None
+    while True:
+        page = await ts.get_active_devices_page("S1", limit=3, cursor=cursor)
+        seen.extend(d["device_id"] for d in page["devices"])
+        # concurrent ingest: refresh everything not yet returned, add a newcomer
+        for member in await redis.zrange(zkey, 0, -1):
+            await redis.zadd(zkey, {member: page["as_of"] + 5})
+        cursor = page["next_cursor"]
+        if cursor is None:
+            break
+
+    assert sorted(seen) == [f"d{i:02d}" for i in range(10)]
+    assert await redis.keys("devices:page:*") == []        # snapshot dropped with the last page
+
+
+async def test_single_page_needs_no_snapshot(redis):
+    await seed(3)
+    page = await ts.get_active_devices_page("S1", limit=3)
+    assert len(page["devices"]) == 3
+    assert page["next_cursor"] is None
+    assert await redis.keys("devices:page:*") == []
+
+
+async def test_expired_or_malformed_cursor_is_rejected(redis):
+    await seed(5)
+    page = await ts.get_active_devices_page("S1", limit=2)
+    await redis.delete(*await redis.keys("devices:page:*"))
+    with pytest.raises(ValueError, match="expired"):
+        await ts.get_active_devices_page("S1", limit=2, cursor=page["next_cursor"])
+    with pytest.raises(ValueError, match="invalid"):
+        await ts.get_active_devices_page("S1", limit=2, cursor="garbage")
@@ -0,0 +1,36 @@
+import pytest
+
+from api.core.config import settings
+from api.services import distinct_service
+from api.services import telemetry_service as ts
+
+pytestmark = pytest.mark.anyio
+
+
+def events(site, devices):
+    return [{"site_id": site, "device_type": "turbine", "device_id": d} for d in devices]
+
+
+async def test_distinct_devices_per_site_and_across_sites(redis, monkeypatch):
+    monkeypatch.setattr(settings, "DISTINCT_HLL_ENABLED", True)
+    await ts.ingest_telemetry_batch(events("S1", ["d1", "d2", "d3"]))
+    await ts.ingest_telemetry_batch(events("S1", ["d1", "d2"]))          # repeats are not recounted
+    await ts.ingest_telemetry_batch(events("S2", ["d1"]))                # same id, other site
+
+    one = await distinct_service.count_distinct_devices("S1", window_sec=3600)
+    assert one["distinct_devices"] == 3
+    assert one["resolution"] == "fine"
+
+    every = await distinct_service.count_distinct_devices(window_sec=3600)
+    assert every["total_distinct_devices"] == 4
+    assert {s["site_id"]: s["distinct_devices"] for s in every["sites"]} == {"S1": 3, "S2": 1}
+
+    longer = await distinct_service.count_distinct_devices("S1", window_sec=settings.DISTINCT_HLL_FINE_RETENTION_SEC + 1)
+    assert longer["resolution"] == "hour" and longer["distinct_devices"] == 3
+
+
+async def test_window_beyond_retention_is_rejected(redis):
+    with pytest.raises(ValueError):
+        await distinct_service.count_distinct_devices("S1", window_sec=settings.DISTINCT_HLL_HOUR_RETENTION_SEC + 1)
+    with pytest.raises(ValueError):
+        await distinct_service.count_distinct_devices("S1", window_sec=0)
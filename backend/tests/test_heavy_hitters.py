@@ -0,0 +1,56 @@
+import pytest
+
+from api.core.config import settings
+from api.services import heavy_hitters
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+def sketch(monkeypatch):
+    monkeypatch.setattr(settings, "LOG_HH_DEPTH", 4)
+    monkeypatch.setattr(settings, "LOG_HH_WIDTH", 1024)
+    monkeypatch.setattr(settings, "LOG_HH_TOP_K", 3)
+
+
+async def test_estimates_never_undercount(redis, sketch):
+    counts = {("500", f"10.0.0.{i}"): i for i in range(1, 41)}
+    await heavy_hitters.add_counts(counts)
+
+    top = await heavy_hitters.top("500", 10)
+    assert len(top) == 3
+    for ip, estimate in top:
+        assert estimate >= counts[("500", ip)]
+    bounds = await heavy_hitters.error_bounds("500")
+    assert bounds["total"] == sum(counts.values())
+    assert bounds["tracked"] == bounds["capacity"] == 3
+    for ip, estimate in top:
+        assert estimate - bounds["max_overcount"] <= counts[("500", ip)]
+
+
+async def test_heavy_ip_evicts_the_minimum_once_the_set_is_full(redis, sketch):
+    await heavy_hitters.add_counts({("404", f"10.0.0.{i}"): 1 for i in range(1, 4)})
+    await heavy_hitters.add_counts({("404", "10.9.9.9"): 50})
+
+    top = await heavy_hitters.top("404", 3)
+    assert top[0] == ("10.9.9.9", 50)
+    assert len(top) == 3
+    bounds = await heavy_hitters.error_bounds("404")
+    assert bounds["guaranteed_above"] == top[-1][1]
+
+
+async def test_statuses_and_dimensions_are_kept_apart(redis, sketch, monkeypatch):
+    await heavy_hitters.add_counts({("404", "10.0.0.1"): 5, ("500", "10.0.0.2"): 7})
+    assert await heavy_hitters.top("404", 5) == [("10.0.0.1", 5)]
+    assert await heavy_hitters.top("500", 5) == [("10.0.0.2", 7)]
+
+    # resized sketches start fresh
+    monkeypatch.setattr(settings, "LOG_HH_WIDTH", 2048)
+    assert await heavy_hitters.top("404", 5) == []
+    assert (await heavy_hitters.error_bounds("404"))["total"] == 0
+
+
+def test_counter_indexes_land_in_their_rows():
+    idx = heavy_hitters.counter_indexes("10.0.0.1", 5, 100)
+    assert idx == heavy_hitters.counter_indexes("10.0.0.1", 5, 100)
+    assert [i // 100 for i in idx] == [0, 1, 2, 3, 4]
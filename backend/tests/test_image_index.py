@@ -0,0 +1,69 @@
+import pytest
+
+from api.core.config import settings
+from api.services import image_service
+
+pytestmark = pytest.mark.anyio
+
+
+class FakeCursor:
+    def __init__(self, rows):
+        self.rows = rows
+
+    def batch_size(self, n):
+        return self
+
+    async def __aiter__(self):
+        for row in self.rows:
+            yield dict(row)
+
+
+class FakeCollection:
+    def __init__(self):
+        self.docs = []
+        self.queries = []
+        self.indexes = []
+
+    def find(self, query, projection):
+        self.queries.append(query)
+        since = query.get("updated_at", {}).get("$gte", float("-inf"))
+        return FakeCursor([d for d in self.docs if d["updated_at"] >= since])
+
+    async def create_index(self, keys):
+        self.indexes.append(keys)
+
+
+@pytest.fixture
+def coll(monkeypatch):
+    coll = FakeCollection()
+    monkeypatch.setattr(image_service, "get_db", lambda: {image_service.COLL: coll})
+    monkeypatch.setattr(image_service, "_index", None)
+    monkeypatch.setattr(image_service, "_synced_until", 0.0)
+    monkeypatch.setattr(image_service, "_next_refresh", 0.0)
+    monkeypatch.setattr(settings, "IMAGE_INDEX_ENGINE", "exact")
+    monkeypatch.setattr(settings, "IMAGE_INDEX_REFRESH_SEC", 0.0)
+    return coll
+
+
+def doc(image_id, updated_at, vec=(1.0, 0.0)):
+    return {"image_id": image_id, "embedding": list(vec), "metadata": {}, "updated_at": updated_at}
+
+
+async def test_ensure_indexes_indexes_updated_at(coll):
+    await image_service.ensure_indexes()
+    assert coll.indexes == ["updated_at"]
+
+
+async def test_refresh_picks_up_writes_from_a_lagging_clock(coll, monkeypatch):
+    monkeypatch.setattr(settings, "IMAGE_INDEX_SYNC_SKEW_SEC", 5.0)
+    coll.docs = [doc("a", 1000.0)]
+    index = await image_service._get_index()
+    assert len(index) == 1
+
+    # another writer whose clock is 3s behind inserts after our load
+    coll.docs.append(doc("b", 997.0, (0.0, 1.0)))
+    coll.docs[0] = doc("a", 1000.0, (0.6, 0.8))          # re-read rows are updated in place
+    results = await image_service.search_similar([0.0, 1.0], 5)
+
+    assert coll.queries[-1] == {"updated_at": {"$gte": 995.0}}
+    assert [(r["image_id"], round(r["score"], 3)) for r in results] == [("b", 1.0), ("a", 0.8)]
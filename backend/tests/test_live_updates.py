@@ -0,0 +1,29 @@
+import asyncio
+
+import pytest
+
+from api.core.config import settings
+from api.services import telemetry_service as ts
+from api.services.live_updates import PresenceFeed
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_subscribe_during_stop_gets_a_running_feed(redis, monkeypatch):
+    monkeypatch.setattr(settings, "LIVE_TICK_SEC", 0.01)
+    feed = PresenceFeed("devices")
+    first = await feed.subscribe("S1")
+
+    stopping = asyncio.create_task(feed.unsubscribe(first))    # last subscriber leaves
+    await asyncio.sleep(0)
+    second = await feed.subscribe("S1")                         # arrives while the loop is cancelled
+    await stopping
+
+    assert feed.metrics()["running"] and not feed._task.done()
+    assert (await second.queue.get()).startswith(b"event: snapshot")
+    await ts.ingest_telemetry_batch([{"site_id": "S1", "device_type": "turbine", "device_id": "d1"}])
+    frame = await asyncio.wait_for(second.queue.get(), 1.0)
+    assert frame.startswith(b"event: delta") and b"d1" in frame
+
+    await feed.unsubscribe(second)
+    assert not feed.metrics()["running"]
@@ -0,0 +1,103 @@
+import pytest
+
+from api.core.config import settings
+from api.services import log_service
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_migration_follows_the_hscan_cursor_across_chunks(redis):
+    legacy = {f"10.0.{i // 256}.{i % 256}": i + 1 for i in range(2500)}
+    await redis.hset(log_service.k_errors_by_ip("404"), mapping=legacy)
+    await redis.zadd(log_service.k_ip_counts("404"), {"10.0.0.0": 5})
+
+    migrated = await log_service.migrate_hash_counts(chunk=100)
+
+    assert migrated == {"404": 2500}
+    assert not await redis.exists(log_service.k_errors_by_ip("404"))
+    assert await redis.zcard(log_service.k_ip_counts("404")) == 2500
+    assert await redis.zscore(log_service.k_ip_counts("404"), "10.0.0.0") == 6
+    assert await redis.zscore(log_service.k_ip_counts("404"), "10.0.9.195") == 2500
+
+
+async def test_migration_does_not_stop_at_an_empty_page(redis, monkeypatch):
+    # Redis may return an empty page with a non-zero cursor
+    await redis.hset(log_service.k_errors_by_ip("500"), mapping={"10.0.0.1": 3, "10.0.0.2": 4})
+    hscan = redis.hscan
+    pages = []
+
+    async def sparse_hscan(key, cursor=0, **kwargs):
+        pages.append(cursor)
+        if cursor == 0 and len(pages) == 1:
+            return 7, {}
+        return await hscan(key, 0, **kwargs)
+
+    monkeypatch.setattr(redis, "hscan", sparse_hscan)
+    migrated = await log_service.migrate_hash_counts(chunk=1)
+
+    assert pages[:2] == [0, 7]
+    assert migrated == {"500": 2}
+    assert await redis.zrevrange(log_service.k_ip_counts("500"), 0, -1, withscores=True) == [
+        ("10.0.0.2", 4.0), ("10.0.0.1", 3.0),
+    ]
+
+
+async def test_top_error_ips_reads_the_top_of_the_zset(redis, monkeypatch):
+    monkeypatch.setattr(settings, "LOG_WINDOW_ENABLED", False)
+    monkeypatch.setattr(settings, "LOG_TEMPLATES_ENABLED", False)
+    for ip, n in [("10.0.0.1", 1), ("10.0.0.2", 3), ("10.0.0.3", 2)]:
+        for _ in range(n):
+            await log_service.ingest_log_line(f'{ip} - - [17/Oct/2026:10:00:00 +0000] "GET / HTTP/1.1" 403 0')
+
+    assert await log_service.top_error_ips("403", 2) == [("10.0.0.2", 3), ("10.0.0.3", 2)]
+    assert await log_service.top_error_ips_bounds("403") is None
+    assert await log_service.top_error_ips("404", 2) == []
+
+
+def _line(ip, status):
+    return f'{ip} - - [17/Oct/2026:10:00:00 +0000] "GET / HTTP/1.1" {status} 0'
+
+
+async def _ingest(counts):
+    for (ip, status), n in counts.items():
+        for _ in range(n):
+            await log_service.ingest_log_line(_line(ip, status))
+
+
+async def test_windowed_top_ips_merge_the_minutes_of_a_class(redis, monkeypatch):
+    monkeypatch.setattr(settings, "LOG_TEMPLATES_ENABLED", False)
+    now = [1_800_000_030]
+    monkeypatch.setattr(log_service.time, "time", lambda: now[0])
+    await _ingest({("10.0.0.1", "500"): 2, ("10.0.0.2", "404"): 9})
+    now[0] += 120
+    await _ingest({("10.0.0.1", "503"): 3, ("10.0.0.3", "500"): 1})
+
+    recent = await log_service.top_ips_window("5xx", 60)
+    assert recent["top"] == [("10.0.0.1", 3), ("10.0.0.3", 1)]
+    assert recent["statuses"] == ["500", "503"]
+
+    full = await log_service.top_ips_window("5xx", 300)
+    assert full["top"] == [("10.0.0.1", 5), ("10.0.0.3", 1)]
+    assert full["covered_from"] == 1_800_000_150 - 300 - (1_800_000_150 - 300) % 60
+    assert (await log_service.top_ips_window("404", 60))["top"] == []
+
+    with pytest.raises(ValueError):
+        await log_service.top_ips_window("500", settings.LOG_WINDOW_RETENTION_SEC + 1)
+
+
+@pytest.mark.parametrize("mode", ["exact", "sketch"])
+async def test_all_time_top_ips_of_a_class(redis, monkeypatch, mode):
+    from api.models.schemas import TopIPsQuery
+    from api.routers import sre
+
+    monkeypatch.setattr(settings, "LOG_TEMPLATES_ENABLED", False)
+    monkeypatch.setattr(settings, "LOG_IP_COUNTS_MODE", mode)
+    await _ingest({("10.0.0.1", "500"): 2, ("10.0.0.1", "503"): 3, ("10.0.0.2", "502"): 4, ("10.0.0.3", "404"): 9})
+
+    result = await sre.top_ips(TopIPsQuery(status_code="5xx", top_n=5))
+    assert result["top"] == [("10.0.0.1", 5), ("10.0.0.2", 4)]
+    if mode == "sketch":
+        assert sorted(result["error_bounds"]["by_status"]) == ["500", "502", "503"]
+        assert result["error_bounds"]["by_status"]["503"]["total"] == 3
+    else:
+        assert "error_bounds" not in result
@@ -0,0 +1,42 @@
+import pytest
+
+from api.core.config import settings
+from api.services import log_service
+
+pytestmark = pytest.mark.anyio
+
+LINE = b'10.0.0.1 - - [17/Oct/2026:10:00:00 +0000] "GET /a HTTP/1.1" 500 12\n'
+
+
+async def chunks(*parts):
+    for part in parts:
+        yield part
+
+
+async def test_rest_of_an_oversized_line_is_skipped_across_chunks(redis, monkeypatch):
+    monkeypatch.setattr(settings, "LOG_INGEST_MAX_LINE_BYTES", 100)
+    result = await log_service.ingest_log_stream(chunks(
+        LINE,
+        b"x" * 150,                 # oversized line, no newline yet
+        b"y" * 150,                 # still the same line
+        LINE[:-1],                  # its tail looks like a valid line
+        b"\n" + LINE,
+    ))
+
+    assert result["rejected"] == 1
+    assert result["parsed"] == 2
+
+
+async def test_sketch_mode_bounds_the_per_minute_window(redis, monkeypatch):
+    monkeypatch.setattr(settings, "LOG_IP_COUNTS_MODE", "sketch")
+    monkeypatch.setattr(settings, "LOG_HH_TOP_K", 3)
+    lines = b"".join(
+        LINE.replace(b"10.0.0.1", f"10.0.0.{i}".encode()) * i for i in range(1, 11)
+    )
+    await log_service.ingest_log_stream(chunks(lines))
+
+    [key] = await redis.keys("logs:status:500:top_ips:*")
+    assert await redis.zcard(key) == 3
+    window = await log_service.top_ips_window("500", 60)
+    assert window["approximate"] is True
+    assert window["top"] == [("10.0.0.10", 10), ("10.0.0.9", 9), ("10.0.0.8", 8)]
@@ -0,0 +1,57 @@
+import pytest
+
+from api.services import log_service
+from api.services.log_service import LOG_RE, LogRecord, parse_ip_status, parse_log_line
+
+COMBINED = (
+    '203.0.113.7 - alice [17/Oct/2026:10:00:00 +0000] "GET /api/v1/items?id=3 HTTP/1.1" 404 512 '
+    '"https://example.com/a \\"b\\"" "curl/8.5"'
+)
+
+LINES = [
+    COMBINED,
+    '10.0.0.1 - - [17/Oct/2026:10:00:00 +0000] "POST /login HTTP/2.0" 500 -',
+    '10.0.0.1 - - [17/Oct/2026:10:00:00 +0000] "GET /" 200 0',
+    # prefixed (syslog or container) lines fall back to the unanchored search
+    'Oct 17 10:00:00 web1 nginx: 10.0.0.2 - - [ts] "GET /x HTTP/1.1" 503 12',
+    '2026-10-17T10:00:00Z stdout F 10.0.0.3 - - "DELETE /y HTTP/1.1" 403 0',
+    # an IP-looking token before the real one
+    'v1.2.3.4 build 10.0.0.4 - - "GET /z HTTP/1.1" 401 0',
+    '10.0.0.5 - - [ts] "GET /a "b" HTTP/1.1" 400 0',
+    '10.0.0.6 "GET /quoted" 418',
+    # no request or status
+    '10.0.0.7 - - [ts] "GET /" 20',
+    "kernel: eth0 link up",
+    "",
+    '999.1.1.1 - - [ts] "GET / HTTP/1.1" 200 1',
+    '10.0.0.8 - - [ts]\n"GET / HTTP/1.1" 200 1',
+]
+
+
+@pytest.mark.parametrize("line", LINES)
+def test_parse_ip_status_agrees_with_log_re(line):
+    m = LOG_RE.search(line)
+    expected = m.group("ip", "status") if m else None
+    assert parse_ip_status(line) == expected
+    rec = parse_log_line(line)
+    assert (rec and (rec.ip, rec.status)) == (expected or None)
+
+
+def test_combined_fields():
+    assert parse_log_line(COMBINED) == LogRecord(
+        "203.0.113.7", "404", "GET", "/api/v1/items?id=3", "HTTP/1.1", 512,
+        'https://example.com/a \\"b\\"', "curl/8.5",
+    )
+
+
+def test_missing_protocol_and_dash_bytes():
+    rec = parse_log_line('10.0.0.1 - - [ts] "GET /" 200 -')
+    assert (rec.method, rec.path, rec.protocol, rec.bytes) == ("GET", "/", None, 0)
+    rec = parse_log_line('10.0.0.1 - - [ts] "GET / HTTP/1.1" 200')
+    assert rec.bytes is None and rec.referrer is None
+
+
+def test_fallback_lines_only_carry_ip_and_status():
+    line = 'Oct 17 10:00:00 web1 nginx: 10.0.0.2 - - [ts] "GET /x HTTP/1.1" 503 12'
+    assert parse_log_line(line) == LogRecord("10.0.0.2", "503")
+    assert log_service._fallback("no status here") is None
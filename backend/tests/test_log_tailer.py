@@ -0,0 +1,91 @@
+import os
+
+import pytest
+
+from api.core.config import settings
+from api.services.log_service import k_ip_counts
+from api.workers.log_tailer import LogFileTailer, k_tail_lease, k_tail_offsets
+
+pytestmark = pytest.mark.anyio
+
+
+def line(ip):
+    return f'{ip} - - [17/Oct/2026:10:00:00 +0000] "GET /a HTTP/1.1" 500 12\n'.encode()
+
+
+async def count(redis, ip):
+    return int(await redis.zscore(k_ip_counts("500"), ip) or 0)
+
+
+async def test_counts_and_checkpoint_are_written_together_and_resumed(redis, tmp_path):
+    path = tmp_path / "access.log"
+    path.write_bytes(line("10.0.0.1") * 3 + line("10.0.0.2")[:20])     # last line still partial
+
+    tailer = LogFileTailer(paths=[str(path)], read_bytes=256)
+    await tailer._follow(tailer._files[str(path)])
+    assert await count(redis, "10.0.0.1") == 3
+    inode, offset = (int(x) for x in (await redis.hget(k_tail_offsets(), str(path))).split(":"))
+    assert (inode, offset) == (os.stat(path).st_ino, 3 * len(line("10.0.0.1")))
+    await tailer.stop()
+
+    with open(path, "ab") as fh:
+        fh.write(line("10.0.0.2")[20:])
+    restarted = LogFileTailer(paths=[str(path)], read_bytes=256)       # resumes from the checkpoint
+    await restarted._follow(restarted._files[str(path)])
+    assert await count(redis, "10.0.0.1") == 3
+    assert await count(redis, "10.0.0.2") == 1
+
+
+async def test_rotation_drains_the_old_file_before_switching(redis, tmp_path):
+    path = tmp_path / "access.log"
+    path.write_bytes(line("10.0.0.1"))
+    tailer = LogFileTailer(paths=[str(path)], read_bytes=256)
+    tf = tailer._files[str(path)]
+    await tailer._follow(tf)
+
+    # the writer appends and logrotate renames between our short read and the stat
+    reopen = tailer._reopen_if_rotated
+
+    async def rotate_then_reopen(tf):
+        with open(path, "ab") as fh:
+            fh.write(line("10.0.0.2") * 2 + line("10.0.0.3")[:-1])   # last line without newline
+        os.rename(path, f"{path}.1")
+        path.write_bytes(line("10.0.0.4"))
+        tailer._reopen_if_rotated = reopen
+        await reopen(tf)
+
+    tailer._reopen_if_rotated = rotate_then_reopen
+    await tailer._follow(tf)            # EOF on the old fd, rotation noticed: drain, switch
+    await tailer._follow(tf)            # follows the new file
+    assert [await count(redis, f"10.0.0.{i}") for i in range(1, 5)] == [1, 2, 1, 1]
+    assert tailer.stats["rotations"] == 1
+
+
+async def test_only_the_lease_holder_reads_a_path(redis, tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "LOG_TAIL_COLLECTOR_ID", "web")
+    path = tmp_path / "access.log"
+    path.write_bytes(line("10.0.0.1") * 2)
+    first = LogFileTailer(paths=[str(path)], read_bytes=256)      # e.g. two gunicorn workers
+    second = LogFileTailer(paths=[str(path)], read_bytes=256)
+    for tailer in (first, second, first, second):
+        await tailer._follow(tailer._files[str(path)])
+    assert await count(redis, "10.0.0.1") == 2
+    assert await redis.get(k_tail_lease(str(path))) == first.owner
+    assert k_tail_offsets() == "logs:tail:offsets:web"
+    assert [f["leased"] for f in second.metrics()["files"]] == [False]
+
+    # the holder stops: the other tailer takes over from the shared checkpoint
+    await first.stop()
+    with open(path, "ab") as fh:
+        fh.write(line("10.0.0.1"))
+    await second._follow(second._files[str(path)])
+    assert await count(redis, "10.0.0.1") == 3
+
+    # ...and gives the file up once its lease is taken by someone else
+    await redis.set(k_tail_lease(str(path)), "elsewhere")
+    with open(path, "ab") as fh:
+        fh.write(line("10.0.0.1"))
+    await second._follow(second._files[str(path)])
+    assert await count(redis, "10.0.0.1") == 3
+    assert second.stats["lease_losses"] == 1
+    assert second._files[str(path)].fh is None
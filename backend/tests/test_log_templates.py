@@ -0,0 +1,104 @@
+import pytest
+
+from api.services import log_service, log_templates, redis_scripts
+from api.services.log_templates import TemplateMiner, top_templates
+from api.services.redis_client import get_redis
+
+
+def tree_size(node):
+    if isinstance(node, list):
+        return 1
+    return 1 + sum(tree_size(child) for child in node.values())
+
+
+def test_eviction_prunes_empty_tree_branches():
+    miner = TemplateMiner(max_clusters=2, max_children=10_000)
+    miner.add("warmup line")
+    baseline = None
+    for i in range(1000):
+        word = chr(97 + i % 26) + chr(97 + i // 26 % 26)        # no digits: each its own branch
+        miner.add(f"{word} failure in module")
+        if i == 10:
+            baseline = tree_size(miner._root)
+
+    assert miner.metrics()["clusters"] == 2
+    assert tree_size(miner._root) <= baseline
+
+
+def test_zero_settings_are_not_replaced_by_defaults():
+    miner = TemplateMiner(depth=1, sim_threshold=0.0)
+    a = miner.add("alpha beta gamma")
+    b = miner.add("alpha delta epsilon")
+    assert a is b and a.template == "alpha <*> <*>"
+
+
+async def flush(miner):
+    await redis_scripts.execute_pipeline(await get_redis(), miner.queue_flush)
+
+
+@pytest.mark.anyio
+async def test_workers_share_template_counts(redis):
+    first, second = TemplateMiner(), TemplateMiner()      # e.g. two gunicorn workers
+    for _ in range(3):
+        first.add("upstream timed out while reading", now=100.0)
+    second.add("upstream timed out while reading", now=200.0)
+    second.add("no live upstreams", now=150.0)
+    await flush(first)
+    await flush(second)
+    first.add("upstream timed out while reading", now=300.0)
+    await flush(first)
+    await flush(first)                                     # nothing new: no change
+
+    top = await top_templates()
+    assert [(t["template"], t["count"]) for t in top] == [
+        ("upstream timed out while reading", 5), ("no live upstreams", 1),
+    ]
+    assert top[0]["last_seen"] == 300.0 and top[0]["first_seen"] == 100.0
+    assert top[0]["group"] == "raw"
+    assert await top_templates(since=250.0) == top[:1]
+    assert await top_templates(group="404") == []
+
+
+@pytest.mark.anyio
+async def test_generalised_template_takes_its_counts_along(redis):
+    miner = TemplateMiner(depth=1, sim_threshold=0.5)
+    miner.add("alpha beta gamma")
+    miner.add("alpha beta gamma")
+    await flush(miner)
+    miner.add("alpha beta delta")
+    await flush(miner)
+
+    top = await top_templates()
+    assert [(t["template"], t["count"]) for t in top] == [("alpha beta <*>", 3)]
+    assert await redis.hlen(log_templates.k_template_info()) == 1
+
+
+@pytest.mark.anyio
+async def test_shared_view_keeps_the_most_recently_seen_templates(redis):
+    miner = TemplateMiner(max_clusters=2)
+    for i, line in enumerate(["one failure", "two problems here", "three bad things happened"]):
+        miner.add(line, now=float(i))
+        await flush(miner)
+
+    assert {t["template"] for t in await top_templates()} == {"two problems here", "three bad things happened"}
+    assert await redis.zcard(log_templates.k_template_counts()) == 2
+
+
+@pytest.mark.anyio
+async def test_ingest_mines_from_the_parse_match(redis, monkeypatch):
+    monkeypatch.setattr(log_templates, "miner", TemplateMiner())
+
+    def no_reparse(line):
+        raise AssertionError("line parsed twice")
+
+    monkeypatch.setattr(log_service, "parse_log_line", no_reparse)
+    await log_service.ingest_log_line('10.0.0.1 - - [17/Oct/2026:10:00:00 +0000] "GET /api/users/42 HTTP/1.1" 404 0')
+    await log_service.ingest_log_line('10.0.0.1 - - "GET /api/users/7" 404 0')
+    await log_service.ingest_log_line('web1 10.0.0.2 "POST /login HTTP/1.1" 500 0')    # fallback match
+    await log_service.ingest_log_line('10.0.0.1 - - "GET / HTTP/1.1" 200 0')
+
+    top = await top_templates()
+    assert [(t["group"], t["template"], t["count"]) for t in top] == [
+        ("404", "GET /api /users /<NUM>", 2),
+        ("500", "web1 <IP> \"POST /login HTTP/<NUM>\" <NUM> <NUM>", 1),
+    ]
@@ -0,0 +1,54 @@
+import asyncio
+
+import pytest
+
+from api.core.config import settings
+from api.workers import mqtt_consumer
+from api.workers.mqtt_consumer import MqttTelemetryConsumer
+
+pytestmark = pytest.mark.anyio
+
+
+def test_client_ids_are_unique_per_process_and_subscription_is_shared(monkeypatch):
+    monkeypatch.setattr(settings, "MQTT_SHARED_GROUP", "grp")
+    consumer = MqttTelemetryConsumer(topic="og/field/#")
+    assert consumer.subscription == "$share/grp/og/field/#"
+    assert str(mqtt_consumer.os.getpid()) in consumer.client_id
+    assert mqtt_consumer.socket.gethostname() in consumer.client_id
+
+    monkeypatch.setattr(settings, "MQTT_SHARED_GROUP", "")
+    assert MqttTelemetryConsumer(topic="og/field/#").subscription == "og/field/#"
+
+
+async def test_stop_flushes_in_flight_partial_and_queued_events(monkeypatch):
+    written = []
+    release = asyncio.Event()
+
+    async def slow_ingest(events):
+        await release.wait()
+        written.extend(e["device_id"] for e in events)
+        return {"accepted": len(events), "rejected": 0}
+
+    monkeypatch.setattr(mqtt_consumer.telemetry_service, "ingest_telemetry_batch", slow_ingest)
+    consumer = MqttTelemetryConsumer(batch_max_size=2, batch_max_wait_ms=60000, queue_max=100)
+    consumer._loop = asyncio.get_running_loop()
+    consumer._queue = asyncio.Queue()
+    consumer._running = True
+    consumer._flusher = asyncio.create_task(consumer._run_flusher())
+
+    def put(i):
+        consumer._enqueue((0.0, {"site_id": "S", "device_type": "t", "device_id": f"d{i}"}))
+
+    put(0), put(1)                 # full batch: flush starts and blocks in ingest
+    await asyncio.sleep(0.01)
+    put(2)                         # partly collected batch, waiting for more
+    await asyncio.sleep(0.01)
+    put(3), put(4), put(5)         # still queued when stop() starts
+
+    stopping = asyncio.create_task(consumer.stop())
+    await asyncio.sleep(0.01)
+    release.set()
+    await stopping
+
+    assert sorted(written) == [f"d{i}" for i in range(6)]
+    assert consumer.stats["flush_errors"] == 0
@@ -0,0 +1,66 @@
+import time
+
+import pytest
+
+from api.core.config import settings
+from api.services import device_codec, redis_scripts
+from api.services.redis_client import get_redis_binary
+from api.workers import presence_sweeper
+from api.workers.presence_sweeper import PresenceSweeper, sweep_orphan_hashes
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_orphan_pass_deletes_only_stale_hashes(redis, monkeypatch):
+    monkeypatch.setattr(settings, "DEVICE_PRESENCE_WINDOW_SEC", 120)
+    now = int(time.time())
+    await redis.hset("device:S|turbine|old", mapping={"last_seen_ts": now - 600})
+    await redis.hset("device:S|turbine|fresh", mapping={"last_seen_ts": now})
+    await redis.hset("device:S|turbine|no-ts", mapping={"m:rpm": "1"})
+    binary = await get_redis_binary()
+    await binary.hset("device:S|turbine|packed-old", device_codec.COMPACT_FIELD,
+                      device_codec.encode_snapshot("turbine", {"rpm": 1.0}, now - 600))
+    await binary.hset("device:S|turbine|packed-fresh", device_codec.COMPACT_FIELD,
+                      device_codec.encode_snapshot("turbine", {"rpm": 1.0}, now))
+
+    deleted = await sweep_orphan_hashes(now)
+
+    assert deleted["devices"] == 3
+    remaining = {k async for k in redis.scan_iter(match="device:*")}
+    assert remaining == {"device:S|turbine|fresh", "device:S|turbine|packed-fresh"}
+
+
+async def test_orphan_check_and_delete_is_atomic(redis):
+    # a re-report landing after the SCAN saw the key as stale must keep the hash
+    now = int(time.time())
+    await redis.hset("user:session:s1", mapping={"last_seen_ts": now - 600, "role": "admin"})
+    await redis.hset("user:session:s1", "last_seen_ts", now)       # refreshed before the delete
+    assert await redis_scripts.orphan_delete(redis, ["user:session:s1"], [now - 120, "c"]) == 0
+    assert await redis.hget("user:session:s1", "role") == "admin"
+
+
+async def test_passes_run_on_one_instance_and_no_scan_at_startup(redis, monkeypatch):
+    calls = {"sweep": 0, "orphans": 0}
+
+    async def fake_sweep(now=None):
+        calls["sweep"] += 1
+        return {"devices": 0, "device_types": 0, "users": 0}
+
+    async def fake_orphans(now=None):
+        calls["orphans"] += 1
+        return {}
+
+    monkeypatch.setattr(presence_sweeper, "sweep_presence", fake_sweep)
+    monkeypatch.setattr(presence_sweeper, "sweep_orphan_hashes", fake_orphans)
+    workers = [PresenceSweeper(interval_sec=5, orphan_scan_interval_sec=3600, reconcile_interval_sec=0)
+               for _ in range(3)]
+
+    for w in workers:
+        await w.tick()
+    assert calls == {"sweep": 1, "orphans": 0}
+    assert sum(w.stats["claimed_by_other"] for w in workers) == 2
+
+    for w in workers:
+        w._last_orphan_scan -= 3600
+        await w.tick()
+    assert calls["orphans"] == 1
@@ -0,0 +1,72 @@
+import json
+
+import pytest
+from redis.exceptions import ConnectionError
+
+from api.workers import rabbitmq_consumer
+from api.workers.rabbitmq_consumer import RabbitUserActivityConsumer
+
+pytestmark = pytest.mark.anyio
+
+
+class Message:
+    def __init__(self, session_id, redelivered=False):
+        self.body = json.dumps({
+            "event_type": "user_activity",
+            "data": {"region": "S1", "session_id": session_id, "user_id": "u"},
+        }).encode()
+        self.redelivered = redelivered
+        self.headers, self.content_type = {}, "application/json"
+        self.settled = None
+
+    async def ack(self, multiple=False):
+        self.settled = "ack"
+
+    async def nack(self, multiple=False, requeue=True):
+        assert not multiple
+        self.settled = "requeue" if requeue else "drop"
+
+
+class Exchange:
+    def __init__(self):
+        self.published = []
+
+    async def publish(self, message, routing_key):
+        self.published.append(json.loads(message.body)["data"]["session_id"])
+
+
+@pytest.fixture
+def consumer(monkeypatch):
+    async def apply(events):
+        if any(e["session_id"] == "bad" for _, e in events):
+            raise ValueError("poison")
+        return {"accepted": len(events)}
+
+    monkeypatch.setattr(rabbitmq_consumer.user_service, "apply_session_events", apply)
+    consumer = RabbitUserActivityConsumer()
+    consumer._dead_letter = Exchange()
+    return consumer
+
+
+async def test_failed_batch_is_requeued_once_then_only_the_poison_message_is_dead_lettered(consumer):
+    first = [Message("s1"), Message("bad")]
+    await consumer._flush(first)
+    assert [m.settled for m in first] == ["requeue", "requeue"]
+
+    again = [Message("s1", redelivered=True), Message("bad", redelivered=True), Message("s2")]
+    await consumer._flush(again)
+    assert [m.settled for m in again] == ["ack", "ack", "requeue"]
+    assert consumer._dead_letter.published == ["bad"]
+    assert consumer.stats["dead_lettered"] == 1
+    assert consumer.stats["accepted"] == 1
+
+
+async def test_redis_outage_never_dead_letters(consumer, monkeypatch):
+    async def down(events):
+        raise ConnectionError("redis down")
+
+    monkeypatch.setattr(rabbitmq_consumer.user_service, "apply_session_events", down)
+    batch = [Message("s1", redelivered=True), Message("s2", redelivered=True)]
+    await consumer._flush(batch)
+    assert [m.settled for m in batch] == ["requeue", "requeue"]
+    assert consumer._dead_letter.published == []
@@ -0,0 +1,40 @@
+import pytest
+from redis.exceptions import ResponseError
+
+from api.services import redis_scripts
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_noscript_retries_only_failed_script_calls(redis):
+    await redis_scripts.load_scripts(redis)
+    await redis.script_flush()
+
+    def build(pipe):
+        pipe.hincrby("counter", "n", 1)
+        redis_scripts.hash_to_zset.queue(pipe, ["src", "dst"], ["a"])
+        pipe.zincrby("z", 1, "m")
+
+    await redis.hset("src", "a", 5)
+    replies = await redis_scripts.execute_pipeline(redis, build)
+
+    assert replies == [1, 1, 1.0]
+    assert await redis.hget("counter", "n") == "1"          # not replayed
+    assert await redis.zscore("z", "m") == 1.0
+    assert await redis.zscore("dst", "a") == 5.0            # script ran exactly once
+    assert await redis.exists("src") == 0
+
+
+async def test_command_errors_are_raised_or_returned(redis):
+    def build(pipe):
+        pipe.set("k", "not-a-number")
+        pipe.incr("k")
+        pipe.set("after", "1")
+
+    with pytest.raises(ResponseError):
+        await redis_scripts.execute_pipeline(redis, build)
+    assert await redis.get("after") == "1"                  # the rest of the pipeline ran
+
+    replies = await redis_scripts.execute_pipeline(redis, build, raise_on_error=False)
+    assert isinstance(replies[1], ResponseError)
+    assert replies[0] is True and replies[2] is True
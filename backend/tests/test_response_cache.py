@@ -0,0 +1,59 @@
+import asyncio
+
+import pytest
+
+from api.services.response_cache import ResponseCache
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_concurrent_misses_share_one_computation_then_hit():
+    cache = ResponseCache(max_entries=10)
+    calls = 0
+
+    async def compute():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.01)
+        return {"n": calls}
+
+    results = await asyncio.gather(*(cache.get_or_compute("k", 60, compute) for _ in range(5)))
+    assert calls == 1 and all(r == {"n": 1} for r in results)
+    assert await cache.get_or_compute("k", 60, compute) == {"n": 1}
+    assert cache.stats == {"hits": 1, "misses": 1, "coalesced": 4, "errors": 0}
+
+
+async def test_failures_are_not_cached_and_ttl_zero_bypasses():
+    cache = ResponseCache(max_entries=10)
+    outcomes = iter([RuntimeError("redis down"), "ok"])
+
+    async def compute():
+        outcome = next(outcomes)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+    with pytest.raises(RuntimeError):
+        await cache.get_or_compute("k", 60, compute)
+    assert await cache.get_or_compute("k", 60, compute) == "ok"
+    assert cache.stats["errors"] == 1
+
+    calls = 0
+
+    async def counted():
+        nonlocal calls
+        calls += 1
+        return calls
+
+    assert [await cache.get_or_compute("b", 0, counted) for _ in range(2)] == [1, 2]
+
+
+async def test_entries_are_bounded_lru():
+    cache = ResponseCache(max_entries=2)
+
+    async def value():
+        return 1
+
+    for key in ("a", "b", "a", "c"):
+        await cache.get_or_compute(key, 60, value)
+    assert list(cache._entries) == ["a", "c"]
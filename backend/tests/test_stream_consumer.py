@@ -0,0 +1,44 @@
+import pytest
+
+from api.core.config import settings
+from api.models.schemas import TelemetryEvent
+from api.services import ingest_stream
+from api.workers import stream_consumer
+from api.workers.stream_consumer import StreamIngestWorkers
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_poison_entry_is_isolated_then_dead_lettered(redis, monkeypatch):
+    applied = []
+
+    async def apply(events):
+        if any(e["device_id"] == "bad" for e in events):
+            raise RuntimeError("poison")
+        applied.extend(e["device_id"] for e in events)
+        return {"accepted": len(events), "rejected": 0}
+
+    monkeypatch.setitem(stream_consumer.APPLY, "telemetry", apply)
+    monkeypatch.setattr(settings, "INGEST_STREAM_MAX_DELIVERIES", 2)
+    await ingest_stream.ensure_groups()
+    for device in ("d1", "bad", "d2"):
+        await ingest_stream.enqueue("telemetry", TelemetryEvent(site_id="S", device_type="t", device_id=device))
+
+    workers = StreamIngestWorkers(workers=1)
+    workers.claim_idle_ms = 0
+    stream = ingest_stream.k_ingest_stream("telemetry")
+    [(_, entries)] = await redis.xreadgroup(ingest_stream.GROUP, "c", {stream: ">"}, count=10)
+    await workers._apply("telemetry", entries)                  # batch fails, all stay pending
+    assert applied == []
+
+    await workers._reclaim("c")                                 # delivery 2: one by one
+    assert applied == ["d1", "d2"]
+    assert (await redis.xpending(stream, ingest_stream.GROUP))["pending"] == 1
+
+    await workers._reclaim("c")                                 # delivery 3 > 2: dead-lettered
+    assert (await redis.xpending(stream, ingest_stream.GROUP))["pending"] == 0
+    [(_, dead)] = await redis.xrange(ingest_stream.k_dead_letter_stream("telemetry"))
+    assert dead["source_id"] == entries[1][0]
+    assert dead["deliveries"] == "3"
+    assert workers.stats["dead_lettered"] == 1
+    assert applied == ["d1", "d2"]
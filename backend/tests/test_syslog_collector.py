@@ -0,0 +1,70 @@
+import asyncio
+import socket
+
+import pytest
+
+from api.core.config import settings
+from api.workers.syslog_collector import REUSE_PORT, SyslogCollector
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_oversized_octet_counted_frame_is_discarded_without_buffering(monkeypatch):
+    monkeypatch.setattr(settings, "LOG_INGEST_MAX_LINE_BYTES", 1000)
+    collector = SyslogCollector()
+    reader = asyncio.StreamReader()
+    size = 200_000
+
+    frame = asyncio.create_task(collector._read_frame(reader))
+    reader.feed_data(f"{size} ".encode())
+    buffered = 0
+    for _ in range(size // 10_000):
+        reader.feed_data(b"x" * 10_000)
+        await asyncio.sleep(0)
+        buffered = max(buffered, len(reader._buffer))
+    assert await frame == b""
+    assert buffered <= 10_000                       # consumed as it arrived, never the whole frame
+    assert collector.stats["oversized"] == 1
+
+    reader.feed_data(b"5 hello")
+    assert await collector._read_frame(reader) == b"hello"   # framing intact after the skip
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+@pytest.mark.skipif(not REUSE_PORT, reason="needs SO_REUSEPORT")
+async def test_several_workers_share_the_ports(monkeypatch):
+    port = free_port()
+    monkeypatch.setattr(settings, "LOG_SYSLOG_HOST", "127.0.0.1")
+    monkeypatch.setattr(settings, "LOG_SYSLOG_UDP_PORT", port)
+    monkeypatch.setattr(settings, "LOG_SYSLOG_TCP_PORT", port)
+    first, second = SyslogCollector(), SyslogCollector()
+    await first.start()
+    try:
+        await second.start()
+        await second.stop()
+    finally:
+        await first.stop()
+
+
+async def test_failed_tcp_bind_closes_the_udp_socket(monkeypatch):
+    monkeypatch.setattr(settings, "LOG_SYSLOG_HOST", "127.0.0.1")
+    with socket.socket() as taken:                  # a plain listener, no SO_REUSEPORT
+        taken.bind(("127.0.0.1", 0))
+        taken.listen()
+        port = taken.getsockname()[1]
+        monkeypatch.setattr(settings, "LOG_SYSLOG_UDP_PORT", port)
+        monkeypatch.setattr(settings, "LOG_SYSLOG_TCP_PORT", port)
+        collector = SyslogCollector()
+        with pytest.raises(OSError):
+            await collector.start()
+    assert collector._transport is None
+
+    # the UDP port is free again (the transport closes its socket on the next loop pass)
+    await asyncio.sleep(0)
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as udp:
+        udp.bind(("127.0.0.1", port))
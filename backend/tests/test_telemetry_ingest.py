@@ -0,0 +1,111 @@
+import pytest
+
+from api.core.config import settings
+from api.services import telemetry_service as ts
+
+pytestmark = pytest.mark.anyio
+
+
+def event(site="S1", dtype="turbine", device="d1", **metrics):
+    return {"site_id": site, "device_type": dtype, "device_id": device, "metrics": metrics or None}
+
+
+@pytest.mark.parametrize("lua", [True, False])
+async def test_batch_ingest_writes_presence_registries_and_snapshots(redis, monkeypatch, lua):
+    monkeypatch.setattr(settings, "REDIS_LUA_INGEST", lua)
+    result = await ts.ingest_telemetry_batch([
+        event(device="d1", rpm=1200.0),
+        event(device="d2", dtype="thermal-engine", temperature=80.5),
+        event(site="S2", device="d3"),
+        {"site_id": "S1", "device_type": "turbine"},            # missing device_id
+    ])
+
+    assert result["accepted"] == 3
+    assert result["rejected"] == 1
+    assert result["errors"][0]["index"] == 3
+    assert result["errors"][0]["field"] == "device_id"
+
+    assert await redis.zcard(ts.k_device_zset_site("S1")) == 2
+    assert await redis.zcard(ts.k_device_zset_site_type("S1", "turbine")) == 1
+    assert set(await redis.zrange(ts.k_device_sites(), 0, -1)) == {"S1", "S2"}
+    assert set(await redis.zrange(ts.k_device_site_types(), 0, -1)) == {
+        "S1|turbine", "S1|thermal-engine", "S2|turbine",
+    }
+    snap = await redis.hgetall(ts.k_device_hash("S1|turbine|d1"))
+    assert snap["m:rpm"] == "1200.0"
+    assert snap["device_id"] == "d1"
+
+
+async def test_single_and_batch_ingest_agree(redis):
+    await ts.ingest_telemetry(ts.TelemetryEvent(**event(device="d1", rpm=5.0)))
+    await ts.ingest_telemetry_batch([event(device="d2", rpm=5.0)])
+
+    page = await ts.get_active_devices("S1")
+    assert page["active_count"] == 2
+    assert {d["device_id"] for d in page["devices"]} == {"d1", "d2"}
+
+
+async def test_non_finite_metrics_are_rejected_per_event(redis):
+    result = await ts.ingest_telemetry_batch([
+        event(device="d1", rpm=1.0),
+        event(device="d2", rpm=float("nan")),
+        event(device="d3", rpm=float("inf")),
+    ])
+
+    assert result["accepted"] == 1
+    assert [e["index"] for e in result["errors"]] == [1, 2]
+    assert result["errors"][0]["field"] == "metrics.rpm"
+
+    rollups = await ts.rollup_service.get_rollups("S1", "turbine", "rpm", resolution="minute")
+    assert rollups["points"][-1]["metrics"]["rpm"]["count"] == 1
+
+
+@pytest.mark.parametrize("lua", [True, False])
+async def test_snapshot_format_toggle_drops_the_other_formats_fields(redis, monkeypatch, lua):
+    monkeypatch.setattr(settings, "REDIS_LUA_INGEST", lua)
+    monkeypatch.setattr(settings, "DEVICE_SNAPSHOT_COMPACT", True)
+    await ts.ingest_telemetry_batch([event(rpm=1.0)])
+    monkeypatch.setattr(settings, "DEVICE_SNAPSHOT_COMPACT", False)
+    await ts.ingest_telemetry_batch([event(rpm=2.0)])
+
+    assert "c" not in await redis.hkeys(ts.k_device_hash("S1|turbine|d1"))
+    [snap] = await ts.fetch_device_details(["S1|turbine|d1"])
+    assert snap["m:rpm"] == "2.0"
+
+    monkeypatch.setattr(settings, "DEVICE_SNAPSHOT_COMPACT", True)
+    await ts.ingest_telemetry_batch([event(rpm=3.0)])
+    assert await redis.hkeys(ts.k_device_hash("S1|turbine|d1")) == ["c"]
+    [snap] = await ts.fetch_device_details(["S1|turbine|d1"])
+    assert snap["m:rpm"] == "3.0"
+
+
+async def test_values_beyond_float32_fall_back_to_the_regular_format(redis, monkeypatch):
+    monkeypatch.setattr(settings, "DEVICE_SNAPSHOT_COMPACT", True)
+    result = await ts.ingest_telemetry_batch([event(rpm=1e39), event(device="d2", rpm=1.0)])
+
+    assert result["accepted"] == 2
+    assert (await redis.hgetall(ts.k_device_hash("S1|turbine|d1")))["m:rpm"] == "1e+39"
+    assert await redis.hkeys(ts.k_device_hash("S1|turbine|d2")) == ["c"]
+
+
+@pytest.mark.parametrize("lua", [True, False])
+async def test_single_event_ingest_is_one_pipeline(redis, monkeypatch, lua):
+    monkeypatch.setattr(settings, "REDIS_LUA_INGEST", lua)
+    calls = []
+    execute_pipeline = ts.redis_scripts.execute_pipeline
+
+    async def counting(r, build, **kwargs):
+        calls.append(kwargs)
+        return await execute_pipeline(r, build, **kwargs)
+
+    async def direct(*args, **kwargs):
+        raise AssertionError("unpipelined write")
+
+    monkeypatch.setattr(ts.redis_scripts, "execute_pipeline", counting)
+    monkeypatch.setattr(redis, "zadd", direct)
+    await ts.ingest_telemetry(ts.TelemetryEvent(**event(device="d1", rpm=5.0)))
+
+    assert calls == [{}]
+    monkeypatch.undo()
+    assert await redis.zscore(ts.k_device_zset_site_type("S1", "turbine"), "S1|turbine|d1")
+    assert (await redis.hgetall(ts.k_device_hash("S1|turbine|d1")))["m:rpm"] == "5.0"
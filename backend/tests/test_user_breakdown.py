@@ -0,0 +1,45 @@
+import time
+
+import pytest
+
+from api.core.config import settings
+from api.services import user_service as us
+from api.workers.presence_sweeper import reconcile_user_role_counts, sweep_presence
+
+pytestmark = pytest.mark.anyio
+
+
+def login(session, site, role=None):
+    data = {"site_id": site, "session_id": session, "user_id": f"u-{session}"}
+    if role:
+        data["role"] = role
+    return ("metric", data)
+
+
+@pytest.mark.parametrize("lua", [True, False])
+async def test_breakdown_follows_logins_role_changes_and_logouts(redis, monkeypatch, lua):
+    monkeypatch.setattr(settings, "REDIS_LUA_INGEST", lua)
+    await us.apply_session_events([
+        login("s1", "eu", "admin"),
+        login("s2", "eu"),
+        login("s3", "us", "viewer"),
+        login("s1", "eu", "viewer"),          # role change moves the session
+        login("s2", "eu", "admin"),           # first reported role replaces "unknown"
+    ])
+    assert await us.get_active_user_breakdown() == {
+        "total": 3, "by_region": {"eu": 2, "us": 1}, "by_role": {"viewer": 2, "admin": 1},
+    }
+
+    await us.apply_session_events([("logout", {"session_id": "s3"})])   # site read from the snapshot
+    assert await us.get_active_user_breakdown() == {
+        "total": 2, "by_region": {"eu": 2}, "by_role": {"viewer": 1, "admin": 1},
+    }
+
+
+async def test_sweeper_keeps_role_counters_in_step(redis):
+    await us.apply_session_events([login("s1", "eu", "admin"), login("s2", "eu", "viewer")])
+    await redis.zadd(us.k_user_zset_site("eu"), {"s1": int(time.time()) - 10 * settings.USER_PRESENCE_WINDOW_SEC})
+
+    await sweep_presence()
+    assert (await us.get_active_user_breakdown())["by_role"] == {"viewer": 1}
+    assert (await reconcile_user_role_counts())["drift"] == 0
@@ -0,0 +1,28 @@
+import pytest
+
+from api.core.config import settings
+from api.services import user_service as us
+
+pytestmark = pytest.mark.anyio
+
+
+def metric(session="s1", **fields):
+    return {"site_id": "S1", "session_id": session, "user_id": "u1", **fields}
+
+
+@pytest.mark.parametrize("lua", [True, False])
+async def test_latency_samples_count_once_across_noscript_replay(redis, monkeypatch, lua):
+    monkeypatch.setattr(settings, "REDIS_LUA_INGEST", lua)
+    await us.ingest_user_batch([metric(latency_ms=12.0)])
+    await redis.script_flush()                  # next batch hits NOSCRIPT
+    await us.ingest_user_batch([metric(session="s2", latency_ms=40.0)])
+
+    result = await us.get_latency_percentiles("S1", window_sec=60)
+    assert result["count"] == 2
+    assert (await us.get_active_users("S1"))["active_user_count"] == 2
+
+
+async def test_non_finite_latency_is_rejected(redis):
+    result = await us.ingest_user_batch([metric(latency_ms=float("nan")), metric(session="s2", cpu_pct=1.0)])
+    assert result["accepted"] == 1
+    assert result["errors"][0]["field"] == "latency_ms"
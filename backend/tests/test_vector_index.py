@@ -0,0 +1,41 @@
+import numpy as np
+
+from api.services.vector_index import IVFIndex
+
+
+def build(n=400, dim=16, nlist=4):
+    rng = np.random.default_rng(7)
+    index = IVFIndex(dim=dim)
+    index.add_batch([f"img{i}" for i in range(n)], rng.normal(size=(n, dim)))
+    index.train(nlist)
+    return index, rng
+
+
+def pending(index):
+    return sum(len(p) for p in index._ivf[2])
+
+
+def test_unchanged_updates_are_not_relisted():
+    index, _ = build()
+    vector = index._matrix[index._pos["img3"]].copy()
+    for _ in range(5):
+        index.add_batch(["img3", "img3"], np.stack([vector, vector]))
+    assert pending(index) == 0
+
+    index.add_batch(["new"], vector[None, :])
+    assert pending(index) == 1
+
+
+def test_search_returns_each_row_once_after_moves():
+    index, _ = build()
+    row = index._pos["img3"]
+    home = index._matrix[row].copy()
+    centroids = index._ivf[0]
+    away = centroids[(index._assign[row] + 1) % len(centroids)]
+    index.add_batch(["img3"], away[None, :])               # moves to another list
+    index.add_batch(["img3"], home[None, :])               # and back: listed twice there
+
+    hits = index.search(home, top_k=len(index.ids), nprobe=len(centroids))
+    rows = [r for r, _ in hits]
+    assert len(rows) == len(set(rows)) == index.size
+    assert rows[0] == row
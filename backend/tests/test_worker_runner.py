@@ -0,0 +1,67 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from api.services import redis_client
+from api.workers import runner
+
+pytestmark = pytest.mark.anyio
+
+
+def test_rate_window_forgets_old_events(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(runner.time, "monotonic", lambda: now[0])
+    rate = runner.RateWindow(window_sec=10.0)
+    rate.add(50)
+    now[0] += 5
+    rate.add(25)
+    assert rate.per_sec() == 7.5
+    now[0] += 6
+    assert rate.per_sec() == 2.5
+    now[0] += 10
+    assert rate.per_sec() == 0.0
+
+
+class FakeWorker:
+    def __init__(self):
+        self.calls = []
+
+    async def start(self):
+        self.calls.append("start")
+
+    async def stop(self):
+        self.calls.append("stop")
+
+    def metrics(self):
+        return {"lines": 3}
+
+
+async def test_standalone_run_logs_metrics_then_stops_and_closes_redis(monkeypatch):
+    worker = FakeWorker()
+    logged = []
+    closed = []
+
+    async def no_keyvault():
+        pass
+
+    async def close_redis():
+        closed.append(True)
+
+    async def extra():
+        return {"lag": 0}
+
+    monkeypatch.setattr(runner, "settings", SimpleNamespace(load_from_keyvault=no_keyvault))
+    monkeypatch.setattr(redis_client, "close_redis", close_redis)
+    monkeypatch.setattr(runner.logger, "info", logged.append)
+
+    task = asyncio.create_task(runner.run_standalone(lambda: worker, "Fake", interval_sec=0.01, extra=extra))
+    while not logged:
+        await asyncio.sleep(0.01)
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await task
+
+    assert logged[0] == "Fake metrics: {'lines': 3, 'lag': 0}"
+    assert worker.calls == ["start", "stop"]
+    assert closed == [True]